@@ -1,5 +1,6 @@
 CREATE TYPE role AS ENUM ('moderator', 'marker', 'undefined');
 CREATE TYPE status AS ENUM ('Новое', 'В работе', 'Завершено', 'На паузе');
+CREATE TYPE job_status AS ENUM ('queued', 'running', 'done', 'failed');
 
 
 CREATE TABLE users (
@@ -19,6 +20,9 @@ CREATE TABLE refresh_tokens (
     expires TIMESTAMP NOT NULL
 );
 
+CREATE INDEX refresh_tokens_user_idx ON refresh_tokens (user_id, expires);
+CREATE INDEX refresh_tokens_expires_idx ON refresh_tokens (expires);
+
 CREATE TABLE researches (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(), 
     creator_id INT NOT NULL,
@@ -51,6 +55,27 @@ CREATE TABLE tasks (
     FOREIGN KEY (user_id) REFERENCES users (id)
 );
 
+CREATE TABLE jobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    kind TEXT NOT NULL,
+    status job_status NOT NULL DEFAULT 'queued',
+    payload JSONB NOT NULL DEFAULT '{}',
+    result JSONB,
+    error TEXT,
+    progress INT NOT NULL DEFAULT 0,
+    total INT,
+    creator_id INT,
+    created_at TIMESTAMP NOT NULL DEFAULT (NOW() at time zone 'utc-3'),
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    claimed_by TEXT,
+    heartbeat_at TIMESTAMP,
+    FOREIGN KEY (creator_id) REFERENCES users (id)
+);
+
+CREATE INDEX jobs_queued_idx ON jobs (created_at) WHERE status = 'queued';
+CREATE INDEX jobs_running_idx ON jobs (heartbeat_at) WHERE status = 'running';
+
 INSERT INTO tags (name) 
 VALUES
     ('Легкие'),
@@ -33,14 +33,24 @@ class CustomHTTPBearer(HTTPBearer):
         return HTTPAuthorizationCredentials(scheme=scheme, credentials=credentials)
 
 
-def get_token(token = Depends(CustomHTTPBearer())) -> utils.JWTToken:
+# Токены с проверенной подписью: повторные запросы с тем же токеном не разбирают его заново
+verified_tokens = utils.JWTCache(config.jwt_env.CACHE_SIZE)
+
+
+def get_token(request: Request, token = Depends(CustomHTTPBearer())) -> utils.JWTToken:
     '''
-    Получаем и парсим токен из заголовка
+    Получаем и парсим токен из заголовка (один раз за запрос, проверенные токены - из кэша)
     '''
-    try:
-        jwt = utils.JWTToken(token.credentials) 
-    except ValueError:
-        raise exc.INVALID_TOKEN
+    jwt = getattr(request.state, 'jwt', None)
+    if jwt is not None and jwt.raw == token.credentials:
+        return jwt
+    jwt = verified_tokens.get(token.credentials)
+    if jwt is None:
+        try:
+            jwt = utils.JWTToken(token.credentials)
+        except ValueError:
+            raise exc.INVALID_TOKEN
+    request.state.jwt = jwt
     return jwt
     
     
@@ -48,8 +58,12 @@ def check_signature(jwt: utils.JWTToken = Depends(get_token)) -> utils.JWTToken:
     '''
     Проверяем подпись токена
     '''
+    if jwt.verified:
+        return jwt
     if not jwt.verify(config.jwt_env.SECRET):
         raise exc.INVALID_TOKEN
+    jwt.verified = True
+    verified_tokens.put(jwt)
     return jwt
 
 
@@ -1,10 +1,14 @@
 from .jwt import (
     create_refresh_token,
     delete_refresh_token,
+    delete_expired_refresh_tokens,
+    rotate_refresh_token,
+    trim_refresh_tokens,
     update_refresh_token,
     verify_refresh_token
 )
 from .user import (
     create_user,
-    get_user_by_login
+    get_user_by_login,
+    update_password
 )
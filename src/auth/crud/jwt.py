@@ -10,6 +10,18 @@ async def create_refresh_token(con: asyncpg.Connection, user_id: int, token: str
     await con.execute(query, user_id, token, expires)
     
     
+async def trim_refresh_tokens(con: asyncpg.Connection, user_id: int, keep: int) -> None:
+    '''
+    Удаление самых старых токенов пользователя сверх keep (по сроку действия)
+    '''
+    query = '''
+    DELETE FROM refresh_tokens WHERE token IN (
+        SELECT token FROM refresh_tokens WHERE user_id=$1 ORDER BY expires DESC OFFSET $2
+    );
+    '''
+    await con.execute(query, user_id, keep)
+
+
 async def update_refresh_token(con: asyncpg.Connection, token: uuid.UUID, new_token: uuid.UUID, new_expires: dt.datetime) -> None:
     query = '''
     UPDATE refresh_tokens SET token=$2, expires=$3 WHERE token=$1;
@@ -17,6 +29,17 @@ async def update_refresh_token(con: asyncpg.Connection, token: uuid.UUID, new_to
     await con.execute(query, token, new_token, new_expires)
     
     
+async def rotate_refresh_token(con: asyncpg.Connection, user_id: int, token: uuid.UUID,
+                               new_token: uuid.UUID, new_expires: dt.datetime) -> bool:
+    '''
+    Замена действующего токена пользователя новым одним запросом (проверка и обновление атомарны)
+    '''
+    query = '''
+    UPDATE refresh_tokens SET token=$3, expires=$4 WHERE user_id=$1 AND token=$2 AND expires>=NOW() RETURNING token;
+    '''
+    return await con.fetchval(query, user_id, token, new_token, new_expires) is not None
+
+
 async def verify_refresh_token(con: asyncpg.Connection, user_id: int, token: uuid.UUID) -> bool:
     query = '''
     SELECT EXISTS (SELECT 1 FROM refresh_tokens WHERE user_id=$1 AND token=$2 AND expires>=NOW());
@@ -29,3 +52,16 @@ async def delete_refresh_token(con: asyncpg.Connection, token: uuid.UUID) -> Non
     DELETE FROM refresh_tokens WHERE token=$1;
     '''
     await con.execute(query, token)
+
+
+async def delete_expired_refresh_tokens(con: asyncpg.Connection, limit: int) -> int:
+    '''
+    Удаление не более limit истекших токенов, возвращает количество удаленных
+    '''
+    query = '''
+    DELETE FROM refresh_tokens WHERE token IN (
+        SELECT token FROM refresh_tokens WHERE expires<NOW() LIMIT $1 FOR UPDATE SKIP LOCKED
+    );
+    '''
+    result = await con.execute(query, limit)
+    return int(result.split()[-1])
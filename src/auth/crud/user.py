@@ -15,3 +15,10 @@ async def get_user_by_login(con: asyncpg.Connection, login: str) -> dto.User:
     '''
     res = await con.fetchrow(query, login)
     return None if res is None else dto.User(**res)
+
+
+async def update_password(con: asyncpg.Connection, user_id: int, hashed_password: str) -> None:
+    query = '''
+    UPDATE users SET hashed_password=$2 WHERE id=$1;
+    '''
+    await con.execute(query, user_id, hashed_password)
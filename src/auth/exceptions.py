@@ -1,3 +1,4 @@
+from src import config
 from src.utils.custom import CustomHTTPException
 
 
@@ -5,3 +6,9 @@ INVALID_CLIENT = CustomHTTPException(400, 'invalid_client')
 INVALID_TOKEN = CustomHTTPException(401, 'invalid_token')
 TOKEN_EXPIRED = CustomHTTPException(401, 'token_expired')
 USER_ALREARY_EXISIS = CustomHTTPException(409, 'user_already_exists')
+# Отказы при перегрузке хэширования паролей: заголовки заданы при создании,
+# чтобы Retry-After не попадал в общие исключения (SERVICE_UNAVAILABLE)
+_RETRY_AFTER = {'Retry-After': str(config.password_env.RETRY_AFTER)}
+LOGIN_IN_PROGRESS = CustomHTTPException(429, 'too_many_requests', 'login is already in progress', headers=_RETRY_AFTER)
+LOGIN_OVERLOADED = CustomHTTPException(503, 'service_unavailable', 'too many logins, try again later',
+                                       headers=_RETRY_AFTER)
@@ -68,13 +68,11 @@ async def refresh(response: Response,
     user_id = access_token.payload.get('sub')
     role = access_token.payload.get('role')
     is_superuser = access_token.payload.get('is_superuser')
-    # проверяем в бд принадлежит ли refresh token данному пользователю
-    await auth.verify_refresh_token(con, user_id, body.refresh_token)
     # генерируем новые токены
     new_access_token = auth.generate_jwt_access(user_id, role, is_superuser)
     new_refresh_token = auth.generate_jwt_refresh()
-    # обновляем токен в бд
-    await auth.update_refresh_token(con, body.refresh_token, new_refresh_token)
+    # заменяем токен в бд, если он принадлежит данному пользователю и действует
+    await auth.rotate_refresh_token(con, user_id, body.refresh_token, new_refresh_token)
     return sch.JWTTokensResponse(access_token=new_access_token, 
                                  refresh_token=new_refresh_token, 
                                  expires_in=config.JWT_AT_LIFETIME.seconds)
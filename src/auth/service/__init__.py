@@ -7,6 +7,8 @@ from .jwt import (
     generate_jwt_refresh,
     create_refresh_token,
     verify_refresh_token,
+    rotate_refresh_token,
     update_refresh_token,
-    delete_refresh_token
+    delete_refresh_token,
+    refresh_token_sweeper
 )
@@ -1,4 +1,7 @@
 import datetime as dt
+import typing as tp
+import asyncio
+import traceback
 import uuid
 import asyncpg
 
@@ -8,10 +11,18 @@ from src.auth import utils
 from src.auth import exceptions as exc
 from src.utils.crypto import generate_uuid
 from src.utils.converters import _dt
+from src.database import database
 
 
 async def create_refresh_token(con: asyncpg.Connection, user_id: int, token: uuid.UUID) -> None:
-    await crud.create_refresh_token(con, user_id, token, dt.datetime.now() + config.JWT_RT_LIFETIME)
+    '''
+    Новый refresh token пользователя. При ограничении JWT_RT_MAX_PER_USER
+    самые старые сессии пользователя сверх лимита удаляются
+    '''
+    async with con.transaction():
+        await crud.create_refresh_token(con, user_id, token, dt.datetime.now() + config.JWT_RT_LIFETIME)
+        if config.jwt_env.RT_MAX_PER_USER > 0:
+            await crud.trim_refresh_tokens(con, user_id, config.jwt_env.RT_MAX_PER_USER)
 
 
 def generate_jwt_refresh() -> uuid.UUID:
@@ -36,6 +47,15 @@ async def verify_refresh_token(con: asyncpg.Connection, user_id: int, token: uui
         raise exc.INVALID_TOKEN
 
 
+async def rotate_refresh_token(con: asyncpg.Connection, user_id: int, token: uuid.UUID, new_token: uuid.UUID) -> None:
+    '''
+    Проверка и замена refresh token одним запросом: токен нельзя использовать повторно
+    '''
+    new_expires = dt.datetime.now() + config.JWT_RT_LIFETIME
+    if not await crud.rotate_refresh_token(con, user_id, token, new_token, new_expires):
+        raise exc.INVALID_TOKEN
+
+
 async def update_refresh_token(con: asyncpg.Connection, token: uuid.UUID, new_token: uuid.UUID) -> None:
     new_expires = dt.datetime.now() + config.JWT_RT_LIFETIME
     await crud.update_refresh_token(con, token, new_token, new_expires)
@@ -43,4 +63,48 @@ async def update_refresh_token(con: asyncpg.Connection, token: uuid.UUID, new_to
    
 async def delete_refresh_token(con: asyncpg.Connection, token: uuid.UUID):
     await crud.delete_refresh_token(con, token)
-    
\ No newline at end of file
+
+
+class RefreshTokenSweeper:
+    '''
+    Периодическое удаление истекших refresh token пакетами по RT_SWEEP_BATCH_SIZE строк,
+    чтобы не держать длинных блокировок таблицы
+    '''
+    def __init__(self, interval: float = config.jwt_env.RT_SWEEP_INTERVAL,
+                 batch_size: int = config.jwt_env.RT_SWEEP_BATCH_SIZE) -> None:
+        self._interval = interval
+        self._batch_size = batch_size
+        self._task: tp.Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def sweep(self) -> int:
+        deleted = 0
+        while True:
+            async with database.acquire() as con:
+                count = await crud.delete_expired_refresh_tokens(con, self._batch_size)
+            deleted += count
+            if count < self._batch_size:
+                return deleted
+            # между пакетами даем выполниться остальным запросам
+            await asyncio.sleep(0)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except (asyncpg.PostgresError, OSError):
+                traceback.print_exc()
+            await asyncio.sleep(self._interval)
+
+
+refresh_token_sweeper = RefreshTokenSweeper()
@@ -1,14 +1,46 @@
 import typing as tp
+import contextlib
 import asyncpg
 
+from src import config
 from src.auth import crud
 from src.auth import utils
 from src.auth.dto import User
 from src.auth import exceptions as exc
+from src.utils.executors import password_executor, run_in_executor
+
+
+class PasswordHashingLimiter:
+    '''
+    Ограничение нагрузки на пул хэширования паролей: одновременно не более одной проверки
+    на логин и не более max_pending проверок в пуле (выполняемых и ожидающих).
+    Лишние попытки входа сразу отклоняются с Retry-After вместо накопления в очереди
+    '''
+    def __init__(self, max_pending: int = config.password_env.MAX_PENDING) -> None:
+        self._max_pending = max_pending
+        self._pending = 0
+        self._logins: tp.Set[str] = set()
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, login: str) -> tp.AsyncIterator[None]:
+        if login in self._logins:
+            raise exc.LOGIN_IN_PROGRESS
+        if self._pending >= self._max_pending:
+            raise exc.LOGIN_OVERLOADED
+        self._pending += 1
+        self._logins.add(login)
+        try:
+            yield
+        finally:
+            self._pending -= 1
+            self._logins.discard(login)
+
+
+password_limiter = PasswordHashingLimiter()
 
 
 async def create_user(con: asyncpg.Connection, login: str, password: str) -> None:
-    hashed_password = utils.PasswordHasher.hash(password)
+    hashed_password = await run_in_executor(password_executor, utils.PasswordHasher.hash, password)
     
     try:
         await crud.create_user(con, login, hashed_password)
@@ -22,6 +54,12 @@ async def verify_user(con: asyncpg.Connection, login: str, password: str) -> tp.
     if user is None:
         raise exc.INVALID_CLIENT
     
-    if not utils.PasswordHasher.verify(password, user.hashed_password):
-        raise exc.INVALID_CLIENT
+    async with password_limiter.acquire(login):
+        is_valid = await run_in_executor(password_executor, utils.PasswordHasher.verify, password, user.hashed_password)
+        if not is_valid:
+            raise exc.INVALID_CLIENT
+        # пароль известен только при входе: хэш старого формата или с другим числом итераций пересчитывается
+        if utils.PasswordHasher.needs_rehash(user.hashed_password):
+            hashed_password = await run_in_executor(password_executor, utils.PasswordHasher.hash, password)
+            await crud.update_password(con, user.id, hashed_password)
     return user
@@ -1,4 +1,5 @@
 from .utils import (
     JWTToken,
+    JWTCache,
     PasswordHasher
     )
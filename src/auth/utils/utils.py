@@ -1,23 +1,31 @@
-from functools import lru_cache
 import typing as tp
+import time
 
 from src.utils.crypto import (
     pbkdf2_hmac,
     generate_random_string,
     compare_strings,
+    compare_bytes,
     hs256
 )
 from src.utils.converters import (
     _str,
     _b64
 )
+from src.utils.cache import LRUCache
+from src import config
 
 
 class PasswordHasher:
     '''
-    Класс, содержащий методы для реализации хэширования паролей
+    Класс, содержащий методы для реализации хэширования паролей.
+    Формат: pbkdf2_sha512${число итераций}${соль}{хэш}; хэши старого формата ({соль}{хэш})
+    посчитаны с _legacy_iterations итерациями и проверяются как раньше
     '''
     _salt_len = 32
+    _scheme = 'pbkdf2_sha512'
+    _legacy_iterations = 50_000
+    iterations = config.password_env.ITERATIONS
     
     @classmethod
     def hash(cls, password) -> str:
@@ -25,19 +33,34 @@ class PasswordHasher:
         Генерация хэша с солью для заданного паспорта
         '''
         salt = cls._gen_salt()
-        salted_hash = cls._gen_hash_with_salt(password, salt)
-        return cls._join_salt_to_hash(salted_hash, salt)
+        salted_hash = cls._gen_hash_with_salt(password, salt, cls.iterations)
+        return f'{cls._scheme}${cls.iterations}${cls._join_salt_to_hash(salted_hash, salt)}'
         
     @classmethod
-    def verify(cls, password_for_verify, salted_hash_with_salt):
+    def verify(cls, password_for_verify, hashed_password):
         '''
         Проверка соответствует ли пароль (строка) хэшированному паролю
         '''
+        iterations, salted_hash_with_salt = cls._split_params(hashed_password)
         salt, _ = cls._split_hash_with_salt(salted_hash_with_salt)
-        salted_hash_for_verify = cls._gen_hash_with_salt(password_for_verify, salt)
+        salted_hash_for_verify = cls._gen_hash_with_salt(password_for_verify, salt, iterations)
         salted_hash_with_salt_for_verify = cls._join_salt_to_hash(salted_hash_for_verify, salt)
         return compare_strings(salted_hash_with_salt_for_verify, salted_hash_with_salt)
+
+    @classmethod
+    def needs_rehash(cls, hashed_password) -> bool:
+        '''
+        Хэш посчитан в старом формате или с другим числом итераций
+        '''
+        iterations, _ = cls._split_params(hashed_password)
+        return not hashed_password.startswith(f'{cls._scheme}$') or iterations != cls.iterations
         
+    @classmethod
+    def _split_params(cls, hashed_password) -> tp.Tuple[int, str]:
+        if hashed_password.startswith(f'{cls._scheme}$'):
+            _, iterations, salted_hash_with_salt = hashed_password.split('$', 2)
+            return int(iterations), salted_hash_with_salt
+        return cls._legacy_iterations, hashed_password
         
     @staticmethod
     def _join_salt_to_hash(hash, salt) -> str:
@@ -52,8 +75,8 @@ class PasswordHasher:
         return generate_random_string(cls._salt_len // 2)
     
     @staticmethod
-    def _gen_hash_with_salt(string: str, salt: str) -> str:
-        return pbkdf2_hmac(string, salt)
+    def _gen_hash_with_salt(string: str, salt: str, iterations: int) -> str:
+        return pbkdf2_hmac(string, salt, iterations=iterations)
     
     
 class BaseJWTToken:
@@ -61,6 +84,11 @@ class BaseJWTToken:
         self.header = {}
         self.payload = {}
         self.signature = b''
+        # исходная строка токена и признак проверенной подписи (см. JWTCache)
+        self.raw = token
+        self.verified = False
+        # подписанная часть токена (header.payload) в том виде, в котором она пришла
+        self._signing_input: tp.Optional[bytes] = None
         
         if token is not None:
             try:
@@ -72,19 +100,25 @@ class BaseJWTToken:
         '''
         Генерация подписи на основе имеющихся в объекте данных
         '''
+        self._signing_input = None
         self.signature = self._gen_sign(secret)
 
     def verify(self, secret: str) -> bool:
         '''
-        Проверка, соответствуют ли данные объекта с имеющейся подписью
+        Проверка, соответствуют ли данные объекта с имеющейся подписью.
+        Для разобранного токена подписывается исходная часть header.payload без повторной сериализации,
+        подписи сравниваются за постоянное время
         '''
         correct_sign = self._gen_sign(secret)
-        return correct_sign == self.signature
+        return compare_bytes(correct_sign, self.signature)
     
     def _gen_sign(self, secret: str) -> bytes:
         '''
         Генерация подписи
         '''
+        if self._signing_input is not None:
+            return hs256(self._signing_input, secret)
+
         header_b64 = _b64.from_dict(self.header)
         payload_b64 = _b64.from_dict(self.payload)
         
@@ -92,12 +126,12 @@ class BaseJWTToken:
         
         return hs256(unsigned_token, secret)
     
-    @lru_cache(maxsize=128)
     def _parse(self, token: str):
         '''
         Токен в виде строки преобразеутся в объект
         '''
         header_b64, payload_b64, signature_b64 = token.split('.')
+        self._signing_input = _str.to_bytes(f'{header_b64}.{payload_b64}')
         self.header = _b64.to_dict(header_b64)
         self.payload = _b64.to_dict(payload_b64)
         self.signature = _b64.to_bytes(_str.to_bytes(signature_b64))
@@ -130,3 +164,26 @@ class JWTToken(BaseJWTToken):
         return self.payload['is_superuser']
     
     
+
+
+class JWTCache:
+    '''
+    Кэш токенов с проверенной подписью на уровне процесса: строка токена -> JWTToken.
+    Запись действительна до истечения срока действия токена, после чего удаляется при обращении.
+    Объекты токенов из кэша общие для запросов и не должны изменяться
+    '''
+    def __init__(self, maxsize: int) -> None:
+        self._tokens = LRUCache(maxsize=maxsize)
+
+    def get(self, token: str) -> tp.Optional[JWTToken]:
+        jwt = self._tokens.get(token)
+        if jwt is None:
+            return None
+        if jwt.exp <= time.time():
+            self._tokens.pop(token)
+            return None
+        return jwt
+
+    def put(self, jwt: JWTToken) -> None:
+        if jwt.raw is not None and jwt.verified and jwt.payload.get('exp', 0) > time.time():
+            self._tokens.put(jwt.raw, jwt)
@@ -1,6 +1,7 @@
 from pydantic import BaseSettings
 import datetime as dt
 import pathlib
+import os
 
 
 class BaseEnv(BaseSettings):
@@ -25,13 +26,113 @@ class PostgresEnv(BaseEnv):
 
 class JWTEnv(BaseEnv):
     SECRET: str
+    CACHE_SIZE: int = 10_000
+    RT_MAX_PER_USER: int = 0
+    RT_SWEEP_INTERVAL: float = 3600.0
+    RT_SWEEP_BATCH_SIZE: int = 1000
 
     class Config:
         env_prefix = 'JWT_'
     
 
+class PasswordEnv(BaseEnv):
+    """
+    Настройки хэширования паролей.
+    """
+    ITERATIONS: int = 50_000
+    WORKERS: int = 2
+    MAX_PENDING: int = 16
+    RETRY_AFTER: int = 1
+
+    class Config:
+        env_prefix = 'PASSWORD_'
+
+
+class IngestEnv(BaseEnv):
+    """
+    Настройки загрузки исследований.
+    """
+    MAX_CONCURRENCY: int = 2
+    WORKERS: int = 8
+    CPU_WORKERS: int = os.cpu_count() or 1
+    CHUNK_SIZE: int = 1024 * 1024
+    BATCH_SIZE: int = 16
+    DEPERSONALIZATION_PROFILE: str = 'minimal'
+
+    class Config:
+        env_prefix = 'INGEST_'
+
+
+class RenderEnv(BaseEnv):
+    """
+    Настройки отрисовки срезов и кэша изображений.
+    """
+    MEMORY_CACHE_BYTES: int = 256 * 1024 * 1024
+    DISK_CACHE_FILES: int = 4096
+    DEFAULT_QUALITY: int = 85
+
+    class Config:
+        env_prefix = 'RENDER_'
+
+
+class TileEnv(BaseEnv):
+    """
+    Настройки пирамиды тайлов.
+    """
+    TILE_SIZE: int = 256
+    # Формат и качество тайлов фиксированы: пирамида строится только для предустановленных окон
+    FORMAT: str = 'jpeg'
+    QUALITY: int = 85
+
+    class Config:
+        env_prefix = 'TILES_'
+
+
+class JobsEnv(BaseEnv):
+    """
+    Настройки фоновых задач.
+    """
+    WORKERS: int = 2
+    POLL_INTERVAL: float = 1.0
+    PROGRESS_INTERVAL: float = 1.0
+    # Выполняемые задачи обработчика отмечаются раз в HEARTBEAT_INTERVAL секунд;
+    # задачи без отметки дольше HEARTBEAT_TIMEOUT секунд считаются прерванными
+    HEARTBEAT_INTERVAL: float = 10.0
+    HEARTBEAT_TIMEOUT: float = 60.0
+
+    class Config:
+        env_prefix = 'JOBS_'
+
+
+class GenerationEnv(BaseEnv):
+    """
+    Настройки генерации патологий.
+    """
+    MODELS_PATH: pathlib.Path = pathlib.Path('.').absolute().joinpath('models')
+    IMAGE_SIZE: int = 256
+    TILE_OVERLAP: int = 64
+    MAX_BATCH_SIZE: int = 8
+    MAX_WAIT_MS: int = 20
+    THREADS: int = os.cpu_count() or 1
+    RUNTIME: str = 'auto'
+    WINDOW_CENTER: float = -600.0
+    WINDOW_WIDTH: float = 1500.0
+    # Полоса (HU) за границами окна, на которой результат генерации переходит в исходный срез
+    WINDOW_BLEND: float = 100.0
+    CACHE_BYTES: int = 1024 * 1024 * 1024
+
+    class Config:
+        env_prefix = 'GENERATION_'
+
+
 postgres_env = PostgresEnv()
 jwt_env = JWTEnv()
+password_env = PasswordEnv()
+ingest_env = IngestEnv()
+render_env = RenderEnv()
+tile_env = TileEnv()
+jobs_env = JobsEnv()
+generation_env = GenerationEnv()
 JWT_AT_LIFETIME = dt.timedelta(minutes=59)
 JWT_RT_LIFETIME = dt.timedelta(days=7)
 JWT_AT_TYPE = 'bearer'
@@ -42,3 +143,5 @@ RESEARCHES_FOLDER = 'researches'
 RESEARCHES_PATH = STORAGE_PATH.joinpath(RESEARCHES_FOLDER)
 TEMPORARY_CT_STORAGE_FOLDER = 'temp'
 TEMPORARY_CT_STORAGE_PATH = STORAGE_PATH.joinpath(TEMPORARY_CT_STORAGE_FOLDER)
+GENERATION_CACHE_FOLDER = 'generation_cache'
+GENERATION_CACHE_PATH = STORAGE_PATH.joinpath(GENERATION_CACHE_FOLDER)
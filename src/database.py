@@ -1,7 +1,11 @@
 from abc import ABCMeta, abstractmethod
 import typing as tp
+import contextlib
+import time
 import asyncpg
 
+from src.utils import metrics
+
 
 def get_postgres_dsn(user: str, password: str, host: str, port: str, db: str,
                      sa_driver: str = None, sa_dialect: str = None):
@@ -42,6 +46,9 @@ class ASPGDatabase(IDatabase):
         Создание асинхронного пула подключений к бд.
         """
         self.pool = await asyncpg.create_pool(get_postgres_dsn(user, password, host, port, db), timeout=5)
+        metrics.DB_POOL_SIZE.set_function(self.pool.get_size)
+        metrics.DB_POOL_IDLE.set_function(self.pool.get_idle_size)
+        metrics.DB_POOL_MAX_SIZE.set_function(self.pool.get_max_size)
 
     async def shutdown(self) -> None:
         """
@@ -53,9 +60,19 @@ class ASPGDatabase(IDatabase):
         """
         Получение подключения из пула.
         """
+        async with self.acquire() as con:
+            yield con
+
+    @contextlib.asynccontextmanager
+    async def acquire(self) -> tp.AsyncIterator[asyncpg.Connection]:
+        """
+        Подключение из пула с учетом времени ожидания в метриках.
+        """
         if self.pool is None:
             raise NotImplementedError('DB pool must be created first')
+        start = time.perf_counter()
         con = await self.pool.acquire()
+        metrics.DB_POOL_ACQUIRE.observe(time.perf_counter() - start)
         try:
             yield con
         finally:
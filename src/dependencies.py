@@ -1,5 +1,8 @@
+import typing as tp
 from src.database import database
-from fastapi import Depends
+from src import config
+from src.schemas import RenderParams, WindowPreset, ImageFormat
+from fastapi import Depends, Query
 import asyncpg
 
 
@@ -10,3 +13,25 @@ def get_db_connection(con: asyncpg.Connection = Depends(database.connection)):
     :return:
     """
     return con
+
+
+def get_render_params(preset: WindowPreset = Query(default=WindowPreset.default),
+                      center: tp.Optional[float] = Query(default=None),
+                      width: tp.Optional[float] = Query(default=None, gt=0),
+                      size: tp.Optional[int] = Query(default=None, ge=16, le=4096),
+                      format: ImageFormat = Query(default=ImageFormat.jpeg),
+                      quality: int = Query(default=config.render_env.DEFAULT_QUALITY, ge=1, le=100)) -> RenderParams:
+    """
+    Параметры отрисовки среза из строки запроса
+    """
+    return RenderParams(preset=preset, center=center, width=width, size=size, format=format, quality=quality)
+
+
+def get_tile_params(preset: WindowPreset = Query(default=WindowPreset.default)) -> RenderParams:
+    """
+    Параметры отрисовки тайлов: только предустановленное окно, формат и качество из настроек,
+    чтобы количество пирамид на срез было ограничено
+    """
+    return RenderParams(preset=preset,
+                        format=ImageFormat(config.tile_env.FORMAT),
+                        quality=config.tile_env.QUALITY)
@@ -1,5 +1,9 @@
 from src.database import database
 from src.config import postgres_env
+from src.utils import executors
+from src.jobs.service import workers
+from src.auth.service import refresh_token_sweeper
+from src.patologies_generation.utils.ai.inference import inference_service
 
 
 async def on_startup() -> None:
@@ -11,6 +15,9 @@ async def on_startup() -> None:
                            postgres_env.HOST, 
                            postgres_env.PORT, 
                            postgres_env.DB)
+    await workers.start()
+    refresh_token_sweeper.start()
+    inference_service.start()
     print('App is running!')
 
 
@@ -18,4 +25,8 @@ async def on_shutdown() -> None:
     """
     Действия, выполняемые при завершении работы приложения.
     """
+    await workers.stop()
+    await refresh_token_sweeper.stop()
+    inference_service.stop()
+    executors.shutdown()
     print('App is shutting down!')
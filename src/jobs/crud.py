@@ -0,0 +1,87 @@
+import json
+import uuid
+import typing as tp
+
+import asyncpg
+
+
+async def create_job(con: asyncpg.Connection, kind: str, payload: tp.Dict[str, tp.Any], creator_id: tp.Optional[int]) -> str:
+    '''
+    Постановка задачи в очередь
+    '''
+    query = '''
+    INSERT INTO jobs (kind, payload, creator_id) VALUES ($1, $2::jsonb, $3) RETURNING id;
+    '''
+    return str(await con.fetchval(query, kind, json.dumps(payload), creator_id))
+
+
+async def get_job(con: asyncpg.Connection, job_id: tp.Union[str, uuid.UUID]) -> tp.Optional[asyncpg.Record]:
+    query = '''
+    SELECT * FROM jobs WHERE id = $1;
+    '''
+    return await con.fetchrow(query, job_id)
+
+
+async def claim_job(con: asyncpg.Connection, kinds: tp.List[str], worker_id: str) -> tp.Optional[asyncpg.Record]:
+    '''
+    Захват самой старой задачи из очереди. Строка блокируется с SKIP LOCKED,
+    поэтому несколько обработчиков (и процессов) не получат одну и ту же задачу
+    '''
+    query = '''
+    UPDATE jobs SET status = 'running', started_at = (NOW() at time zone 'utc-3'),
+                    claimed_by = $2, heartbeat_at = (NOW() at time zone 'utc-3')
+    WHERE id = (
+        SELECT id FROM jobs
+        WHERE status = 'queued' AND kind = ANY($1::text[])
+        ORDER BY created_at
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING *;
+    '''
+    return await con.fetchrow(query, kinds, worker_id)
+
+
+async def touch_jobs(con: asyncpg.Connection, worker_id: str, job_ids: tp.List[str]) -> None:
+    '''
+    Отметка о том, что задачи обработчика еще выполняются
+    '''
+    query = '''
+    UPDATE jobs SET heartbeat_at = (NOW() at time zone 'utc-3')
+    WHERE id = ANY($2::uuid[]) AND claimed_by = $1 AND status = 'running';
+    '''
+    await con.execute(query, worker_id, job_ids)
+
+
+async def update_progress(con: asyncpg.Connection, job_id: tp.Union[str, uuid.UUID], progress: int, total: tp.Optional[int]) -> None:
+    query = '''
+    UPDATE jobs SET progress = $2, total = $3 WHERE id = $1 AND status = 'running';
+    '''
+    await con.execute(query, job_id, progress, total)
+
+
+async def finish_job(con: asyncpg.Connection, job_id: tp.Union[str, uuid.UUID], result: tp.Optional[tp.Dict[str, tp.Any]]) -> None:
+    query = '''
+    UPDATE jobs SET status = 'done', result = $2::jsonb, finished_at = (NOW() at time zone 'utc-3') WHERE id = $1;
+    '''
+    await con.execute(query, job_id, json.dumps(result))
+
+
+async def fail_job(con: asyncpg.Connection, job_id: tp.Union[str, uuid.UUID], error: str) -> None:
+    query = '''
+    UPDATE jobs SET status = 'failed', error = $2, finished_at = (NOW() at time zone 'utc-3') WHERE id = $1;
+    '''
+    await con.execute(query, job_id, error)
+
+
+async def fail_interrupted_jobs(con: asyncpg.Connection, kinds: tp.List[str], timeout: float) -> None:
+    '''
+    Задачи, обработчик которых не отмечался дольше timeout секунд (процесс остановлен или завис),
+    помечаются как невыполненные. Задачи живых обработчиков других процессов не затрагиваются
+    '''
+    query = '''
+    UPDATE jobs SET status = 'failed', error = 'interrupted', finished_at = (NOW() at time zone 'utc-3')
+    WHERE status = 'running' AND kind = ANY($1::text[])
+      AND (heartbeat_at IS NULL OR heartbeat_at < (NOW() at time zone 'utc-3') - make_interval(secs => $2));
+    '''
+    await con.execute(query, kinds, timeout)
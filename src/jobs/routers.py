@@ -0,0 +1,20 @@
+import uuid
+import asyncpg
+from fastapi import APIRouter, Depends
+
+from src.auth import backends
+from src.dependencies import get_db_connection
+from src.schemas import Error
+from src.jobs import service
+import src.jobs.schemas as sch
+
+
+router = APIRouter(prefix='/api/v1', tags=['jobs'])
+router.responses = {403: {'description': 'Access denied', 'model': Error},
+                    401: {'description': 'Token expired', 'model': Error},
+                    404: {'description': 'Job not found', 'model': Error}}
+
+
+@router.get('/jobs/{job_id}', dependencies=[Depends(backends.jwt_auth)], response_model=sch.Job)
+async def get_job(job_id: uuid.UUID, con: asyncpg.Connection = Depends(get_db_connection)):
+    return await service.get_job(con, job_id)
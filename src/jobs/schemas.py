@@ -0,0 +1,25 @@
+import pydantic as pd
+import datetime as dt
+import uuid
+import typing as tp
+from enum import Enum
+
+
+class JobStatus(str, Enum):
+    queued = 'queued'
+    running = 'running'
+    done = 'done'
+    failed = 'failed'
+
+
+class Job(pd.BaseModel):
+    id: tp.Union[str, uuid.UUID]
+    kind: str
+    status: JobStatus
+    progress: int
+    total: tp.Optional[int]
+    result: tp.Optional[tp.Dict[str, tp.Any]]
+    error: tp.Optional[str]
+    created_at: dt.datetime
+    started_at: tp.Optional[dt.datetime]
+    finished_at: tp.Optional[dt.datetime]
@@ -0,0 +1,197 @@
+import json
+import typing as tp
+import asyncio
+import traceback
+import socket
+import uuid
+import os
+
+import asyncpg
+
+from src import config
+from src import exceptions as exc
+from src.database import database
+from src.jobs import crud
+from src.jobs import schemas as sch
+
+
+JobPayload = tp.Dict[str, tp.Any]
+JobResult = tp.Optional[tp.Dict[str, tp.Any]]
+ProgressCallback = tp.Callable[[int, int], None]
+JobHandler = tp.Callable[[JobPayload, ProgressCallback], tp.Awaitable[JobResult]]
+
+# Обработчики задач по типу задачи
+_handlers: tp.Dict[str, JobHandler] = {}
+
+
+class JobError(Exception):
+    '''
+    Ожидаемая ошибка выполнения задачи: текст сохраняется в задаче без трассировки
+    '''
+
+
+def register_handler(kind: str) -> tp.Callable[[JobHandler], JobHandler]:
+    '''
+    Регистрация обработчика задач заданного типа
+    '''
+    def decorator(handler: JobHandler) -> JobHandler:
+        _handlers[kind] = handler
+        return handler
+    return decorator
+
+
+async def enqueue(con: asyncpg.Connection, kind: str, payload: JobPayload, creator_id: tp.Optional[int] = None) -> str:
+    if kind not in _handlers:
+        raise ValueError(f'Unknown job kind: {kind}')
+    job_id = await crud.create_job(con, kind, payload, creator_id)
+    workers.notify()
+    return job_id
+
+
+async def get_job(con: asyncpg.Connection, job_id: tp.Union[str, uuid.UUID]) -> sch.Job:
+    row = await crud.get_job(con, job_id)
+    if row is None:
+        raise exc.FILE_NOT_FOUND(error_description='job was not found')
+    job = dict(row)
+    job['result'] = json.loads(job['result']) if job['result'] is not None else None
+    return sch.Job.parse_obj(job)
+
+
+class JobProgress:
+    '''
+    Прогресс выполняемой задачи. Обработчик сообщает прогресс синхронно и сколь угодно часто,
+    в базу данных значение записывается не чаще, чем раз в PROGRESS_INTERVAL секунд
+    '''
+    def __init__(self, job_id: str) -> None:
+        self._job_id = job_id
+        self._done = 0
+        self._total: tp.Optional[int] = None
+        self._saved: tp.Tuple[int, tp.Optional[int]] = (0, None)
+
+    def __call__(self, done: int, total: int) -> None:
+        self._done, self._total = done, total
+
+    async def save(self) -> None:
+        current = (self._done, self._total)
+        if current == self._saved:
+            return
+        async with database.acquire() as con:
+            await crud.update_progress(con, self._job_id, *current)
+        self._saved = current
+
+    async def run(self, interval: float = config.jobs_env.PROGRESS_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.save()
+            except (asyncpg.PostgresError, OSError):
+                traceback.print_exc()
+
+
+class JobWorkers:
+    '''
+    Пул обработчиков фоновых задач внутри процесса приложения.
+    Очередь хранится в таблице jobs: обработчик захватывает задачу (FOR UPDATE SKIP LOCKED),
+    выполняет ее и записывает результат или ошибку. Новые задачи будят обработчики сразу,
+    задачи, поставленные другими процессами, подхватываются опросом раз в POLL_INTERVAL секунд.
+    Захваченные задачи помечаются идентификатором процесса, который периодически отмечает их как
+    выполняемые; задачи без отметки дольше HEARTBEAT_TIMEOUT секунд любой процесс считает прерванными
+    '''
+    def __init__(self, count: int = config.jobs_env.WORKERS,
+                 poll_interval: float = config.jobs_env.POLL_INTERVAL,
+                 heartbeat_interval: float = config.jobs_env.HEARTBEAT_INTERVAL,
+                 heartbeat_timeout: float = config.jobs_env.HEARTBEAT_TIMEOUT) -> None:
+        self._count = count
+        self._poll_interval = poll_interval
+        self._heartbeat_interval = heartbeat_interval
+        self._heartbeat_timeout = heartbeat_timeout
+        self._worker_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._wakeup = asyncio.Event()
+        self._tasks: tp.List[asyncio.Task] = []
+        # задачи, выполняемые обработчиками процесса (отмечаются в _heartbeat)
+        self._running: tp.Set[str] = set()
+
+    async def start(self) -> None:
+        async with database.acquire() as con:
+            await crud.fail_interrupted_jobs(con, list(_handlers), self._heartbeat_timeout)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self._count)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    async def _work(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                async with database.acquire() as con:
+                    row = await crud.claim_job(con, list(_handlers), self._worker_id)
+            except (asyncpg.PostgresError, OSError):
+                traceback.print_exc()
+                row = None
+            if row is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(row)
+
+    async def _heartbeat(self) -> None:
+        '''
+        Отметка своих задач и освобождение задач остановленных процессов
+        '''
+        while True:
+            await asyncio.sleep(self._heartbeat_interval)
+            try:
+                async with database.acquire() as con:
+                    if self._running:
+                        await crud.touch_jobs(con, self._worker_id, list(self._running))
+                    await crud.fail_interrupted_jobs(con, list(_handlers), self._heartbeat_timeout)
+            except (asyncpg.PostgresError, OSError):
+                traceback.print_exc()
+
+    async def _run(self, row: asyncpg.Record) -> None:
+        '''
+        Выполнение задачи. Ошибки базы данных при записи результата не останавливают обработчик:
+        задача перестает отмечаться и после HEARTBEAT_TIMEOUT помечается как прерванная
+        '''
+        job_id = str(row['id'])
+        self._running.add(job_id)
+        try:
+            await self._execute(row, job_id)
+        except (asyncpg.PostgresError, OSError):
+            traceback.print_exc()
+        finally:
+            self._running.discard(job_id)
+
+    async def _execute(self, row: asyncpg.Record, job_id: str) -> None:
+        progress = JobProgress(job_id)
+        progress_task = asyncio.create_task(progress.run())
+        try:
+            result = await _handlers[row['kind']](json.loads(row['payload']), progress)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if isinstance(e, JobError):
+                error = str(e)
+            else:
+                traceback.print_exc()
+                error = f'{type(e).__name__}: {e}'
+            async with database.acquire() as con:
+                await crud.fail_job(con, job_id, error)
+            return
+        finally:
+            progress_task.cancel()
+        await progress.save()
+        async with database.acquire() as con:
+            await crud.finish_job(con, job_id, result)
+
+
+workers = JobWorkers()
@@ -6,9 +6,11 @@ from src import events
 from src.markup.routers import router as markup_router
 from src.auth.routers import router as auth_router
 from src.patologies_generation.routers import router as generation_router
+from src.jobs.routers import router as jobs_router
 from src.exception_handlers import validation_error_handler, custom_http_exception_handler
 from src.exceptions import CustomHTTPException
 from src.utils.openapi import CustomOpenAPIGenerator
+from src.utils.metrics import MetricsMiddleware, metrics_endpoint
 
 
 def get_app() -> FastAPI:
@@ -25,6 +27,8 @@ def get_app() -> FastAPI:
     app.include_router(router=markup_router)
     app.include_router(router=auth_router)
     app.include_router(router=generation_router)
+    app.include_router(router=jobs_router)
+    app.add_route('/metrics', metrics_endpoint, methods=['GET'], include_in_schema=False)
     app.add_event_handler('startup', events.on_startup)
     app.add_event_handler('shutdown', events.on_shutdown)
     app.add_middleware(
@@ -34,6 +38,7 @@ def get_app() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"]
     )
+    app.add_middleware(MetricsMiddleware)
     app.openapi = CustomOpenAPIGenerator(app)
     return app
 
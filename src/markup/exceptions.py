@@ -3,3 +3,4 @@ from src.utils.custom import CustomHTTPException
 
 WRONG_FILES_FORMAT = CustomHTTPException(415, 'wrong_files_format')
 FILE_NOT_FOUND = CustomHTTPException(404, 'not_found')
+RESEARCH_NOT_READY = CustomHTTPException(409, 'research_not_ready', 'research is still being processed')
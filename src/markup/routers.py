@@ -2,16 +2,25 @@ from pprint import pprint
 import typing as tp
 import uuid
 import asyncpg
-from fastapi import APIRouter, Depends, UploadFile, Form
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, UploadFile, Form, Request, Query
+from fastapi.responses import FileResponse, Response, StreamingResponse
 
 from src import config
 from src.auth import backends
 from src.auth.utils import JWTToken
-from src.dependencies import get_db_connection
-from src.schemas import Error
+from src.dependencies import get_db_connection, get_render_params, get_tile_params
+from src.schemas import Error, RenderParams, SeriesFormat, MprPlane
 from src.markup.utils import ResearchesStorage
 from src.markup import service
+from src.utils.slice_index import SliceIndex
+from src.utils import series_stream
+from src.utils.responses import (
+    file_response,
+    is_not_modified,
+    CACHE_IMMUTABLE,
+    CACHE_PREVIEW,
+    CACHE_REVALIDATE
+)
 import src.markup.schemas as sch
 import src.exceptions as exc
 
@@ -23,6 +32,8 @@ router.responses = {403: {'description': 'Access denied', 'model': Error},
 
 
 @router.post('/research',
+             status_code=202,
+             response_model=sch.CreateResearchResponse,
              dependencies=[Depends(backends.jwt_auth),
                            Depends(backends.is_moderator)])
 async def create_research(files: tp.List[UploadFile],
@@ -34,31 +45,97 @@ async def create_research(files: tp.List[UploadFile],
     
     tags = ''.join(tags).split(',') if tags is not None else []
     research_id = await service.create_research(con, jwt.user, name, description, tags)
-    loaded = await service.load_captures(research_id, files)
-    return sch.CreateResearchResponse(research_id=research_id, captures_count=loaded)
+    await service.stage_captures(research_id, files)
+    job_id = await service.enqueue_ingest(con, research_id, jwt.user)
+    return sch.CreateResearchResponse(research_id=research_id, job_id=job_id)
 
 
 @router.get('/research/{research_id}/preview', dependencies=[Depends(backends.jwt_auth)])
-async def get_preview(research_id: str):
+async def get_preview(request: Request, research_id: str):
     path = service.get_path_to_preview(research_id)
-    return FileResponse(path)
+    return await file_response(request, path, CACHE_PREVIEW, media_type='image/jpeg')
+
+
+@router.get('/research/{research_id}/series', dependencies=[Depends(backends.jwt_auth)], response_model=SliceIndex)
+async def get_series(research_id: str):
+    return service.get_series_index(research_id)
+
+
+@router.get('/research/{research_id}/captures', response_class=StreamingResponse, dependencies=[Depends(backends.jwt_auth)])
+async def get_captures(research_id: str,
+                       start: int = Query(default=1, ge=1),
+                       end: tp.Optional[int] = Query(default=None, ge=1),
+                       format: SeriesFormat = Query(default=SeriesFormat.zip),
+                       compress: bool = Query(default=False)):
+    '''
+    Диапазон срезов (по умолчанию вся серия) одним ответом:
+    zip-архив, собираемый на лету, или поток multipart/mixed
+    '''
+    captures = service.get_series_captures(research_id, start, end)
+    if format == SeriesFormat.zip:
+        return StreamingResponse(series_stream.iter_zip(captures, compress),
+                                 media_type='application/zip',
+                                 headers={'Content-Disposition': f'attachment; filename="{research_id}.zip"'})
+
+    boundary = series_stream.make_boundary()
+    stream = series_stream.iter_multipart(captures, boundary)
+    headers = {}
+    if compress:
+        stream = series_stream.gzip_stream(stream)
+        headers['Content-Encoding'] = 'gzip'
+    return StreamingResponse(stream,
+                             media_type=f'multipart/mixed; type="application/dicom"; boundary={boundary}',
+                             headers=headers)
 
 
 @router.get('/research/{research_id}/captures/{capture_num}')#, dependencies=[Depends(backends.jwt_auth)])
-async def get_capture(research_id: str, capture_num: int):
+async def get_capture(request: Request, research_id: str, capture_num: int):
     
     path = service.get_path_to_capture(research_id, capture_num)
-    return FileResponse(path)
+    return await file_response(request, path, CACHE_IMMUTABLE, media_type='application/dicom', etag_by_content=True)
+
+
+@router.get('/research/{research_id}/captures/{capture_num}/image', response_class=Response, dependencies=[Depends(backends.jwt_auth)])
+async def get_capture_image(research_id: str, capture_num: int, params: RenderParams = Depends(get_render_params)):
+    data = await service.render_capture(research_id, capture_num, params)
+    return Response(data, media_type=params.format.media_type)
+
+
+@router.get('/research/{research_id}/mpr/{plane}/{position}/image', response_class=Response, dependencies=[Depends(backends.jwt_auth)])
+async def get_mpr_image(research_id: str, plane: MprPlane, position: int, params: RenderParams = Depends(get_render_params)):
+    data = await service.render_mpr(research_id, plane, position, params)
+    return Response(data, media_type=params.format.media_type)
+
+
+@router.get('/research/{research_id}/tiles', dependencies=[Depends(backends.jwt_auth)], response_model=sch.TilePyramidInfo)
+async def get_tile_pyramid_info(research_id: str):
+    return service.get_tile_pyramid_info(research_id)
+
+
+@router.get('/research/{research_id}/captures/{capture_num}/tiles/{level}/{col}/{row}', dependencies=[Depends(backends.jwt_auth)])
+async def get_capture_tile(request: Request,
+                           research_id: str,
+                           capture_num: int,
+                           level: int,
+                           col: int,
+                           row: int,
+                           params: RenderParams = Depends(get_tile_params)):
+    path, etag = await service.get_capture_tile(research_id, capture_num, level, col, row, params)
+    headers = {'ETag': etag, 'Cache-Control': CACHE_IMMUTABLE}
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=params.format.media_type, headers=headers)
 
 
 @router.get('/research/{research_id}/markup', dependencies=[Depends(backends.jwt_auth)])
-async def get_markup(research_id: str, 
+async def get_markup(request: Request,
+                     research_id: str, 
                      con: asyncpg.Connection = Depends(get_db_connection),
                      jwt: JWTToken = Depends(backends.get_token)):
     
     path = service.get_path_to_markup(research_id)
     await service.check_access_to_research(con, jwt.user, research_id)
-    return FileResponse(path)
+    return await file_response(request, path, CACHE_REVALIDATE, media_type='application/json')
 
 
 @router.post('/research/{research_id}/markup', dependencies=[Depends(backends.jwt_auth)])
@@ -51,9 +51,16 @@ class FilterData(pd.BaseModel):
     
 # Responses ------------------------------------------------------------------------
 
+class TilePyramidInfo(pd.BaseModel):
+    width: int
+    height: int
+    tile_size: int
+    levels: int
+
+
 class CreateResearchResponse(pd.BaseModel):
     research_id: str
-    captures_count: int
+    job_id: str
     
 
 class GetFiltersResponse(pd.BaseModel):
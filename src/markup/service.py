@@ -1,6 +1,8 @@
 import datetime as dt
 import typing as tp
 import pathlib
+import traceback
+import asyncio
 
 import asyncpg
 from fastapi import UploadFile
@@ -10,6 +12,26 @@ from src import config
 from src.markup import crud
 from src.markup import utils
 from src.markup import schemas as sch   
+from src.jobs import service as jobs
+from src.utils.slice_index import SliceIndex
+from src.utils.render_cache import RenderCache
+from src.utils.volume import Volume, VolumeHeader, render_slice, render_plane
+from src.utils.rendering import WINDOW_PRESETS, Window
+from src.utils.tiles import TilePyramid, build_tile_pyramid, make_etag
+from src.utils.executors import run_io, run_cpu
+from src.utils.other import ExtensionsValidators
+from src.schemas import RenderParams, WindowPreset, MprPlane
+
+
+INGEST_JOB = 'ingest_research'
+
+_WRONG_FILES_DESCRIPTION = 'you may load list of .dcm files or ONE archive with .dcm files'
+
+# Блокировки построения пирамид тайлов (одна пирамида строится одним запросом)
+_tile_locks: tp.Dict[str, asyncio.Lock] = {}
+
+# Блокировки сборки объемов исследований, загруженных до появления объемов
+_volume_locks: tp.Dict[str, asyncio.Lock] = {}
 
 
 async def create_research(con: asyncpg.Connection, creator_id: str, name: str, description: str, tags: tp.List[str]) -> str:
@@ -26,26 +48,210 @@ async def create_task(con: asyncpg.Connection, research_id: str, user_id: int, d
                                   status=res['status'])
 
 
-async def load_captures(research_id: str, files: tp.List[UploadFile]) -> int:
+async def stage_captures(research_id: str, files: tp.List[UploadFile]) -> None:
+    '''
+    Проверка расширений и сохранение загруженных файлов для фоновой обработки
+    '''
     storage = utils.ResearchesStorage(config.RESEARCHES_PATH)
-    loaded = await storage.load_captures(research_id, files)
-    
+    is_archive = len(files) == 1 and ExtensionsValidators.is_archive(files[0].filename)
+    if not is_archive and not any(ExtensionsValidators.is_dicom(file.filename) for file in files):
+        storage.remove_research(research_id)
+        raise exc.WRONG_FILES_FORMAT(error_description=_WRONG_FILES_DESCRIPTION)
+    await storage.stage_captures(research_id, files)
+
+
+async def enqueue_ingest(con: asyncpg.Connection, research_id: str, creator_id: int) -> str:
+    return await jobs.enqueue(con, INGEST_JOB, {'research_id': research_id}, creator_id)
+
+
+@jobs.register_handler(INGEST_JOB)
+async def ingest_research(payload: tp.Dict[str, tp.Any], on_progress: jobs.ProgressCallback) -> tp.Dict[str, tp.Any]:
+    '''
+    Фоновая загрузка срезов исследования (прогресс - количество обработанных срезов)
+    '''
+    research_id = payload['research_id']
+    storage = utils.ResearchesStorage(config.RESEARCHES_PATH)
+    try:
+        loaded = await storage.load_staged_captures(research_id, on_progress)
+    except Exception:
+        # без индекса записанные срезы читались бы как исследование, загруженное до появления индекса
+        storage.remove_research(research_id)
+        raise
+
     if loaded is None:
         storage.remove_research(research_id)
-        raise exc.WRONG_FILES_FORMAT(error_description='you may load list of .dcm files or ONE archive with .dcm files')
-    storage.generate_preview(research_id)
-    await storage.depersonalize(research_id)
-    return loaded
+        raise jobs.JobError(_WRONG_FILES_DESCRIPTION)
+    return {'research_id': research_id, 'captures_count': loaded}
+
+
+def check_research_ready(storage: utils.ResearchesStorage, research_id: str) -> None:
+    '''
+    Срезы и превью отдаются только после сохранения индекса фоновой загрузкой
+    '''
+    if storage.is_exists(research_id) and storage.is_ingesting(research_id):
+        raise exc.RESEARCH_NOT_READY
 
 
 def get_path_to_capture(research_id: str, capture_num: int) -> tp.Union[str, pathlib.Path]:
     storage = utils.ResearchesStorage(config.RESEARCHES_PATH)
+    check_research_ready(storage, research_id)
     path = storage.get_capture_path(research_id, capture_num)
     if path is None:
         raise exc.FILE_NOT_FOUND(error_description='research or capture was not found')
     return path
 
 
+def get_series_captures(research_id: str, start: int, end: tp.Optional[int]) -> tp.List[tp.Tuple[int, pathlib.Path]]:
+    '''
+    Срезы диапазона [start, end] в анатомическом порядке (end=None - до конца серии)
+    '''
+    storage = utils.ResearchesStorage(config.RESEARCHES_PATH)
+    check_research_ready(storage, research_id)
+    count = storage.get_captures_count(research_id)
+    if count is None:
+        raise exc.FILE_NOT_FOUND(error_description='research was not found')
+    end = count if end is None else min(end, count)
+    if start > end:
+        raise exc.INVALID_REQUEST_EXCEPTION(error_description='invalid captures range')
+
+    captures = []
+    for slice_num in range(start, end + 1):
+        path = storage.get_capture_path(research_id, slice_num)
+        if path is not None:
+            captures.append((slice_num, path))
+    return captures
+
+
+async def render_capture(research_id: str, capture_num: int, params: RenderParams) -> bytes:
+    storage = utils.ResearchesStorage(config.RESEARCHES_PATH)
+    check_research_ready(storage, research_id)
+    path = storage.get_capture_path(research_id, capture_num)
+    if path is None:
+        raise exc.FILE_NOT_FOUND(error_description='research or capture was not found')
+
+    source = storage.get_slice_source(research_id, capture_num)
+    center, width = get_window(params)
+    cache = RenderCache(storage.get_renders_path(research_id))
+    key = cache.make_key(research_id, path.name, center, width, params.size, params.format.value, params.quality)
+    data = cache.peek(key)
+    if data is None:
+        data = await run_io(cache.get, key)
+    if data is None:
+        data = await run_cpu(render_slice, source, center, width, params.size, params.format.value, params.quality)
+        await run_io(cache.put, key, data)
+    return data
+
+
+async def render_mpr(research_id: str, plane: MprPlane, position: int, params: RenderParams) -> bytes:
+    '''
+    Корональная или сагиттальная реконструкция по объему исследования
+    '''
+    storage = utils.ResearchesStorage(config.RESEARCHES_PATH)
+    volume = await get_volume(storage, research_id)
+    if not 1 <= position <= volume.plane_size(plane.value):
+        raise exc.FILE_NOT_FOUND(error_description='section was not found')
+
+    center, width = get_window(params)
+    cache = RenderCache(storage.get_renders_path(research_id))
+    key = cache.make_key(research_id, plane.value, position, center, width, params.size, params.format.value, params.quality)
+    data = cache.peek(key)
+    if data is None:
+        data = await run_io(cache.get, key)
+    if data is None:
+        data = await run_cpu(render_plane, storage.get_volume_path(research_id), plane.value, position,
+                             center, width, params.size, params.format.value, params.quality)
+        await run_io(cache.put, key, data)
+    return data
+
+
+async def get_volume(storage: utils.ResearchesStorage, research_id: str) -> Volume:
+    '''
+    Объем исследования. Для исследований, загруженных до появления объемов,
+    объем собирается при первом обращении
+    '''
+    if storage.get_index(research_id) is None:
+        raise exc.FILE_NOT_FOUND(error_description='research was not found')
+    if not storage.has_volume(research_id):
+        try:
+            async with _volume_locks.setdefault(research_id, asyncio.Lock()):
+                if not storage.has_volume(research_id):
+                    header = await _build_volume(storage, research_id)
+                    if header is None:
+                        raise exc.WRONG_FILES_FORMAT(error_description='series slices have different sizes')
+        finally:
+            _volume_locks.pop(research_id, None)
+    return storage.get_volume(research_id)
+
+
+async def _build_volume(storage: utils.ResearchesStorage, research_id: str) -> tp.Optional[VolumeHeader]:
+    try:
+        return await storage.build_volume(research_id)
+    except Exception:
+        traceback.print_exc()
+        raise exc.FILE_NOT_FOUND(error_description='research volume is not available')
+
+
+def get_tile_pyramid_info(research_id: str) -> sch.TilePyramidInfo:
+    index = get_series_index(research_id)
+    width, height = index.geometry.columns, index.geometry.rows
+    if not width or not height:
+        raise exc.FILE_NOT_FOUND(error_description='research has no image geometry')
+    tile_size = config.tile_env.TILE_SIZE
+    return sch.TilePyramidInfo(width=width,
+                               height=height,
+                               tile_size=tile_size,
+                               levels=TilePyramid.levels_count(width, height, tile_size))
+
+
+async def get_capture_tile(research_id: str, capture_num: int, level: int, col: int, row: int,
+                           params: RenderParams) -> tp.Tuple[pathlib.Path, str]:
+    '''
+    Путь к тайлу и его ETag. Пирамида строится при первом обращении к срезу с данными параметрами
+    '''
+    storage = utils.ResearchesStorage(config.RESEARCHES_PATH)
+    check_research_ready(storage, research_id)
+    path = storage.get_capture_path(research_id, capture_num)
+    if path is None:
+        raise exc.FILE_NOT_FOUND(error_description='research or capture was not found')
+
+    window = get_window(params)
+    params_key = RenderCache.make_key(window, params.format.value, params.quality, config.tile_env.TILE_SIZE)
+    pyramid_path = storage.get_tiles_path(research_id).joinpath(path.stem, params_key)
+    pyramid = TilePyramid(pyramid_path)
+    if not pyramid.is_built():
+        source = storage.get_slice_source(research_id, capture_num)
+        async with _tile_locks.setdefault(str(pyramid_path), asyncio.Lock()):
+            if not pyramid.is_built():
+                await run_cpu(build_tile_pyramid, source, pyramid_path,
+                              Window(*window) if window[0] is not None else None,
+                              params.format.value, params.quality)
+        _tile_locks.pop(str(pyramid_path), None)
+
+    tile_path = pyramid.get_tile_path(level, col, row, params.format.value)
+    if tile_path is None:
+        raise exc.FILE_NOT_FOUND(error_description='tile was not found')
+    return tile_path, make_etag(research_id, path.name, params_key, level, col, row)
+
+
+def get_window(params: RenderParams) -> tp.Tuple[tp.Optional[float], tp.Optional[float]]:
+    '''
+    Окно отрисовки: явно заданное, предустановленное или окно из файла (None, None)
+    '''
+    if params.center is not None and params.width is not None:
+        return params.center, params.width
+    if params.preset != WindowPreset.default:
+        return WINDOW_PRESETS[params.preset.value]
+    return None, None
+
+
+def get_series_index(research_id: str) -> SliceIndex:
+    storage = utils.ResearchesStorage(config.RESEARCHES_PATH)
+    index = storage.get_index(research_id)
+    if index is None:
+        raise exc.FILE_NOT_FOUND(error_description='research was not found')
+    return index
+
+
 def get_path_to_markup(research_id: str) -> tp.Union[str, pathlib.Path]:
     storage = utils.ResearchesStorage(config.RESEARCHES_PATH)
     path = storage.get_markup_path(research_id)
@@ -56,9 +262,13 @@ def get_path_to_markup(research_id: str) -> tp.Union[str, pathlib.Path]:
 
 def get_path_to_preview(research_id: str) -> tp.Union[str, pathlib.Path]:
     storage = utils.ResearchesStorage(config.RESEARCHES_PATH)
+    check_research_ready(storage, research_id)
     path = storage.get_preview_path(research_id)
     if path is None:
         raise exc.FILE_NOT_FOUND(error_description='research was not found')
+    # пустой файл - превью исследований, созданных до записи превью при загрузке
+    if not path.exists() or path.stat().st_size == 0:
+        raise exc.FILE_NOT_FOUND(error_description='preview was not found')
     return path
 
 
@@ -1,38 +1,113 @@
 import typing as tp
 import pathlib
 import asyncio
-import os   
+import time
+import traceback
+import shutil
 
 from fastapi import UploadFile
 
 from src.utils.dicom import (
     dicom_to_image,
-    remove_patient_personal_data
+    ingest_dicom
 )
-from src.utils.storage import FileStorage
+from src.utils.storage import (
+    FileStorage,
+    SliceIndexMixin,
+    VolumeMixin
+)
+from src.utils.slice_index import SliceIndex
+from src.utils.executors import (
+    ingest_semaphore,
+    get_cpu_executor,
+    run_io
+)
+from src.utils.metrics import observe_ingest
 from src.utils.other import ExtensionsValidators
 from src.utils.ct_loaders import (
     MarkupLoader,
+    ArchiveFileLoader,
     AsyncArchiveLoader,
-    AsyncDicomListLoader
+    AsyncDicomListLoader,
+    DicomFilesLoader,
+    ProgressCallback,
+    stream_upload
 )
 
 
 class ResearchLoadersMixin:
-    async def load_captures(self, foldername: str, files: tp.List[UploadFile]) -> tp.Optional[int]:
+    async def load_captures(self, foldername: str,
+                            files: tp.List[UploadFile],
+                            on_progress: tp.Optional[ProgressCallback] = None) -> tp.Optional[int]:
+        '''
+        Загрузка срезов за один проход: каждый срез разбирается один раз,
+        обезличивается и записывается на диск. По собранным метаданным строится
+        индекс срезов, по нему собирается объем серии и выбирается срез для превью
+        '''
         if not self.is_exists(foldername):
             return None
         
         if len(files) == 1 and ExtensionsValidators.is_archive(files[0].filename):
-            loader = AsyncArchiveLoader(files[0])
+            loader = AsyncArchiveLoader(files[0], processor=ingest_dicom, executor=get_cpu_executor(), on_progress=on_progress)
         else:
-            loader = AsyncDicomListLoader(files)
-        
+            loader = AsyncDicomListLoader(files, processor=ingest_dicom, on_progress=on_progress)
+        return await self._ingest(foldername, loader)
+
+    async def stage_captures(self, foldername: str, files: tp.List[UploadFile]) -> tp.Optional[int]:
+        '''
+        Сохранение загруженных файлов во временную папку исследования без обработки
+        (обработка выполняется фоновой задачей)
+        '''
+        if not self.is_exists(foldername):
+            return None
+
+        uploads_path = self.get_path_to_folder(foldername).joinpath(self._UPLOADS_FOLDER)
+        uploads_path.mkdir(exist_ok=True)
+        for num, file in enumerate(files):
+            filename = pathlib.Path(file.filename or '').name
+            await stream_upload(file, uploads_path.joinpath(f'{num}_{filename}'))
+        return len(files)
+
+    async def load_staged_captures(self, foldername: str,
+                                   on_progress: tp.Optional[ProgressCallback] = None) -> tp.Optional[int]:
+        '''
+        Загрузка срезов из файлов, сохраненных stage_captures. Временная папка удаляется
+        '''
+        if not self.is_exists(foldername):
+            return None
+
+        uploads_path = self.get_path_to_folder(foldername).joinpath(self._UPLOADS_FOLDER)
+        # имена файлов: {номер}_{исходное имя}, расширение сохраняется
+        staged = sorted(uploads_path.iterdir(), key=lambda path: int(path.name.split('_', 1)[0]))
+        try:
+            if len(staged) == 1 and ExtensionsValidators.is_archive(staged[0].name):
+                loader = ArchiveFileLoader(staged[0], processor=ingest_dicom, executor=get_cpu_executor(), on_progress=on_progress)
+            else:
+                loader = DicomFilesLoader(staged, processor=ingest_dicom, executor=get_cpu_executor(), on_progress=on_progress)
+            return await self._ingest(foldername, loader)
+        finally:
+            shutil.rmtree(uploads_path, ignore_errors=True)
+
+    async def _ingest(self, foldername: str,
+                      loader: tp.Union[ArchiveFileLoader, AsyncArchiveLoader,
+                                       AsyncDicomListLoader, DicomFilesLoader]) -> tp.Optional[int]:
         path = self.get_path_to_folder(foldername).joinpath(self._CAPTURES_FOLDER)
-        loaded = await loader.load(path)
+        async with ingest_semaphore:
+            start = time.perf_counter()
+            loaded = await loader.load(path)
+            elapsed = time.perf_counter() - start
         if not loaded:
             return None
-        return loaded     
+        await run_io(observe_ingest, 'researches', path, loaded, elapsed)
+        index = SliceIndex.build(loader.metadata)
+        self.save_index(foldername, index)
+        try:
+            await self.build_volume(foldername)
+        except Exception:
+            # срезы уже сохранены: объем для MPR соберется при первом обращении (service.get_volume)
+            traceback.print_exc()
+        self.generate_preview(foldername, index.middle())
+        return loaded
 
     async def load_markup(self, foldername: str, file: UploadFile) -> tp.Optional[int]:
         if not self.is_exists(foldername) or not ExtensionsValidators.is_json:
@@ -45,23 +120,27 @@ class ResearchLoadersMixin:
 
 
 class ResearchPathManagerMixin:
-    def get_capture_path(self, foldername: str, capture_num: int) -> tp.Optional[pathlib.Path]:
+    def get_captures_path(self, foldername: str) -> tp.Optional[pathlib.Path]:
         if not self.is_exists(foldername):
             return None
         
-        captures_path = self.get_captures_path(foldername)
-        capture_path = captures_path.joinpath(f'{capture_num}.dcm')
-        if not capture_path.exists():
+        research_path = self.get_path_to_folder(foldername)
+        captures_path = research_path.joinpath(self._CAPTURES_FOLDER)
+        return captures_path
+
+    def get_renders_path(self, foldername: str) -> tp.Optional[pathlib.Path]:
+        if not self.is_exists(foldername):
             return None
-        return capture_path
-    
-    def get_captures_path(self, foldername: str) -> tp.Optional[pathlib.Path]:
+        
+        research_path = self.get_path_to_folder(foldername)
+        return research_path.joinpath(self._RENDERS_FOLDER)
+
+    def get_tiles_path(self, foldername: str) -> tp.Optional[pathlib.Path]:
         if not self.is_exists(foldername):
             return None
         
         research_path = self.get_path_to_folder(foldername)
-        captures_path = research_path.joinpath(self._CAPTURES_FOLDER)
-        return captures_path
+        return research_path.joinpath(self._TILES_FOLDER)
 
     def get_preview_path(self, foldername: str) -> tp.Optional[pathlib.Path]:
         if not self.is_exists(foldername):
@@ -80,8 +159,11 @@ class ResearchPathManagerMixin:
         return markup_path
 
 
-class ResearchesStorage(FileStorage, ResearchLoadersMixin, ResearchPathManagerMixin):
+class ResearchesStorage(SliceIndexMixin, VolumeMixin, FileStorage, ResearchLoadersMixin, ResearchPathManagerMixin):
     _CAPTURES_FOLDER = 'captures'
+    _RENDERS_FOLDER = 'renders'
+    _UPLOADS_FOLDER = 'uploads'
+    _TILES_FOLDER = 'tiles'
     _MARKUP_FILENAME = 'markup.json'
     _PREVIEW_FILENAME = 'preview.jpg'
     
@@ -97,43 +179,44 @@ class ResearchesStorage(FileStorage, ResearchLoadersMixin, ResearchPathManagerMi
         
         markup_path = self.get_markup_path(foldername)
         markup_path.touch()
-        
-        preview_path = self.get_preview_path(foldername)
-        preview_path.touch()
+        # превью записывается при загрузке срезов (generate_preview)
         return foldername
     
     def remove_research(self, foldername: str) -> None:
         self.remove_folder(foldername)
+
+    def is_ingesting(self, foldername: str) -> bool:
+        '''
+        Срезы еще загружаются: индекс не сохранен, а временная папка с загруженными файлами
+        (удаляется в конце загрузки) существует. До сохранения индекса файлы срезов
+        пронумерованы в порядке загрузки, а не в анатомическом
+        '''
+        return self.get_index(foldername) is None and \
+            self.get_path_to_folder(foldername).joinpath(self._UPLOADS_FOLDER).exists()
+
+    def get_captures_count(self, foldername: str) -> tp.Optional[int]:
+        if self.is_ingesting(foldername):
+            return None
+        return super().get_captures_count(foldername)
+
+    def get_capture_path(self, foldername: str, capture_num: int) -> tp.Optional[pathlib.Path]:
+        if self.is_ingesting(foldername):
+            return None
+        return super().get_capture_path(foldername, capture_num)
     
     
-    def generate_preview(self, foldername: str) -> tp.Optional[pathlib.Path]:
+    def generate_preview(self, foldername: str, capture_num: tp.Optional[int] = None) -> tp.Optional[pathlib.Path]:
         if not self.is_exists(foldername):
             return None
         
         path = self.get_path_to_folder(foldername)
         
-        captures_count = self.get_captures_count(foldername)
-        capture_num = captures_count // 2
+        if capture_num is None:
+            captures_count = self.get_captures_count(foldername)
+            capture_num = captures_count // 2
         if capture_num == 0:
             return None
         capture_path = self.get_capture_path(foldername, capture_num)
         return dicom_to_image(capture_path, path.joinpath(self._PREVIEW_FILENAME))
-        
-    async def depersonalize(self, foldername: str) -> None:
-        if not self.is_exists(foldername):
-            return None
-        
-        captures_count = self.get_captures_count(foldername)
-        for i in range(1, captures_count+1):
-            capture_path = self.get_capture_path(foldername, i)
-            remove_patient_personal_data(capture_path)
-            await asyncio.sleep(0)
-    
-        
-    def get_captures_count(self, foldername: str) -> int:
-        if not self.is_exists(foldername):
-            return None
-        
-        path = self.get_path_to_folder(foldername)
-        return len(os.listdir(path.joinpath(self._CAPTURES_FOLDER)))
+
 
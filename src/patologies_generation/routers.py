@@ -1,13 +1,14 @@
 import typing as tp 
 
-from fastapi import APIRouter, Depends, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, UploadFile, Request
+from fastapi.responses import FileResponse, StreamingResponse
 
 from src.auth import backends
 from src.schemas import Error
 from src import exceptions as exc
 from src.patologies_generation import service
 from src.patologies_generation import schemas as sch
+from src.utils.responses import file_response, CACHE_IMMUTABLE
 
 
 router = APIRouter(prefix='/api/v1', tags=['generation'])
@@ -22,10 +23,10 @@ async def load(files: tp.List[UploadFile]):
 
 
 @router.get('/generation/{id}/captures/{capture_num}')#, dependencies=[Depends(backends.jwt_auth)])
-async def get_capture(id: str, capture_num: int):
+async def get_capture(request: Request, id: str, capture_num: int):
     
     path = service.get_path_to_capture(id, capture_num)
-    return FileResponse(path)
+    return await file_response(request, path, CACHE_IMMUTABLE, media_type='application/dicom', etag_by_content=True)
 
 
 @router.get('/generation/params', dependencies=[Depends(backends.jwt_auth)], response_model=sch.GetParamsResponse)
@@ -34,7 +35,32 @@ async def get_params():
 
 
 @router.post('/generation/{id}/captures/{capture_num}/generate', dependencies=[Depends(backends.jwt_auth)])
-async def generate_patologies(body: sch.GeneratePatologiesRequest):
-    capture_with_patologies = service.generate_patologies(body)
-    return FileResponse()
+async def generate_patologies(id: str, capture_num: int, body: sch.GeneratePatologiesRequest):
+    path = await service.generate_patologies(id, capture_num, body.params)
+    return FileResponse(path, media_type='application/dicom')
+
+
+@router.post('/generation/{id}/generate', dependencies=[Depends(backends.jwt_auth)], response_class=StreamingResponse)
+async def generate_series(request: Request, id: str, body: sch.GenerateSeriesRequest):
+    '''
+    Генерация на диапазоне срезов (или срезах доли). Ответ - поток NDJSON:
+    по строке sch.GeneratedCapture на каждый срез в порядке готовности
+    '''
+    results = await service.generate_series(
+        id, body, lambda filename: request.url_for('get_generated_capture', id=id, filename=filename))
+
+    async def stream() -> tp.AsyncIterator[str]:
+        try:
+            async for result in results:
+                yield result.json(exclude_none=True) + '\n'
+        finally:
+            await results.aclose()
+
+    return StreamingResponse(stream(), media_type='application/x-ndjson')
+
+
+@router.get('/generation/{id}/generated/{filename}', dependencies=[Depends(backends.jwt_auth)])
+async def get_generated_capture(request: Request, id: str, filename: str):
+    path = service.get_generated_path(id, filename)
+    return await file_response(request, path, CACHE_IMMUTABLE, media_type='application/dicom')
 
@@ -56,3 +56,19 @@ class LoadResponse(pd.BaseModel):
 
 class GeneratePatologiesRequest(pd.BaseModel):
     params: GenerationParams
+
+
+class GenerateSeriesRequest(pd.BaseModel):
+    '''
+    Диапазон срезов [start, end] (номера с 1). Если диапазон не задан,
+    генерация выполняется на срезах доли, указанной в params
+    '''
+    params: GenerationParams
+    start: tp.Optional[pd.conint(ge=1)] = None
+    end: tp.Optional[pd.conint(ge=1)] = None
+
+
+class GeneratedCapture(pd.BaseModel):
+    capture_num: int
+    url: tp.Optional[str] = None
+    error: tp.Optional[str] = None
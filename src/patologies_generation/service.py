@@ -1,12 +1,28 @@
 import typing as tp
 import pathlib
+import hashlib
+import asyncio
+import traceback
 
 from fastapi import UploadFile
 
 from src import config
 from src import exceptions as exc
+from src.exceptions import CustomHTTPException
 from src.patologies_generation.utils.storage import TemporaryCTStorage
 from src.patologies_generation import schemas as sch    
+from src.patologies_generation.utils.ai.inference import inference_service, ModelNotFoundError
+from src.patologies_generation.utils.ai.processing import OUTPUT_MERGE, prepare_capture, save_generated
+from src.patologies_generation.utils.generation_cache import GenerationCache
+from src.utils.executors import run_io, run_cpu
+from src.utils.responses import file_digest
+
+
+# Кэш результатов генерации (общий для всех загруженных исследований)
+generation_cache = GenerationCache()
+
+# Блокировки генерации: одинаковые запросы, пришедшие одновременно, выполняются один раз
+_generation_locks: tp.Dict[str, asyncio.Lock] = {}
 
 
 async def load(files: tp.List[UploadFile]):
@@ -17,7 +33,6 @@ async def load(files: tp.List[UploadFile]):
     if loaded is None:
         storage.remove_folder(foldername)
         raise exc.WRONG_FILES_FORMAT(error_description='you may load list of .dcm files or ONE archive with .dcm files')
-    await storage.depersonalize(foldername)
     return foldername, loaded
 
 
@@ -42,16 +57,116 @@ def get_params():
                                  size_mm=sizes)
     
     
-def generate_patologies(body: sch.GeneratePatologiesRequest):
-    pass
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
\ No newline at end of file
+async def generate_patologies(id: str, capture_num: int, params: sch.GenerationParams) -> pathlib.Path:
+    '''
+    Генерация патологий на срезе. Результат берется из кэша генерации или генерируется
+    и помещается в кэш, в папку исследования он попадает жесткой ссылкой
+    '''
+    storage = TemporaryCTStorage(config.TEMPORARY_CT_STORAGE_PATH)
+    path = storage.get_capture_path(id, capture_num)
+    if path is None:
+        raise exc.FILE_NOT_FOUND(error_description='research or capture was not found')
+
+    version = await inference_service.get_version(params.type.value)
+    if version is None:
+        raise exc.SERVICE_UNAVAILABLE(error_description=f'generator for {params.type.value} is not loaded')
+    digest = await run_io(file_digest, path, path.stat())
+    key = generation_cache.make_key(digest, get_params_key(params),
+                                    f'{version}:{inference_service.tiling}:{OUTPUT_MERGE}')
+    result_path = storage.get_generated_path(id, capture_num, key)
+
+    cached = await run_io(generation_cache.get, key, result_path)
+    if cached is None:
+        async with _generation_locks.setdefault(key, asyncio.Lock()):
+            cached = await run_io(generation_cache.get, key, result_path)
+            if cached is None:
+                cached = await _generate(path, params, key, result_path)
+        _generation_locks.pop(key, None)
+    return result_path
+
+
+async def _generate(path: pathlib.Path, params: sch.GenerationParams, key: str,
+                    result_path: pathlib.Path) -> pathlib.Path:
+    image = await run_cpu(prepare_capture, path)
+    try:
+        output = await inference_service.predict_tiled(params.type.value, image)
+    except ModelNotFoundError:
+        raise exc.SERVICE_UNAVAILABLE(error_description=f'generator for {params.type.value} is not loaded')
+
+    description = f'Generated {params.type.value}: {params.lung.value} lung, {params.lobe.value} lobe, ' \
+                  f'{params.count.value}, {params.size_mm.value} mm'
+    tmp_path = generation_cache.get_tmp_path(key)
+    await run_cpu(save_generated, path, output, tmp_path, description)
+    return await run_io(generation_cache.put, key, tmp_path, result_path)
+
+
+async def generate_series(id: str,
+                          body: sch.GenerateSeriesRequest,
+                          url_for: tp.Callable[[str], str]) -> tp.AsyncIterator[sch.GeneratedCapture]:
+    '''
+    Генерация на диапазоне срезов. Проверки выполняются сразу, результаты отдаются
+    по мере готовности: срезы (не более 2 * MAX_BATCH_SIZE) отправляются в сервис генерации
+    одновременно, поэтому их тайлы объединяются в пакеты. url_for - ссылка на результат по имени файла
+    '''
+    storage = TemporaryCTStorage(config.TEMPORARY_CT_STORAGE_PATH)
+    count = storage.get_captures_count(id)
+    if count is None:
+        raise exc.FILE_NOT_FOUND(error_description='research was not found')
+    if await inference_service.get_version(body.params.type.value) is None:
+        raise exc.SERVICE_UNAVAILABLE(error_description=f'generator for {body.params.type.value} is not loaded')
+
+    if body.start is None and body.end is None:
+        start, end = get_lobe_range(count, body.params.lobe)
+    else:
+        start, end = body.start or 1, min(body.end or count, count)
+    if start > end:
+        raise exc.INVALID_REQUEST_EXCEPTION(error_description='invalid captures range')
+    return _generate_series(id, range(start, end + 1), body.params, url_for)
+
+
+async def _generate_series(id: str,
+                           capture_nums: tp.Iterable[int],
+                           params: sch.GenerationParams,
+                           url_for: tp.Callable[[str], str]) -> tp.AsyncIterator[sch.GeneratedCapture]:
+    semaphore = asyncio.Semaphore(config.generation_env.MAX_BATCH_SIZE * 2)
+
+    async def generate(capture_num: int) -> sch.GeneratedCapture:
+        async with semaphore:
+            try:
+                path = await generate_patologies(id, capture_num, params)
+            except CustomHTTPException as e:
+                return sch.GeneratedCapture(capture_num=capture_num, error=e.error_description)
+            except Exception as e:
+                # ошибка одного среза (чтение файла, среда выполнения модели) не прерывает поток результатов
+                traceback.print_exc()
+                return sch.GeneratedCapture(capture_num=capture_num, error=f'{type(e).__name__}: {e}')
+        return sch.GeneratedCapture(capture_num=capture_num, url=url_for(path.name))
+
+    tasks = [asyncio.create_task(generate(capture_num)) for capture_num in capture_nums]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def get_lobe_range(count: int, lobe: sch.Lobe) -> tp.Tuple[int, int]:
+    '''
+    Приблизительный диапазон срезов доли: серия (от головы к ногам) делится на трети
+    '''
+    third = count / 3
+    part = {sch.Lobe.up: 0, sch.Lobe.middle: 1, sch.Lobe.bottom: 2}[lobe]
+    return int(third * part) + 1, max(int(third * (part + 1)), int(third * part) + 1)
+
+
+def get_generated_path(id: str, filename: str) -> pathlib.Path:
+    storage = TemporaryCTStorage(config.TEMPORARY_CT_STORAGE_PATH)
+    path = storage.get_generated_file(id, filename)
+    if path is None:
+        raise exc.FILE_NOT_FOUND(error_description='generated capture was not found')
+    return path
+
+
+def get_params_key(params: sch.GenerationParams) -> str:
+    return hashlib.sha1(params.json(sort_keys=True).encode()).hexdigest()
@@ -0,0 +1,227 @@
+'''
+Воспроизводимый замер обучения и генерации pix2pix на CPU на синтетических данных:
+
+    python -m src.patologies_generation.utils.ai.benchmark --iterations 20 --output benchmark.json
+
+Шаг обучения повторяет predict.py (генератор и дискриминатор, GAN + L1). Отчет в JSON:
+образцы в секунду и время итерации (обучение, генерация), время прямого прохода по слоям,
+пиковый объем памяти процесса. Дополнительно:
+--shards - скорость чтения и аугментации шардов (shards.py), --model - генерация экспортированной моделью (export.py)
+'''
+import argparse
+import platform
+import resource
+import typing as tp
+import pathlib
+import json
+import time
+import sys
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+from src.patologies_generation.utils.ai.models import GeneratorUNet, Discriminator, weights_init_normal
+from src.patologies_generation.utils.ai.datasets import ShardDataset, augment_batch
+from src.patologies_generation.utils.ai.runtime import load_runtime
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def _summary(times: tp.List[float], batch_size: int) -> tp.Dict[str, float]:
+    times_ms = np.array(times) * 1000
+    return {
+        'iterations': len(times),
+        'samples_per_sec': batch_size * len(times) / sum(times),
+        'iteration_ms_mean': float(times_ms.mean()),
+        'iteration_ms_p50': float(np.percentile(times_ms, 50)),
+        'iteration_ms_p95': float(np.percentile(times_ms, 95)),
+    }
+
+
+def _run(step: tp.Callable[[], None], iterations: int, warmup: int) -> tp.List[float]:
+    for _ in range(warmup):
+        step()
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        step()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+class LayerTimer:
+    '''
+    Время прямого прохода по слоям (дочерние модули модели) через forward hooks
+    '''
+    def __init__(self, model: nn.Module, prefix: str) -> None:
+        self.times: tp.Dict[str, tp.List[float]] = {}
+        self._started: tp.Dict[str, float] = {}
+        self._handles = []
+        for name, module in model.named_children():
+            if isinstance(module, nn.Sequential) and name == 'model':
+                children = [(f'{name}.{child_name}', child) for child_name, child in module.named_children()]
+            else:
+                children = [(name, module)]
+            for child_name, child in children:
+                key = f'{prefix}.{child_name}'
+                self._handles.append(child.register_forward_pre_hook(self._pre_hook(key)))
+                self._handles.append(child.register_forward_hook(self._hook(key)))
+
+    def _pre_hook(self, key: str) -> tp.Callable:
+        def hook(module, inputs):
+            self._started[key] = time.perf_counter()
+        return hook
+
+    def _hook(self, key: str) -> tp.Callable:
+        def hook(module, inputs, output):
+            self.times.setdefault(key, []).append(time.perf_counter() - self._started.pop(key))
+        return hook
+
+    def remove(self) -> None:
+        for handle in self._handles:
+            handle.remove()
+
+    def summary(self) -> tp.Dict[str, float]:
+        return {key: float(np.mean(times) * 1000) for key, times in self.times.items()}
+
+
+def benchmark_training(generator: nn.Module, discriminator: nn.Module,
+                       real_A: torch.Tensor, real_B: torch.Tensor,
+                       iterations: int, warmup: int) -> tp.Dict[str, float]:
+    criterion_GAN = nn.MSELoss()
+    criterion_pixelwise = nn.L1Loss()
+    lambda_pixel = 100
+    optimizer_G = torch.optim.Adam(generator.parameters(), lr=0.0002, betas=(0.5, 0.999))
+    optimizer_D = torch.optim.Adam(discriminator.parameters(), lr=0.0002, betas=(0.5, 0.999))
+    patch = (1, real_A.shape[2] // 2 ** 4, real_A.shape[3] // 2 ** 4)
+    valid = torch.ones((real_A.size(0), *patch))
+    fake = torch.zeros((real_A.size(0), *patch))
+    generator.train()
+    discriminator.train()
+
+    def step() -> None:
+        optimizer_G.zero_grad()
+        fake_B = generator(real_A)
+        loss_G = criterion_GAN(discriminator(fake_B, real_A), valid) + lambda_pixel * criterion_pixelwise(fake_B, real_B)
+        loss_G.backward()
+        optimizer_G.step()
+
+        optimizer_D.zero_grad()
+        loss_real = criterion_GAN(discriminator(real_B, real_A), valid)
+        loss_fake = criterion_GAN(discriminator(fake_B.detach(), real_A), fake)
+        loss_D = 0.5 * (loss_real + loss_fake)
+        loss_D.backward()
+        optimizer_D.step()
+
+    return _summary(_run(step, iterations, warmup), real_A.size(0))
+
+
+def benchmark_inference(model: tp.Callable[[], tp.Any], batch_size: int,
+                        iterations: int, warmup: int) -> tp.Dict[str, float]:
+    return _summary(_run(model, iterations, warmup), batch_size)
+
+
+def benchmark_shards(path: str, batch_size: int, height: int, width: int,
+                     iterations: int, warmup: int) -> tp.Dict[str, float]:
+    '''
+    Чтение пакетов из шардов с аугментацией (как при обучении predict.py --shards)
+    '''
+    dataloader = DataLoader(ShardDataset(path), batch_size=batch_size, shuffle=True)
+    batches = iter(())
+
+    def step() -> None:
+        nonlocal batches
+        try:
+            batch = next(batches)
+        except StopIteration:
+            batches = iter(dataloader)
+            batch = next(batches)
+        augment_batch(batch, height, width)
+
+    return _summary(_run(step, iterations, warmup), batch_size)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='CPU benchmark of pix2pix training and inference')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--inference_batch_size', type=int, default=8)
+    parser.add_argument('--img_height', type=int, default=256)
+    parser.add_argument('--img_width', type=int, default=256)
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip_training', action='store_true')
+    parser.add_argument('--shards', type=str, default=None, help='folder with shards prepared by shards.py')
+    parser.add_argument('--model', type=pathlib.Path, default=None, help='exported generator (.pt or .onnx)')
+    parser.add_argument('--output', type=pathlib.Path, default=None, help='JSON report path (stdout by default)')
+    opt = parser.parse_args()
+
+    torch.manual_seed(opt.seed)
+    torch.set_num_threads(opt.threads)
+    generator = GeneratorUNet()
+    discriminator = Discriminator()
+    generator.apply(weights_init_normal)
+    discriminator.apply(weights_init_normal)
+
+    shape = (3, opt.img_height, opt.img_width)
+    report: tp.Dict[str, tp.Any] = {
+        'config': {
+            **vars(opt),
+            'torch': torch.__version__,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+        },
+    }
+
+    if not opt.skip_training:
+        real_A = torch.rand(opt.batch_size, *shape) * 2 - 1
+        real_B = torch.rand(opt.batch_size, *shape) * 2 - 1
+        report['training'] = benchmark_training(generator, discriminator, real_A, real_B, opt.iterations, opt.warmup)
+
+    generator.eval()
+    discriminator.eval()
+    inputs = torch.rand(opt.inference_batch_size, *shape) * 2 - 1
+
+    def generate() -> None:
+        with torch.inference_mode():
+            generator(inputs)
+
+    report['inference'] = benchmark_inference(generate, opt.inference_batch_size, opt.iterations, opt.warmup)
+
+    timers = [LayerTimer(generator, 'generator'), LayerTimer(discriminator, 'discriminator')]
+    with torch.inference_mode():
+        for _ in range(opt.iterations):
+            discriminator(generator(inputs), inputs)
+    report['layers_forward_ms'] = {key: value for timer in timers for key, value in timer.summary().items()}
+    for timer in timers:
+        timer.remove()
+
+    if opt.model is not None:
+        runtime = load_runtime(opt.model, opt.threads)
+        numpy_inputs = inputs.numpy()
+        report['inference_' + runtime.kind] = benchmark_inference(lambda: runtime(numpy_inputs),
+                                                                  opt.inference_batch_size,
+                                                                  opt.iterations, opt.warmup)
+    if opt.shards:
+        report['data_pipeline'] = benchmark_shards(opt.shards, opt.batch_size, opt.img_height, opt.img_width,
+                                                   opt.iterations, opt.warmup)
+
+    report['peak_rss_mb'] = _peak_rss_mb()
+    result = json.dumps(report, indent=2, default=str)
+    if opt.output is None:
+        print(result)
+    else:
+        opt.output.write_text(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,10 @@
 import glob
 import random
+import json
 import os
 import numpy as np
 
+import torch
 from torch.utils.data import Dataset
 from PIL import Image
 import torchvision.transforms as transforms
@@ -34,3 +36,54 @@ class ImageDataset(Dataset):
 
     def __len__(self):
         return len(self.files)
+
+
+SHARDS_INDEX = "index.json"
+
+
+def get_shard_path(root, mode, number):
+    return os.path.join(root, mode, "shard_%05d.npy" % number)
+
+
+class ShardDataset(Dataset):
+    """
+    Пары, заранее декодированные и нормализованные в [-1, 1] (см. shards.py):
+    шарды (N, 2, C, H, W) float32 открываются через memmap, образцы отдаются без копирования.
+    Аугментация выполняется над пакетом тензоров (augment_batch)
+    """
+    def __init__(self, root, mode="train"):
+        with open(os.path.join(root, mode, SHARDS_INDEX)) as f:
+            index = json.load(f)
+        self.shape = tuple(index["shape"])
+        # copy-on-write: тензоры из memmap без копирования и без предупреждения о read-only массиве
+        self.shards = [np.load(get_shard_path(root, mode, number), mmap_mode="c") for number in range(len(index["sizes"]))]
+        self.offsets = np.cumsum([0] + index["sizes"])
+
+    def __getitem__(self, index):
+        index = index % len(self)
+        shard = int(np.searchsorted(self.offsets, index, side="right")) - 1
+        pair = torch.from_numpy(self.shards[shard][index - self.offsets[shard]])
+        return {"A": pair[0], "B": pair[1]}
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+
+def augment_batch(batch, height=None, width=None, flip=True):
+    """
+    Аугментация пакета {"A": (N, C, H, W), "B": (N, C, H, W)}: одинаковые для A и B
+    случайное отражение по горизонтали и случайный фрагмент height x width
+    """
+    img_A, img_B = batch["A"], batch["B"]
+    n, _, h, w = img_A.shape
+    height, width = height or h, width or w
+    if (height, width) != (h, w):
+        ys = torch.randint(0, h - height + 1, (n,)).tolist()
+        xs = torch.randint(0, w - width + 1, (n,)).tolist()
+        img_A = torch.stack([img[:, y:y + height, x:x + width] for img, y, x in zip(img_A, ys, xs)])
+        img_B = torch.stack([img[:, y:y + height, x:x + width] for img, y, x in zip(img_B, ys, xs)])
+    if flip:
+        mask = (torch.rand(n) < 0.5).view(n, 1, 1, 1)
+        img_A = torch.where(mask, img_A.flip(-1), img_A)
+        img_B = torch.where(mask, img_B.flip(-1), img_B)
+    return {"A": img_A, "B": img_B}
@@ -0,0 +1,126 @@
+'''
+Упаковка генератора для CPU: экспорт весов PyTorch (.pth) в TorchScript (.pt) или ONNX (.onnx)
+с проверкой совпадения результатов с исходной моделью.
+
+    python -m src.patologies_generation.utils.ai.export saved_models/generator_200.pth models/generator_cancer.onnx --quantize
+
+Формат определяется расширением выходного файла. --quantize - динамическое квантование весов в int8
+(только ONNX: в GeneratorUNet нет слоев nn.Linear, которые квантует torch.quantization.quantize_dynamic,
+а ONNX Runtime квантует и свертки)
+'''
+import argparse
+import typing as tp
+import pathlib
+import time
+import sys
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from src import config
+from src.patologies_generation.utils.ai.runtime import (GeneratorRuntime, TorchRuntime, EAGER, TORCHSCRIPT, ONNX,
+                                                        get_runtime_kind, load_eager, load_runtime)
+
+
+# Допустимое отклонение выхода (диапазон [-1, 1]) от исходной модели
+FP32_TOLERANCE = 1e-3
+INT8_TOLERANCE = 0.1
+ONNX_OPSET = 13
+
+
+def _example(image_size: int, batch_size: int = 1, seed: int = 0) -> torch.Tensor:
+    generator = torch.Generator().manual_seed(seed)
+    return torch.rand(batch_size, 3, image_size, image_size, generator=generator) * 2 - 1
+
+
+def export_torchscript(model: nn.Module, path: pathlib.Path, image_size: int) -> None:
+    with torch.inference_mode():
+        traced = torch.jit.trace(model, _example(image_size))
+    frozen = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+    torch.jit.save(frozen, str(path))
+
+
+def export_onnx(model: nn.Module, path: pathlib.Path, image_size: int, quantize: bool = False) -> None:
+    '''
+    Экспорт в ONNX с переменным размером пакета, при quantize - с весами в int8
+    '''
+    fp32_path = path.with_name(f'.{path.stem}.fp32.onnx') if quantize else path
+    with torch.no_grad():
+        torch.onnx.export(model, _example(image_size), str(fp32_path),
+                          input_names=['input'], output_names=['output'],
+                          dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}},
+                          opset_version=ONNX_OPSET, do_constant_folding=True)
+    if not quantize:
+        return
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    try:
+        quantize_dynamic(str(fp32_path), str(path), weight_type=QuantType.QInt8)
+    finally:
+        os.unlink(fp32_path)
+
+
+def check_parity(eager: nn.Module, runtime: GeneratorRuntime, image_size: int,
+                 batch_size: int = 2, repeats: int = 3) -> tp.Tuple[float, float, float]:
+    '''
+    Сравнение экспортированной модели с исходной на одном и том же входе.
+    Возвращает максимальное отклонение выхода и время обработки пакета (с) обеими моделями
+    '''
+    inputs = _example(image_size, batch_size)
+    reference = TorchRuntime(eager, EAGER)
+    expected = reference(inputs.numpy())
+    actual = runtime(inputs.numpy())
+    return (float(np.abs(expected - actual).max()),
+            _measure(reference, inputs.numpy(), repeats),
+            _measure(runtime, inputs.numpy(), repeats))
+
+
+def _measure(runtime: GeneratorRuntime, inputs: np.ndarray, repeats: int) -> float:
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        runtime(inputs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Export GeneratorUNet weights to TorchScript or ONNX')
+    parser.add_argument('weights', type=pathlib.Path, help='generator weights saved by predict.py (.pth)')
+    parser.add_argument('output', type=pathlib.Path, help='output file: .pt (TorchScript) or .onnx')
+    parser.add_argument('--quantize', action='store_true', help='dynamic int8 quantization of weights (ONNX only)')
+    parser.add_argument('--image_size', type=int, default=config.generation_env.IMAGE_SIZE)
+    parser.add_argument('--threads', type=int, default=config.generation_env.THREADS, help='intra-op threads')
+    parser.add_argument('--tolerance', type=float, default=None, help='max allowed output difference')
+    opt = parser.parse_args()
+
+    kind = get_runtime_kind(opt.output)
+    if kind not in (TORCHSCRIPT, ONNX):
+        parser.error('output must have .pt or .onnx extension')
+    if opt.quantize and kind != ONNX:
+        parser.error('--quantize is supported for ONNX only')
+
+    torch.set_num_threads(opt.threads)
+    model = load_eager(opt.weights)
+    opt.output.parent.mkdir(parents=True, exist_ok=True)
+    if kind == TORCHSCRIPT:
+        export_torchscript(model, opt.output, opt.image_size)
+    else:
+        export_onnx(model, opt.output, opt.image_size, opt.quantize)
+
+    tolerance = opt.tolerance
+    if tolerance is None:
+        tolerance = INT8_TOLERANCE if opt.quantize else FP32_TOLERANCE
+    error, eager_time, runtime_time = check_parity(model, load_runtime(opt.output, opt.threads), opt.image_size)
+    print(f'{opt.output}: max abs difference {error:.6f} (tolerance {tolerance}), '
+          f'batch time eager {eager_time * 1000:.1f} ms, {kind} {runtime_time * 1000:.1f} ms')
+    if error > tolerance:
+        os.unlink(opt.output)
+        print('parity check failed, output removed', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
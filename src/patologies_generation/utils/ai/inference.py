@@ -0,0 +1,217 @@
+import typing as tp
+import pathlib
+import asyncio
+import queue
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from src import config
+from src.utils.executors import run_io
+from src.utils.responses import file_digest
+from src.patologies_generation.utils.ai.processing import split_tiles, stitch_tiles
+from src.patologies_generation.utils.ai.runtime import (GeneratorRuntime, RUNTIME_PRIORITY, RUNTIME_SUFFIXES,
+                                                        get_runtime_kind, load_runtime)
+
+
+class ModelNotFoundError(KeyError):
+    '''
+    Для заданного типа патологии нет весов генератора
+    '''
+
+
+class _Request(tp.NamedTuple):
+    model: str
+    image: np.ndarray
+    future: asyncio.Future
+    loop: asyncio.AbstractEventLoop
+
+
+def _set_result(future: asyncio.Future, result: tp.Any) -> None:
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, exception: BaseException) -> None:
+    if not future.done():
+        future.set_exception(exception)
+
+
+class InferenceService:
+    '''
+    Сервис генерации на CPU. Модели загружаются один раз при запуске в отдельном потоке
+    и прогреваются, после чего поток обслуживает очередь запросов:
+    запросы, пришедшие в течение MAX_WAIT_MS после первого (но не более MAX_BATCH_SIZE),
+    объединяются в один пакет и проходят через генератор за один вызов.
+    Цикл событий только ставит запрос в очередь и ждет future.
+    Генератор рассчитан на вход IMAGE_SIZE x IMAGE_SIZE, поэтому срез в исходном разрешении
+    разбивается на тайлы с перекрытием TILE_OVERLAP (predict_tiled): тайлы всех срезов,
+    обрабатываемых одновременно, попадают в общие пакеты, а результаты сшиваются без швов.
+
+    Веса хранятся в MODELS_PATH: generator_{тип патологии}.{pth|pt|onnx},
+    generator.* используется для типов без собственных весов.
+    Формат определяет среду выполнения (см. runtime.py и export.py); если для модели есть
+    несколько форматов, выбирается runtime (auto - ONNX, затем TorchScript, затем PyTorch)
+    '''
+    _DEFAULT_MODEL = 'generator'
+
+    def __init__(self, models_path: pathlib.Path = config.generation_env.MODELS_PATH,
+                 max_batch_size: int = config.generation_env.MAX_BATCH_SIZE,
+                 max_wait_ms: int = config.generation_env.MAX_WAIT_MS,
+                 threads: int = config.generation_env.THREADS,
+                 runtime: str = config.generation_env.RUNTIME,
+                 image_size: int = config.generation_env.IMAGE_SIZE,
+                 tile_overlap: int = config.generation_env.TILE_OVERLAP) -> None:
+        if not 0 <= tile_overlap < image_size:
+            raise ValueError(f'Tile overlap must be in [0, {image_size})')
+        if runtime != 'auto' and runtime not in RUNTIME_SUFFIXES:
+            raise ValueError(f'Unknown generator runtime: {runtime}')
+        self._models_path = pathlib.Path(models_path)
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000
+        self._threads = threads
+        self._runtimes = RUNTIME_PRIORITY if runtime == 'auto' else (runtime,)
+        self._image_size = image_size
+        self._tile_overlap = tile_overlap
+        self._models: tp.Dict[str, GeneratorRuntime] = {}
+        self._versions: tp.Dict[str, str] = {}
+        self._loaded = threading.Event()
+        self._queue: 'queue.Queue[tp.Optional[_Request]]' = queue.Queue()
+        self._thread: tp.Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._serve, name='inference', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+        self._thread = None
+
+    async def get_version(self, model: str) -> tp.Optional[str]:
+        '''
+        Версия модели, которая обработает запрос (хэш файла весов), None - модели нет.
+        До окончания загрузки моделей ожидает ее
+        '''
+        if not self._loaded.is_set():
+            await run_io(self._loaded.wait)
+        name = self._resolve(model)
+        return self._versions[name] if name is not None else None
+
+    @property
+    def tiling(self) -> str:
+        '''
+        Параметры разбиения на тайлы (влияют на результат генерации)
+        '''
+        return f'{self._image_size}:{self._tile_overlap}'
+
+    async def predict(self, model: str, image: np.ndarray) -> np.ndarray:
+        '''
+        Генерация для одного изображения (C, IMAGE_SIZE, IMAGE_SIZE) float32 в диапазоне [-1, 1]
+        '''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put(_Request(model, image, future, loop))
+        return await future
+
+    async def predict_tiled(self, model: str, image: np.ndarray) -> np.ndarray:
+        '''
+        Генерация для изображения (C, H, W) произвольного размера по тайлам
+        '''
+        tiles, positions = split_tiles(image, self._image_size, self._tile_overlap)
+        outputs = await asyncio.gather(*(self.predict(model, tile) for tile in tiles))
+        return await run_io(stitch_tiles, outputs, positions, image.shape, self._tile_overlap)
+
+    def _resolve(self, model: str) -> tp.Optional[str]:
+        if model in self._models:
+            return model
+        if self._DEFAULT_MODEL in self._models:
+            return self._DEFAULT_MODEL
+        return None
+
+    def _find_models(self) -> tp.Dict[str, pathlib.Path]:
+        '''
+        Файл весов для каждой модели в наиболее предпочтительном из разрешенных форматов
+        '''
+        found: tp.Dict[str, tp.Dict[str, pathlib.Path]] = {}
+        for path in sorted(self._models_path.glob('generator*')):
+            kind = get_runtime_kind(path)
+            if kind is None:
+                continue
+            name = path.stem.split('_', 1)[1] if '_' in path.stem else self._DEFAULT_MODEL
+            found.setdefault(name, {})[kind] = path
+        return {
+            name: next(paths[kind] for kind in self._runtimes if kind in paths)
+            for name, paths in found.items()
+            if any(kind in paths for kind in self._runtimes)
+        }
+
+    def _load(self) -> None:
+        for name, path in self._find_models().items():
+            try:
+                model = load_runtime(path, self._threads)
+                model(np.zeros((1, 3, self._image_size, self._image_size), dtype=np.float32))
+            except Exception:
+                traceback.print_exc()
+                continue
+            self._models[name] = model
+            self._versions[name] = file_digest(path, path.stat())
+
+    def _serve(self) -> None:
+        try:
+            self._load()
+        finally:
+            self._loaded.set()
+
+        stopping = False
+        while not stopping:
+            request = self._queue.get()
+            if request is None:
+                break
+            batch = [request]
+            deadline = time.monotonic() + self._max_wait
+            while len(batch) < self._max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+
+            groups: tp.Dict[tp.Optional[str], tp.List[_Request]] = {}
+            for request in batch:
+                groups.setdefault(self._resolve(request.model), []).append(request)
+            for name, requests in groups.items():
+                self._forward(name, requests)
+
+    def _forward(self, name: tp.Optional[str], requests: tp.List[_Request]) -> None:
+        # запросы, которые уже не ждут (клиент отключился), не обрабатываются
+        requests = [request for request in requests if not request.future.done()]
+        if not requests:
+            return
+        if name is None:
+            for request in requests:
+                request.loop.call_soon_threadsafe(_set_exception, request.future, ModelNotFoundError(request.model))
+            return
+        try:
+            outputs = self._models[name](np.stack([request.image for request in requests]))
+        except Exception as e:
+            for request in requests:
+                request.loop.call_soon_threadsafe(_set_exception, request.future, e)
+            return
+        for request, output in zip(requests, outputs):
+            request.loop.call_soon_threadsafe(_set_result, request.future, output)
+
+
+inference_service = InferenceService()
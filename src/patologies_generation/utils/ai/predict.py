@@ -38,6 +38,9 @@ parser.add_argument(
     "--sample_interval", type=int, default=500, help="interval between sampling of images from generators"
 )
 parser.add_argument("--checkpoint_interval", type=int, default=-1, help="interval between model checkpoints")
+parser.add_argument(
+    "--shards", type=str, default=None, help="folder with shards prepared by shards.py (instead of decoding images)"
+)
 opt = parser.parse_args()
 print(opt)
 
@@ -86,19 +89,31 @@ transforms_ = [
     transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5)),
 ]
 
-dataloader = DataLoader(
-    ImageDataset("../../data/%s" % opt.dataset_name, transforms_=transforms_),
-    batch_size=opt.batch_size,
-    shuffle=True,
-    num_workers=opt.n_cpu,
-)
+if opt.shards:
+    # образцы уже декодированы и нормализованы: чтение из memmap, аугментация над пакетом в основном процессе
+    dataloader = DataLoader(ShardDataset(opt.shards), batch_size=opt.batch_size, shuffle=True)
+    val_dataloader = DataLoader(ShardDataset(opt.shards, mode="val"), batch_size=10, shuffle=True)
+else:
+    dataloader = DataLoader(
+        ImageDataset("../../data/%s" % opt.dataset_name, transforms_=transforms_),
+        batch_size=opt.batch_size,
+        shuffle=True,
+        num_workers=opt.n_cpu,
+    )
+
+    val_dataloader = DataLoader(
+        ImageDataset("../../data/%s" % opt.dataset_name, transforms_=transforms_, mode="val"),
+        batch_size=10,
+        shuffle=True,
+        num_workers=1,
+    )
+
+
+def prepare_batch(batch, train=True):
+    if not opt.shards:
+        return batch
+    return augment_batch(batch, opt.img_height, opt.img_width, flip=train)
 
-val_dataloader = DataLoader(
-    ImageDataset("../../data/%s" % opt.dataset_name, transforms_=transforms_, mode="val"),
-    batch_size=10,
-    shuffle=True,
-    num_workers=1,
-)
 
 # Tensor type
 Tensor = torch.cuda.FloatTensor if cuda else torch.FloatTensor
@@ -106,7 +121,7 @@ Tensor = torch.cuda.FloatTensor if cuda else torch.FloatTensor
 
 def sample_images(batches_done):
     """Saves a generated sample from the validation set"""
-    imgs = next(iter(val_dataloader))
+    imgs = prepare_batch(next(iter(val_dataloader)), train=False)
     real_A = Variable(imgs["B"].type(Tensor))
     real_B = Variable(imgs["A"].type(Tensor))
     fake_B = generator(real_A)
@@ -122,7 +137,7 @@ prev_time = time.time()
 
 for epoch in range(opt.epoch, opt.n_epochs):
     for i, batch in enumerate(dataloader):
-
+        batch = prepare_batch(batch)
         # Model inputs
         real_A = Variable(batch["B"].type(Tensor))
         real_B = Variable(batch["A"].type(Tensor))
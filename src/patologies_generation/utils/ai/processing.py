@@ -0,0 +1,134 @@
+import typing as tp
+import pathlib
+import math
+
+import numpy as np
+
+from src import config
+from src.utils.dicom import save_derived_dicom
+from src.utils.volume import SliceSource, read_slice
+from src.utils.rendering import Window
+
+
+# Окно, в котором срез подается генератору (значения HU переводятся в [-1, 1])
+MODEL_WINDOW = Window(config.generation_env.WINDOW_CENTER, config.generation_env.WINDOW_WIDTH)
+# Параметры переноса результата на исходный срез (входят в ключ кэша генерации)
+OUTPUT_MERGE = f'{MODEL_WINDOW.center}:{MODEL_WINDOW.width}:{config.generation_env.WINDOW_BLEND}'
+
+
+def to_model_input(hu: np.ndarray, window: Window = MODEL_WINDOW) -> np.ndarray:
+    '''
+    Срез в HU -> вход генератора: (3, H, W) float32 в диапазоне [-1, 1] в исходном разрешении
+    '''
+    low = window.center - window.width / 2
+    image = np.clip((hu.astype(np.float32) - low) / window.width, 0.0, 1.0) * 2.0 - 1.0
+    return np.ascontiguousarray(np.broadcast_to(image, (3, *image.shape)), dtype=np.float32)
+
+
+def from_model_output(output: np.ndarray, window: Window = MODEL_WINDOW) -> np.ndarray:
+    '''
+    Выход генератора (3, H, W) в [-1, 1] -> срез в HU
+    '''
+    image = (output.mean(axis=0) + 1.0) / 2.0
+    low = window.center - window.width / 2
+    return image * window.width + low
+
+
+def merge_with_source(source: np.ndarray, generated: np.ndarray, window: Window = MODEL_WINDOW,
+                      blend: float = config.generation_env.WINDOW_BLEND) -> np.ndarray:
+    '''
+    Перенос результата генерации (HU) на исходный срез (HU). Генератор видит срез только в окне window,
+    поэтому за его границами (кость, контраст, воздух) сохраняются исходные значения.
+    На полосе blend HU за границами вес результата линейно убывает до нуля, а к результату
+    возвращается отрезанная окном часть значения, поэтому неизмененный срез переносится без потерь
+    '''
+    low = window.center - window.width / 2
+    high = window.center + window.width / 2
+    source = source.astype(np.float32)
+    clipped = np.clip(source, low, high)
+    outside = np.abs(source - clipped)
+    weight = np.clip(1.0 - outside / blend, 0.0, 1.0) if blend > 0 else (outside == 0).astype(np.float32)
+    return weight * (generated + source - clipped) + (1.0 - weight) * source
+
+
+def get_tile_positions(length: int, tile_size: int, overlap: int) -> tp.List[int]:
+    '''
+    Начала тайлов вдоль оси: тайлы покрывают ось целиком и перекрываются не меньше, чем на overlap
+    '''
+    if length <= tile_size:
+        return [0]
+    count = math.ceil((length - overlap) / (tile_size - overlap))
+    return np.linspace(0, length - tile_size, count).round().astype(int).tolist()
+
+
+def get_blend_weights(tile_size: int, overlap: int) -> np.ndarray:
+    '''
+    Веса пикселей тайла при сшивке: линейно убывают к краям в полосе перекрытия,
+    поэтому соседние тайлы плавно переходят друг в друга без швов
+    '''
+    ramp = np.ones(tile_size, dtype=np.float32)
+    if overlap > 0:
+        edge = (np.arange(overlap, dtype=np.float32) + 0.5) / overlap
+        ramp[:overlap] = edge
+        ramp[-overlap:] = np.minimum(ramp[-overlap:], edge[::-1])
+    return np.outer(ramp, ramp)
+
+
+def split_tiles(image: np.ndarray, tile_size: int,
+                overlap: int) -> tp.Tuple[tp.List[np.ndarray], tp.List[tp.Tuple[int, int]]]:
+    '''
+    Разбиение входа генератора (C, H, W) на тайлы (C, tile_size, tile_size) с перекрытием.
+    Срез меньше тайла дополняется значениями с края
+    '''
+    _, height, width = image.shape
+    pad = ((0, 0), (0, max(tile_size - height, 0)), (0, max(tile_size - width, 0)))
+    if any(after for _, after in pad):
+        image = np.pad(image, pad, mode='edge')
+    positions = [(y, x)
+                 for y in get_tile_positions(image.shape[1], tile_size, overlap)
+                 for x in get_tile_positions(image.shape[2], tile_size, overlap)]
+    tiles = [image[:, y:y + tile_size, x:x + tile_size] for y, x in positions]
+    return tiles, positions
+
+
+def stitch_tiles(outputs: tp.Sequence[np.ndarray], positions: tp.Sequence[tp.Tuple[int, int]],
+                 shape: tp.Tuple[int, int, int], overlap: int) -> np.ndarray:
+    '''
+    Сшивка выходов генератора для тайлов split_tiles в изображение (C, H, W) исходного размера
+    взвешенным усреднением в полосах перекрытия
+    '''
+    channels, height, width = shape
+    tile_size = outputs[0].shape[-1]
+    weights = get_blend_weights(tile_size, overlap)
+    result = np.zeros((channels, max(height, tile_size), max(width, tile_size)), dtype=np.float32)
+    total = np.zeros(result.shape[1:], dtype=np.float32)
+    for output, (y, x) in zip(outputs, positions):
+        result[:, y:y + tile_size, x:x + tile_size] += output * weights
+        total[y:y + tile_size, x:x + tile_size] += weights
+    result /= total
+    return result[:, :height, :width]
+
+
+def read_hu(source: SliceSource) -> np.ndarray:
+    pixels, slope, intercept, _ = read_slice(source)
+    return pixels.astype(np.float32) * slope + intercept
+
+
+def prepare_capture(source: SliceSource) -> np.ndarray:
+    '''
+    Чтение среза и подготовка входа генератора (функция уровня модуля для пула процессов)
+    '''
+    return to_model_input(read_hu(source))
+
+
+def save_generated(path_to_dicom: pathlib.Path,
+                   output: np.ndarray,
+                   path_to_save: pathlib.Path,
+                   description: str) -> pathlib.Path:
+    '''
+    Запись результата генерации в DICOM-файл на основе исходного среза:
+    пиксели вне окна генератора берутся из исходного среза (merge_with_source)
+    '''
+    hu = merge_with_source(read_hu(path_to_dicom), from_model_output(output))
+    save_derived_dicom(path_to_dicom, hu, path_to_save, description)
+    return path_to_save
@@ -0,0 +1,100 @@
+from abc import ABCMeta, abstractmethod
+import typing as tp
+import pathlib
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from src.patologies_generation.utils.ai.models import GeneratorUNet
+
+
+# Форматы весов генератора по расширению файла
+EAGER = 'eager'
+TORCHSCRIPT = 'torchscript'
+ONNX = 'onnx'
+RUNTIME_SUFFIXES = {EAGER: '.pth', TORCHSCRIPT: '.pt', ONNX: '.onnx'}
+# Порядок выбора, если для модели есть файлы в нескольких форматах (GENERATION_RUNTIME=auto)
+RUNTIME_PRIORITY = (ONNX, TORCHSCRIPT, EAGER)
+
+
+class GeneratorRuntime(metaclass=ABCMeta):
+    '''
+    Среда выполнения генератора: (N, 3, H, W) float32 в [-1, 1] -> (N, 3, H, W) float32
+    '''
+    kind: str
+
+    @abstractmethod
+    def __call__(self, inputs: np.ndarray) -> np.ndarray:
+        pass
+
+
+class TorchRuntime(GeneratorRuntime):
+    '''
+    Модель PyTorch: обычная (eager) или TorchScript
+    '''
+    def __init__(self, model: nn.Module, kind: str) -> None:
+        self.kind = kind
+        self._model = model
+
+    def __call__(self, inputs: np.ndarray) -> np.ndarray:
+        with torch.inference_mode():
+            return self._model(torch.from_numpy(inputs)).numpy()
+
+
+class OnnxRuntime(GeneratorRuntime):
+    '''
+    Модель ONNX в ONNX Runtime (CPU) с полной оптимизацией графа
+    '''
+    kind = ONNX
+
+    def __init__(self, path: pathlib.Path, threads: int) -> None:
+        # onnxruntime нужен только для моделей в формате ONNX
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+        self._input = self._session.get_inputs()[0].name
+
+    def __call__(self, inputs: np.ndarray) -> np.ndarray:
+        return self._session.run(None, {self._input: inputs})[0]
+
+
+def get_runtime_kind(path: pathlib.Path) -> tp.Optional[str]:
+    for kind, suffix in RUNTIME_SUFFIXES.items():
+        if path.suffix == suffix:
+            return kind
+    return None
+
+
+def load_eager(path: pathlib.Path) -> nn.Module:
+    '''
+    Загрузка генератора PyTorch: словарь весов (как сохраняет predict.py) или целиком сохраненная модель
+    '''
+    obj = torch.load(path, map_location='cpu')
+    if isinstance(obj, nn.Module):
+        model = obj
+    else:
+        model = GeneratorUNet()
+        model.load_state_dict(obj)
+    return model.eval()
+
+
+def load_runtime(path: pathlib.Path, threads: int) -> GeneratorRuntime:
+    '''
+    Загрузка генератора в среду выполнения, соответствующую формату файла.
+    Число потоков задается для операций внутри слоя (intra-op)
+    '''
+    kind = get_runtime_kind(path)
+    if kind == ONNX:
+        return OnnxRuntime(path, threads)
+    torch.set_num_threads(threads)
+    if kind == TORCHSCRIPT:
+        return TorchRuntime(torch.jit.load(str(path), map_location='cpu').eval(), kind)
+    if kind == EAGER:
+        return TorchRuntime(load_eager(path), kind)
+    raise ValueError(f'Unknown generator format: {path.name}')
@@ -0,0 +1,121 @@
+'''
+Подготовка обучающей выборки для predict.py: пары декодируются и нормализуются один раз
+и записываются в шарды (N, 2, 3, H, W) float32, которые ShardDataset читает через memmap.
+
+    python -m src.patologies_generation.utils.ai.shards images ../../data/facades ../../data/facades_shards
+    python -m src.patologies_generation.utils.ai.shards dicom storage/temp/<с патологией> storage/temp/<исходное> ../../data/ct_shards
+
+images - изображения A|B в одном файле (как ImageDataset, train дополняется test), приводятся к img_height x img_width.
+dicom - срезы исследования с патологией (A) и исходного исследования (B) с одинаковыми именами файлов
+в исходном разрешении и окне генератора; фрагменты нужного размера вырезает augment_batch при обучении
+'''
+import argparse
+import concurrent.futures
+import typing as tp
+import pathlib
+import json
+import glob
+import os
+
+import numpy as np
+from PIL import Image
+
+from src.patologies_generation.utils.ai.datasets import SHARDS_INDEX, get_shard_path
+from src.patologies_generation.utils.ai.processing import prepare_capture
+
+
+Pair = np.ndarray  # (2, 3, H, W) float32
+
+
+def load_image_pair(path: str, height: int, width: int) -> Pair:
+    img = Image.open(path).convert('RGB')
+    w, h = img.size
+    pair = []
+    for img_part in (img.crop((0, 0, w // 2, h)), img.crop((w // 2, 0, w, h))):
+        image = np.asarray(img_part.resize((width, height), Image.BICUBIC), dtype=np.float32)
+        pair.append((image / 127.5 - 1.0).transpose(2, 0, 1))
+    return np.stack(pair)
+
+
+def load_dicom_pair(paths: tp.Tuple[pathlib.Path, pathlib.Path]) -> Pair:
+    return np.stack([prepare_capture(path) for path in paths])
+
+
+def write_shards(pairs: tp.Iterable[Pair], count: int, root: pathlib.Path, mode: str, shard_size: int) -> int:
+    '''
+    Запись пар в шарды по shard_size. Все пары должны быть одной формы.
+    Индекс записывается последним, поэтому незавершенная подготовка не читается как готовая
+    '''
+    folder = root.joinpath(mode)
+    folder.mkdir(parents=True, exist_ok=True)
+    index_path = folder.joinpath(SHARDS_INDEX)
+    if index_path.exists():
+        index_path.unlink()
+
+    shape: tp.Optional[tp.Tuple[int, ...]] = None
+    sizes: tp.List[int] = []
+    shard = None
+    written = 0
+    for pair in pairs:
+        if shape is None:
+            shape = pair.shape
+        if pair.shape != shape:
+            raise ValueError(f'Pair {written} has shape {pair.shape}, expected {shape}')
+        position = written % shard_size
+        if position == 0:
+            if shard is not None:
+                shard.flush()
+            size = min(shard_size, count - written)
+            shard = np.lib.format.open_memmap(get_shard_path(root, mode, len(sizes)), mode='w+',
+                                              dtype=np.float32, shape=(size, *shape))
+            sizes.append(size)
+        shard[position] = pair
+        written += 1
+    if shard is not None:
+        shard.flush()
+    for stale in sorted(glob.glob(str(folder.joinpath('shard_*.npy'))))[len(sizes):]:
+        os.unlink(stale)
+
+    tmp_path = index_path.with_suffix('.tmp')
+    tmp_path.write_text(json.dumps({'shape': shape, 'sizes': sizes}))
+    os.replace(tmp_path, index_path)
+    return written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Prepare pre-decoded training shards for predict.py')
+    parser.add_argument('source', choices=['images', 'dicom'])
+    parser.add_argument('paths', type=pathlib.Path, nargs='+',
+                        help='images: dataset root and output; dicom: folder A, folder B and output')
+    parser.add_argument('--mode', default='train', help='dicom: dataset split to write')
+    parser.add_argument('--img_height', type=int, default=256)
+    parser.add_argument('--img_width', type=int, default=256)
+    parser.add_argument('--shard_size', type=int, default=512, help='pairs per shard')
+    parser.add_argument('--n_cpu', type=int, default=os.cpu_count() or 1)
+    opt = parser.parse_args()
+
+    with concurrent.futures.ProcessPoolExecutor(opt.n_cpu) as executor:
+        if opt.source == 'images':
+            if len(opt.paths) != 2:
+                parser.error('images: expected dataset root and output')
+            root, output = opt.paths
+            splits = {'train': ['train', 'test'], 'val': ['val']}
+            for mode, folders in splits.items():
+                files = [path for folder in folders for path in sorted(glob.glob(str(root.joinpath(folder, '*.*'))))]
+                if not files:
+                    continue
+                pairs = executor.map(load_image_pair, files, [opt.img_height] * len(files),
+                                     [opt.img_width] * len(files), chunksize=16)
+                print(f'{mode}: {write_shards(pairs, len(files), output, mode, opt.shard_size)} pairs')
+        else:
+            if len(opt.paths) != 3:
+                parser.error('dicom: expected folder A, folder B and output')
+            folder_a, folder_b, output = opt.paths
+            names = sorted(path.name for path in folder_a.glob('*.dcm') if folder_b.joinpath(path.name).exists())
+            paths = [(folder_a.joinpath(name), folder_b.joinpath(name)) for name in names]
+            pairs = executor.map(load_dicom_pair, paths, chunksize=16)
+            print(f'{opt.mode}: {write_shards(pairs, len(paths), output, opt.mode, opt.shard_size)} pairs')
+
+
+if __name__ == '__main__':
+    main()
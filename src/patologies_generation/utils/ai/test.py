@@ -1,41 +1,44 @@
-import numpy as np  
-from PIL import Image
+'''
+Проверка генератора на изображении из обучающей выборки (пара A|B в одном файле):
 
-import torchvision.transforms as transforms
-import torch
+    python -m src.patologies_generation.utils.ai.test models/generator.onnx test_1.jpg result.png
 
+Генератор загружается в среду выполнения по формату файла (.pth, .pt, .onnx), как в сервисе генерации
+'''
+import argparse
+import pathlib
 
+import numpy as np
+from PIL import Image
 
+from src import config
+from src.patologies_generation.utils.ai.runtime import load_runtime
 
 
-def preprocess(path):
-    global transforms_
-    img = Image.open(path)
+def preprocess(path: pathlib.Path, image_size: int) -> np.ndarray:
+    '''
+    Левая половина изображения (A) -> вход генератора (1, 3, size, size) в [-1, 1]
+    '''
+    img = Image.open(path).convert('RGB')
     w, h = img.size
-    img_A = img.crop((0, 0, w / 2, h))
-    img_B = img.crop((w / 2, 0, w, h))
-
-    if np.random.random() < 0.5:
-        img_A = Image.fromarray(np.array(img_A)[:, ::-1, :], "RGB")
-        img_B = Image.fromarray(np.array(img_B)[:, ::-1, :], "RGB")
-
-    transforms_ = [
-        transforms.Resize((img.height, img.width), Image.BICUBIC),
-        transforms.ToTensor(),
-        transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5)),
-    ]
-
-    img_A = transforms.Compose(transforms_)(img_A)
-    img_B = transforms.Compose(transforms_)(img_B)
-
-    return {"A": img_A, "B": img_B}
-
+    img_A = img.crop((0, 0, w // 2, h)).resize((image_size, image_size), Image.BICUBIC)
+    image = np.asarray(img_A, dtype=np.float32) / 127.5 - 1.0
+    return np.ascontiguousarray(image.transpose(2, 0, 1)[None])
 
-path = './test_1.jpg'
-preprocessed = preprocess(path)
 
-mod_1 = torch.load('./src/patologies_generation/utils/ai/model00.pth')
+def postprocess(output: np.ndarray) -> Image.Image:
+    image = (np.clip(output[0].transpose(1, 2, 0), -1.0, 1.0) + 1.0) * 127.5
+    return Image.fromarray(image.round().astype(np.uint8), 'RGB')
 
-pred = mod_1.predict('Рак')
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model', type=pathlib.Path)
+    parser.add_argument('image', type=pathlib.Path)
+    parser.add_argument('output', type=pathlib.Path)
+    parser.add_argument('--image_size', type=int, default=config.generation_env.IMAGE_SIZE)
+    parser.add_argument('--threads', type=int, default=config.generation_env.THREADS)
+    opt = parser.parse_args()
 
+    runtime = load_runtime(opt.model, opt.threads)
+    postprocess(runtime(preprocess(opt.image, opt.image_size))).save(opt.output)
@@ -0,0 +1,123 @@
+import typing as tp
+import pathlib
+import hashlib
+import threading
+import shutil
+import os
+
+from src import config
+from src.utils.cache import LRUCache
+
+
+class GenerationCache:
+    '''
+    Кэш результатов генерации с адресацией по содержимому.
+    Ключ - (хэш исходного среза, параметры генерации, версия модели), поэтому повторная
+    генерация того же среза с теми же параметрами (в том числе из другого загруженного
+    исследования) не запускает генератор.
+    Файлы хранятся в {path}/{key[:2]}/{key}.dcm, индекс (ключ -> размер файла) держится в памяти
+    и при первом обращении восстанавливается с диска в порядке времени последнего использования.
+    Суммарный размер ограничен: давно не использованные файлы удаляются
+    '''
+    def __init__(self, path: pathlib.Path = config.GENERATION_CACHE_PATH,
+                 max_bytes: int = config.generation_env.CACHE_BYTES) -> None:
+        self._path = path
+        self._index = LRUCache(maxsize=10_000_000, maxweight=max_bytes, weigher=lambda size: size,
+                               on_evict=self._remove)
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        # ссылка на файл кэша и удаление вытесненного файла не выполняются одновременно
+        self._files_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(capture_digest: str, params_key: str, model_version: str) -> str:
+        return hashlib.sha1(f'{capture_digest}:{params_key}:{model_version}'.encode()).hexdigest()
+
+    def get_path(self, key: str) -> pathlib.Path:
+        return self._path.joinpath(key[:2], f'{key}.dcm')
+
+    def get_tmp_path(self, key: str) -> pathlib.Path:
+        '''
+        Путь для записи результата перед put (в той же файловой системе, что и кэш)
+        '''
+        path = self.get_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path.with_name(f'.{key}.{os.getpid()}.{threading.get_ident()}.tmp')
+
+    def get(self, key: str, target: tp.Optional[pathlib.Path] = None) -> tp.Optional[pathlib.Path]:
+        '''
+        Путь к файлу кэша. Если задан target, на файл сразу создается жесткая ссылка:
+        вытеснение из кэша, выполненное после get, не удалит результат по ссылке
+        '''
+        self._load()
+        path = self.get_path(key)
+        with self._files_lock:
+            if self._index.get(key) is None:
+                return None
+            try:
+                # время изменения - время последнего использования (для восстановления индекса)
+                os.utime(path)
+            except FileNotFoundError:
+                self._index.pop(key)
+                return None
+            if target is not None:
+                self._link(path, target)
+        return path
+
+    def put(self, key: str, tmp_path: pathlib.Path, target: tp.Optional[pathlib.Path] = None) -> pathlib.Path:
+        '''
+        Помещение результата в кэш. Ссылка target создается до добавления в индекс,
+        пока файл не может быть вытеснен
+        '''
+        self._load()
+        path = self.get_path(key)
+        size = tmp_path.stat().st_size
+        with self._files_lock:
+            os.replace(tmp_path, path)
+            if target is not None:
+                self._link(path, target)
+        self._index.put(key, size)
+        return path
+
+    @staticmethod
+    def _link(path: pathlib.Path, target: pathlib.Path) -> None:
+        '''
+        Жесткая ссылка на файл кэша: файл остается доступным по target после вытеснения из кэша
+        '''
+        if target.exists():
+            return
+        try:
+            os.link(path, target)
+        except FileExistsError:
+            pass
+        except OSError:
+            # другая файловая система
+            shutil.copyfile(path, target)
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            entries = []
+            if self._path.exists():
+                for folder in os.scandir(self._path):
+                    if not folder.is_dir():
+                        continue
+                    for entry in os.scandir(folder.path):
+                        if entry.name.endswith('.dcm'):
+                            stat = entry.stat()
+                            entries.append((stat.st_mtime, entry.name[:-len('.dcm')], stat.st_size))
+                        elif entry.name.endswith('.tmp'):
+                            os.unlink(entry.path)
+            for _, key, size in sorted(entries):
+                self._index.put(key, size)
+            self._loaded = True
+
+    def _remove(self, key: str, size: int) -> None:
+        with self._files_lock:
+            try:
+                os.unlink(self.get_path(key))
+            except FileNotFoundError:
+                pass
@@ -1,12 +1,24 @@
 import typing as tp
 import pathlib
 import asyncio
-import os
+import time
 
 from fastapi import UploadFile
 
-from src.utils.dicom import remove_patient_personal_data
-from src.utils.storage import FileStorage
+from src.utils.dicom import (
+    ingest_dicom
+)
+from src.utils.storage import (
+    FileStorage,
+    SliceIndexMixin
+)
+from src.utils.slice_index import SliceIndex
+from src.utils.executors import (
+    ingest_semaphore,
+    get_cpu_executor,
+    run_io
+)
+from src.utils.metrics import observe_ingest
 from src.utils.other import ExtensionsValidators
 from src.utils.ct_loaders import (
     AsyncArchiveLoader,
@@ -14,8 +26,9 @@ from src.utils.ct_loaders import (
 )
 
 
-class TemporaryCTStorage(FileStorage):
+class TemporaryCTStorage(SliceIndexMixin, FileStorage):
     _CAPTURES_FOLDER = 'captures'
+    _GENERATED_FOLDER = 'generated'
     
     def create_empty_ct(self, foldername: tp.Optional[str] = None) -> tp.Optional[str]:
         if foldername is None:
@@ -34,14 +47,19 @@ class TemporaryCTStorage(FileStorage):
             return None
         
         if len(files) == 1 and ExtensionsValidators.is_archive(files[0].filename):
-            loader = AsyncArchiveLoader(files[0])
+            loader = AsyncArchiveLoader(files[0], processor=ingest_dicom, executor=get_cpu_executor())
         else:
-            loader = AsyncDicomListLoader(files)
+            loader = AsyncDicomListLoader(files, processor=ingest_dicom)
         
         path = self.get_path_to_folder(foldername).joinpath(self._CAPTURES_FOLDER)
-        loaded = await loader.load(path)
+        async with ingest_semaphore:
+            start = time.perf_counter()
+            loaded = await loader.load(path)
+            elapsed = time.perf_counter() - start
         if not loaded:
             return None
+        await run_io(observe_ingest, 'temp', path, loaded, elapsed)
+        self.save_index(foldername, SliceIndex.build(loader.metadata))
         return loaded  
 
     def get_captures_path(self, foldername: str) -> tp.Optional[pathlib.Path]:
@@ -52,29 +70,22 @@ class TemporaryCTStorage(FileStorage):
         captures_path = research_path.joinpath(self._CAPTURES_FOLDER)
         return captures_path
     
-    async def depersonalize(self, foldername: str) -> None:
-        if not self.is_exists(foldername):
-            return None
-        
-        captures_count = self.get_captures_count(foldername)
-        for i in range(1, captures_count+1):
-            capture_path = self.get_capture_path(foldername, i)
-            remove_patient_personal_data(capture_path)
-            await asyncio.sleep(0)
-            
-    def get_captures_count(self, foldername: str) -> int:
+    def get_generated_path(self, foldername: str, capture_num: int, key: str) -> tp.Optional[pathlib.Path]:
+        '''
+        Путь к результату генерации для среза (key - ключ кэша генерации)
+        '''
         if not self.is_exists(foldername):
             return None
         
-        path = self.get_path_to_folder(foldername)
-        return len(os.listdir(path.joinpath(self._CAPTURES_FOLDER)))
+        generated_path = self.get_path_to_folder(foldername).joinpath(self._GENERATED_FOLDER)
+        generated_path.mkdir(exist_ok=True)
+        return generated_path.joinpath(f'{capture_num}_{key}.dcm')
     
-    def get_capture_path(self, foldername: str, capture_num: int) -> tp.Optional[pathlib.Path]:
+    def get_generated_file(self, foldername: str, filename: str) -> tp.Optional[pathlib.Path]:
         if not self.is_exists(foldername):
             return None
         
-        captures_path = self.get_captures_path(foldername)
-        capture_path = captures_path.joinpath(f'{capture_num}.dcm')
-        if not capture_path.exists():
+        generated_path = self.get_path_to_folder(foldername).joinpath(self._GENERATED_FOLDER, pathlib.Path(filename).name)
+        if not generated_path.exists():
             return None
-        return capture_path
+        return generated_path
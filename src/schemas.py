@@ -1,10 +1,44 @@
 import pydantic as pd
 import typing as tp
+from enum import Enum
 
 
 class Error(pd.BaseModel):
     error: str
     error_description: str = pd.Field('')
-    
-    
 
+
+class WindowPreset(str, Enum):
+    default = 'default'
+    lung = 'lung'
+    mediastinum = 'mediastinum'
+    bone = 'bone'
+
+
+class ImageFormat(str, Enum):
+    jpeg = 'jpeg'
+    png = 'png'
+    webp = 'webp'
+
+    @property
+    def media_type(self) -> str:
+        return f'image/{self.value}'
+
+
+class MprPlane(str, Enum):
+    coronal = 'coronal'
+    sagittal = 'sagittal'
+
+
+class SeriesFormat(str, Enum):
+    zip = 'zip'
+    multipart = 'multipart'
+
+
+class RenderParams(pd.BaseModel):
+    preset: WindowPreset = WindowPreset.default
+    center: tp.Optional[float] = None
+    width: tp.Optional[float] = None
+    size: tp.Optional[int] = None
+    format: ImageFormat = ImageFormat.jpeg
+    quality: int
@@ -0,0 +1,76 @@
+import threading
+import typing as tp
+from collections import OrderedDict
+
+
+class LRUCache:
+    '''
+    Потокобезопасный кэш с вытеснением давно неиспользуемых записей.
+    Размер ограничивается количеством записей и (опционально) суммарным весом записей.
+    on_evict вызывается для вытесненных записей вне блокировки
+    '''
+    def __init__(self, maxsize: int = 256,
+                 maxweight: tp.Optional[int] = None,
+                 weigher: tp.Optional[tp.Callable[[tp.Any], int]] = None,
+                 on_evict: tp.Optional[tp.Callable[[tp.Hashable, tp.Any], None]] = None) -> None:
+        self._maxsize = maxsize
+        self._maxweight = maxweight
+        self._weigher = weigher
+        self._on_evict = on_evict
+        self._weight = 0
+        self._data: 'OrderedDict[tp.Hashable, tp.Any]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tp.Hashable, default: tp.Any = None) -> tp.Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: tp.Hashable, value: tp.Any) -> None:
+        with self._lock:
+            if key in self._data:
+                self._weight -= self._weigh(self._data.pop(key))
+            self._data[key] = value
+            self._weight += self._weigh(value)
+            evicted = self._evict()
+        if self._on_evict is not None:
+            for item in evicted:
+                self._on_evict(*item)
+
+    def pop(self, key: tp.Hashable, default: tp.Any = None) -> tp.Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data.pop(key)
+            self._weight -= self._weigh(value)
+            return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._weight = 0
+
+    def __contains__(self, key: tp.Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def weight(self) -> int:
+        return self._weight
+
+    def _weigh(self, value: tp.Any) -> int:
+        return self._weigher(value) if self._weigher is not None else 0
+
+    def _evict(self) -> tp.List[tp.Tuple[tp.Hashable, tp.Any]]:
+        evicted = []
+        while len(self._data) > self._maxsize or \
+                (self._maxweight is not None and self._weight > self._maxweight and len(self._data) > 1):
+            key, value = self._data.popitem(last=False)
+            self._weight -= self._weigh(value)
+            evicted.append((key, value))
+        return evicted
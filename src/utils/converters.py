@@ -29,7 +29,8 @@ class _b64:
     
     @staticmethod
     def to_bytes(value: bytes) -> bytes:
-        return base64.urlsafe_b64decode(value)
+        # в JWT base64url обычно без выравнивания "="
+        return base64.urlsafe_b64decode(value + b'=' * (-len(value) % 4))
     
     @classmethod
     def from_dict(cls, value: dict) -> str:
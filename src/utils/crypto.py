@@ -1,7 +1,9 @@
+from functools import lru_cache
 import uuid
 import secrets
 import hashlib
 import hmac
+import typing as tp
 from .converters import _str
 
 
@@ -17,9 +19,23 @@ def pbkdf2_hmac(string: str, salt: str, alg='sha512', iterations=50_000) -> str:
     return hashlib.pbkdf2_hmac(alg, string.encode(), salt.encode(), iterations).hex()
 
 
-def hs256(string: str, key: str) -> bytes:
-    return hmac.new(_str.to_bytes(key), _str.to_bytes(string), hashlib.sha256).digest()
+@lru_cache(maxsize=8)
+def hs256_key(key: str) -> 'hmac.HMAC':
+    '''
+    HMAC-SHA256 с заданным ключом: подготовка ключа выполняется один раз, подписи считаются копиями
+    '''
+    return hmac.new(_str.to_bytes(key), digestmod=hashlib.sha256)
+
+
+def hs256(string: tp.Union[str, bytes], key: str) -> bytes:
+    signer = hs256_key(key).copy()
+    signer.update(_str.to_bytes(string) if isinstance(string, str) else string)
+    return signer.digest()
 
 
 def compare_strings(s_1: str, s_2: str) -> bool:
     return secrets.compare_digest(s_1, s_2)
+
+
+def compare_bytes(b_1: bytes, b_2: bytes) -> bool:
+    return hmac.compare_digest(b_1, b_2)
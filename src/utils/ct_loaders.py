@@ -1,64 +1,296 @@
 import typing as tp
-import aiofiles
 import pathlib
 import asyncio
+import shutil
+import time
+from zipfile import ZipInfo
+from concurrent.futures import Executor
 
 from fastapi import UploadFile
 
+from src import config
+from src.utils.executors import (
+    io_executor,
+    run_io,
+    run_in_executor
+)
 from src.utils.temp_file import tempfile_context
+from src.utils.metrics import INGEST_DEPERSONALIZE
 from src.utils.other import (
     ExtensionsValidators,
+    ContentValidators,
     CustomZipFile
 )
 
 
+ProgressCallback = tp.Callable[[int, int], None]
+SliceMetadata = tp.Dict[str, tp.Any]
+SliceProcessor = tp.Callable[[tp.BinaryIO, pathlib.Path], tp.Optional[SliceMetadata]]
+
+
+def copy_fileobj_to_path(src: tp.BinaryIO, path: tp.Union[str, pathlib.Path],
+                         chunk_size: int = config.ingest_env.CHUNK_SIZE) -> int:
+    '''
+    Блочное копирование файлового объекта на диск (в памяти держится не более одного блока)
+    '''
+    src.seek(0)
+    written = 0
+    with open(path, 'wb') as dst:
+        while True:
+            data = src.read(chunk_size)
+            if not data: break
+            dst.write(data)
+            written += len(data)
+    return written
+
+
+def copy_dicom(src: tp.BinaryIO, path: pathlib.Path,
+               chunk_size: int = config.ingest_env.CHUNK_SIZE) -> tp.Optional[SliceMetadata]:
+    '''
+    Обработчик среза по умолчанию: проверка сигнатуры и блочное копирование без разбора
+    '''
+    header = src.read(ContentValidators.dicom_header_len())
+    if not ContentValidators.is_dicom(header):
+        return None
+    with open(path, 'wb') as dst:
+        dst.write(header)
+        shutil.copyfileobj(src, dst, chunk_size)
+    return {}
+
+
+def enumerate_slices(processed: tp.List[tp.Tuple[int, SliceMetadata]], path: pathlib.Path) -> tp.List[SliceMetadata]:
+    '''
+    Переименование обработанных срезов в 1.dcm..N.dcm в исходном порядке
+    '''
+    metadata = []
+    for capture_num, (num, meta) in enumerate(sorted(processed, key=lambda item: item[0]), start=1):
+        part_path(path, num).rename(path.joinpath(f'{capture_num}.dcm'))
+        metadata.append({**meta, 'capture_num': capture_num})
+    return metadata
+
+
+def part_path(path: pathlib.Path, num: int) -> pathlib.Path:
+    return path.joinpath(f'.{num}.part')
+
+
+async def stream_upload(file: UploadFile, path: tp.Union[str, pathlib.Path]) -> int:
+    '''
+    Потоковая запись загруженного файла на диск в пуле потоков
+    '''
+    return await run_io(copy_fileobj_to_path, file.file, path)
+
+
 class MarkupLoader:
     def __init__(self, file: UploadFile) -> None:
         self._file = file
-        
+
     async def load(self, path: pathlib.Path):
-        async with aiofiles.open(path, 'wb') as f:
-            await f.write(self._file.file.read())
+        await stream_upload(self._file, path)
 
 
 class AsyncDicomListLoader:
-    def __init__(self, files: tp.List[UploadFile]) -> None:
+    '''
+    Загрузка списка загруженных DICOM-файлов
+    '''
+    def __init__(self, files: tp.List[UploadFile],
+                 processor: SliceProcessor = copy_dicom,
+                 on_progress: tp.Optional[ProgressCallback] = None) -> None:
         self._files = files
-    
+        self._processor = processor
+        self._on_progress = on_progress
+        self.metadata: tp.List[SliceMetadata] = []
+
     async def load(self, path: pathlib.Path) -> int:
-        count = 0
-        for file in self._files:
-            if not ExtensionsValidators.is_dicom(file.filename):
-                continue
-    
-            count += 1
-            async with aiofiles.open(path.joinpath(f'{count}.dcm'), 'wb') as f:
-                await f.write(file.file.read())
-        return count
-    
+        dicoms = [file for file in self._files if ExtensionsValidators.is_dicom(file.filename)]
+        total = len(dicoms)
+        done = 0
+
+        async def process(file: UploadFile, target: pathlib.Path) -> tp.Optional[SliceMetadata]:
+            nonlocal done
+            meta = await run_io(self._process, file, target)
+            done += 1
+            if self._on_progress is not None:
+                self._on_progress(done, total)
+            return meta
+
+        results = await asyncio.gather(*(process(file, part_path(path, num)) for num, file in enumerate(dicoms)))
+        processed = [(num, meta) for num, meta in enumerate(results) if meta is not None]
+        self.metadata = await run_io(enumerate_slices, processed, path)
+        return len(self.metadata)
+
+    def _process(self, file: UploadFile, target: pathlib.Path) -> tp.Optional[SliceMetadata]:
+        with INGEST_DEPERSONALIZE.time():
+            file.file.seek(0)
+            return self._processor(file.file, target)
+
+
+def process_files(batch: tp.List[tp.Tuple[int, pathlib.Path]],
+                  path: pathlib.Path,
+                  processor: SliceProcessor) -> tp.Tuple[tp.List[tp.Tuple[int, SliceMetadata]], tp.List[float]]:
+    '''
+    Обработка пакета DICOM-файлов, сохраненных на диск
+    (функция уровня модуля, чтобы ее можно было выполнять в пуле процессов).
+    Возвращает метаданные обработанных срезов и время обработки каждого файла (для метрик)
+    '''
+    processed = []
+    durations = []
+    for num, file_path in batch:
+        start = time.perf_counter()
+        with open(file_path, 'rb') as src:
+            meta = processor(src, part_path(path, num))
+        durations.append(time.perf_counter() - start)
+        if meta is not None:
+            processed.append((num, meta))
+    return processed, durations
+
+
+class DicomFilesLoader:
+    '''
+    Загрузка DICOM-файлов, уже сохраненных на диск. Файлы делятся на пакеты,
+    пакеты обрабатываются параллельно в заданном пуле (как члены архива в ParallelZipExtractor)
+    '''
+    def __init__(self, files: tp.List[pathlib.Path],
+                 processor: SliceProcessor = copy_dicom,
+                 executor: Executor = io_executor,
+                 on_progress: tp.Optional[ProgressCallback] = None,
+                 batch_size: int = config.ingest_env.BATCH_SIZE) -> None:
+        self._files = files
+        self._processor = processor
+        self._executor = executor
+        self._on_progress = on_progress
+        self._batch_size = batch_size
+        self.metadata: tp.List[SliceMetadata] = []
+
+    async def load(self, path: pathlib.Path) -> int:
+        dicoms = [file for file in self._files if ExtensionsValidators.is_dicom(file.name)]
+        total = len(dicoms)
+        done = 0
+
+        async def process_batch(batch: tp.List[tp.Tuple[int, pathlib.Path]]) -> tp.List[tp.Tuple[int, SliceMetadata]]:
+            nonlocal done
+            processed, durations = await run_in_executor(self._executor, process_files, batch, path, self._processor)
+            for duration in durations:
+                INGEST_DEPERSONALIZE.observe(duration)
+            done += len(batch)
+            if self._on_progress is not None:
+                self._on_progress(done, total)
+            return processed
+
+        numbered = list(enumerate(dicoms))
+        batches = [numbered[i:i + self._batch_size] for i in range(0, total, self._batch_size)]
+        results = await asyncio.gather(*(process_batch(batch) for batch in batches))
+        processed = [item for batch_result in results for item in batch_result]
+        self.metadata = await run_io(enumerate_slices, processed, path)
+        return len(self.metadata)
+
+
+def extract_members(archive_path: tp.Union[str, pathlib.Path],
+                    batch: tp.List[tp.Tuple[int, ZipInfo]],
+                    path: pathlib.Path,
+                    processor: SliceProcessor) -> tp.Tuple[tp.List[tp.Tuple[int, SliceMetadata]], tp.List[float]]:
+    '''
+    Обработка пакета членов архива собственным экземпляром ZipFile
+    (функция уровня модуля, чтобы ее можно было выполнять в пуле процессов).
+    Возвращает метаданные обработанных срезов и время обработки каждого члена (для метрик)
+    '''
+    processed = []
+    durations = []
+    with CustomZipFile(archive_path) as zip_file:
+        for num, member in batch:
+            start = time.perf_counter()
+            with zip_file.open(member) as src:
+                meta = processor(src, part_path(path, num))
+            durations.append(time.perf_counter() - start)
+            if meta is not None:
+                processed.append((num, meta))
+    return processed, durations
+
+
+class ParallelZipExtractor:
+    '''
+    Параллельная распаковка DICOM-файлов из zip-архива.
+    Члены архива делятся на пакеты, пакеты обрабатываются параллельно в заданном пуле:
+    в пуле потоков (zlib освобождает GIL на время распаковки) или в пуле процессов,
+    если обработчик среза нагружает процессор.
+    Файл считается DICOM-файлом по сигнатуре, а не по расширению
+    '''
+    def __init__(self, archive_path: tp.Union[str, pathlib.Path],
+                 processor: SliceProcessor = copy_dicom,
+                 executor: Executor = io_executor,
+                 batch_size: int = config.ingest_env.BATCH_SIZE) -> None:
+        self._archive_path = archive_path
+        self._processor = processor
+        self._executor = executor
+        self._batch_size = batch_size
+        self.metadata: tp.List[SliceMetadata] = []
+
+    async def extract(self, path: pathlib.Path, on_progress: tp.Optional[ProgressCallback] = None) -> int:
+        members = await run_io(self._list_members)
+        total = len(members)
+        if not total:
+            return 0
+
+        done = 0
+
+        async def extract_batch(batch: tp.List[tp.Tuple[int, ZipInfo]]) -> tp.List[tp.Tuple[int, SliceMetadata]]:
+            nonlocal done
+            processed, durations = await run_in_executor(self._executor, extract_members,
+                                                         self._archive_path, batch, path, self._processor)
+            for duration in durations:
+                INGEST_DEPERSONALIZE.observe(duration)
+            done += len(batch)
+            if on_progress is not None:
+                on_progress(done, total)
+            return processed
+
+        numbered = list(enumerate(members))
+        batches = [numbered[i:i + self._batch_size] for i in range(0, total, self._batch_size)]
+        results = await asyncio.gather(*(extract_batch(batch) for batch in batches))
+        processed = [item for batch_result in results for item in batch_result]
+        self.metadata = await run_io(enumerate_slices, processed, path)
+        return len(self.metadata)
+
+    def _list_members(self) -> tp.List[ZipInfo]:
+        with CustomZipFile(self._archive_path) as zip_file:
+            return [member for member in zip_file.infolist() if not member.is_dir()]
+
+
+class ArchiveFileLoader:
+    '''
+    Загрузка срезов из архива, уже сохраненного на диск
+    '''
+    def __init__(self, archive_path: tp.Union[str, pathlib.Path],
+                 processor: SliceProcessor = copy_dicom,
+                 executor: Executor = io_executor,
+                 on_progress: tp.Optional[ProgressCallback] = None) -> None:
+        self._archive_path = archive_path
+        self._processor = processor
+        self._executor = executor
+        self._on_progress = on_progress
+        self.metadata: tp.List[SliceMetadata] = []
+
+    async def load(self, path: pathlib.Path) -> int:
+        extractor = ParallelZipExtractor(self._archive_path, self._processor, self._executor)
+        loaded = await extractor.extract(path, self._on_progress)
+        self.metadata = extractor.metadata
+        return loaded
+
 
 class AsyncArchiveLoader:
-    def __init__(self, file: UploadFile) -> None:
+    def __init__(self, file: UploadFile,
+                 processor: SliceProcessor = copy_dicom,
+                 executor: Executor = io_executor,
+                 on_progress: tp.Optional[ProgressCallback] = None) -> None:
         self._file = file
-        
+        self._processor = processor
+        self._executor = executor
+        self._on_progress = on_progress
+        self.metadata: tp.List[SliceMetadata] = []
+
     async def load(self, path: pathlib.Path) -> int:
         with tempfile_context() as t_path:
-            async with aiofiles.open(t_path, 'wb') as t_f:
-                while True:
-                    data = await self._file.read(1024*1024*5)
-                    if not data: break
-                    await t_f.write(data)
-            
-            zip_file = CustomZipFile(t_path)
-            count = 0
-            for file in zip_file.filelist:
-                if not ExtensionsValidators.is_dicom(file.filename):
-                    continue
-                count += 1  
-                zip_file.extract(member=file, path=path, parents=False, filename=f'{count}.dcm')
-                await asyncio.sleep(0)
-            
-        return count
-    
-    
-    
\ No newline at end of file
+            await stream_upload(self._file, t_path)
+            loader = ArchiveFileLoader(t_path, self._processor, self._executor, self._on_progress)
+            loaded = await loader.load(path)
+            self.metadata = loader.metadata
+            return loaded
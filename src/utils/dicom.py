@@ -1,18 +1,259 @@
+import typing as tp
+import pathlib
+import shutil
+import os
+
+import numpy as np
 import pydicom
-import matplotlib.pyplot as plt
+from pydicom.errors import InvalidDicomError
+from pydicom.multival import MultiValue
+from pydicom.uid import generate_uid, DeflatedExplicitVRLittleEndian, ExplicitVRLittleEndian
+from src import config
+from src.utils.other import ContentValidators
+from src.utils import rendering
 
-def dicom_to_image(path_to_dicom, path_to_save):
+
+# Тег PixelData (7FE0,0010) в little/big endian кодировке
+_PIXEL_DATA_TAG_LE = b'\xe0\x7f\x10\x00'
+_PIXEL_DATA_TAG_BE = b'\x7f\xe0\x00\x10'
+
+
+class DepersonalizationProfile:
+    '''
+    Профиль обезличивания: какие элементы очищаются, удаляются и какие UID заменяются.
+    Замена UID детерминирована (UID строится из исходного), поэтому срезы одной серии,
+    обработанные в разных процессах, остаются связанными
+    '''
+    def __init__(self,
+                 name: str,
+                 blank: tp.Iterable[str] = (),
+                 remove: tp.Iterable[str] = (),
+                 replace_uids: tp.Iterable[str] = (),
+                 remove_private: bool = False,
+                 method: tp.Optional[str] = None) -> None:
+        self.name = name
+        self.blank = tuple(blank)
+        self.remove = tuple(remove)
+        self.replace_uids = tuple(replace_uids)
+        self.remove_private = remove_private
+        self.method = method
+
+    def apply(self, ds: pydicom.Dataset) -> None:
+        for keyword in self.blank:
+            setattr(ds, keyword, None)
+        for keyword in self.remove:
+            if keyword in ds:
+                delattr(ds, keyword)
+        for keyword in self.replace_uids:
+            if keyword in ds:
+                setattr(ds, keyword, generate_uid(entropy_srcs=[str(ds.data_element(keyword).value)]))
+        if 'SOPInstanceUID' in self.replace_uids and 'SOPInstanceUID' in ds and hasattr(ds, 'file_meta'):
+            ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+        if self.remove_private:
+            ds.remove_private_tags()
+        ds.PatientIdentityRemoved = 'YES'
+        if self.method is not None:
+            ds.DeidentificationMethod = self.method
+
+
+PROFILES = {
+    # Исходный набор: очищаются только основные данные пациента
+    'minimal': DepersonalizationProfile(
+        'minimal',
+        blank=('PatientName', 'PatientID', 'PatientSex', 'PatientBirthDate'),
+    ),
+    # Основные элементы DICOM PS3.15 Basic Application Level Confidentiality Profile
+    'basic': DepersonalizationProfile(
+        'basic',
+        blank=('PatientName', 'PatientID', 'PatientSex', 'PatientBirthDate',
+               'AccessionNumber', 'ReferringPhysicianName', 'StudyID',
+               'StudyDate', 'StudyTime', 'ContentCreatorName'),
+        remove=('PatientBirthTime', 'PatientAge', 'PatientSize', 'PatientWeight', 'PatientAddress',
+                'PatientTelephoneNumbers', 'OtherPatientIDs', 'OtherPatientNames', 'EthnicGroup',
+                'PatientComments', 'AdditionalPatientHistory', 'MedicalRecordLocator',
+                'InstitutionName', 'InstitutionAddress', 'InstitutionalDepartmentName',
+                'ReferringPhysicianAddress', 'ReferringPhysicianTelephoneNumbers',
+                'PhysiciansOfRecord', 'PerformingPhysicianName', 'NameOfPhysiciansReadingStudy',
+                'OperatorsName', 'RequestingPhysician', 'StationName', 'DeviceSerialNumber'),
+        replace_uids=('StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID', 'FrameOfReferenceUID'),
+        remove_private=True,
+        method='DICOM PS3.15 Basic Application Level Confidentiality Profile',
+    ),
+}
+
+
+def get_profile(name: str = config.ingest_env.DEPERSONALIZATION_PROFILE) -> DepersonalizationProfile:
+    if name not in PROFILES:
+        raise ValueError(f'Unknown depersonalization profile: {name}')
+    return PROFILES[name]
+
+
+def read_pixels(path_to_dicom) -> tp.Tuple[np.ndarray, float, float, tp.Optional[rendering.Window]]:
+    '''
+    Чтение массива пикселей среза с параметрами перевода в HU и окном из файла
+    '''
     ds = pydicom.dcmread(path_to_dicom)
-    plt.imsave(path_to_save, ds.pixel_array, cmap=plt.bone())
+    slope = _to_float(ds.get('RescaleSlope')) or 1.0
+    intercept = _to_float(ds.get('RescaleIntercept')) or 0.0
+    center = _to_float(_first(ds.get('WindowCenter')))
+    width = _to_float(_first(ds.get('WindowWidth')))
+    window = rendering.Window(center, width) if center is not None and width else None
+    return ds.pixel_array, slope, intercept, window
+
+
+def dicom_to_image(path_to_dicom, path_to_save):
+    pixels, slope, intercept, _ = read_pixels(path_to_dicom)
+    image = rendering.render(pixels, slope, intercept, colormap='bone')
+    pathlib.Path(path_to_save).write_bytes(rendering.encode(image, 'jpeg', quality=95))
     return path_to_save
 
 
-def remove_patient_personal_data(path_to_dicom):
+def save_derived_dicom(path_to_dicom, hu: np.ndarray, path_to_save, description: str) -> None:
+    '''
+    Запись производного среза (например, результата генерации) на основе исходного файла:
+    пиксели заменяются значениями hu в кодировке исходного среза, UID серии и среза
+    строятся детерминированно из исходных и описания
+    '''
     ds = pydicom.dcmread(path_to_dicom)
-    ds.PatientName = None
-    ds.PatientID = None
-    ds.PatientSex = None
-    ds.PatientBirthDate = None
-    ds.PatientIdentityRemoved = 'YES'
-    ds.save_as(path_to_dicom)    
-    
+    slope = _to_float(ds.get('RescaleSlope')) or 1.0
+    intercept = _to_float(ds.get('RescaleIntercept')) or 0.0
+    dtype = ds.pixel_array.dtype
+    limits = np.iinfo(dtype)
+    stored = np.clip(np.rint((hu - intercept) / slope), limits.min, limits.max).astype(dtype)
+
+    ds.PixelData = stored.tobytes()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.is_little_endian, ds.is_implicit_VR = True, False
+    ds.ImageType = ['DERIVED', 'SECONDARY']
+    ds.SeriesDescription = description
+    ds.DerivationDescription = description
+    if 'SeriesInstanceUID' in ds:
+        ds.SeriesInstanceUID = generate_uid(entropy_srcs=[str(ds.SeriesInstanceUID), description])
+    if 'SOPInstanceUID' in ds:
+        ds.SOPInstanceUID = generate_uid(entropy_srcs=[str(ds.SOPInstanceUID), description])
+        ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+
+    path_to_save = pathlib.Path(path_to_save)
+    tmp_path = path_to_save.with_name(f'.{path_to_save.name}.tmp')
+    ds.save_as(tmp_path, write_like_original=False)
+    os.replace(tmp_path, path_to_save)
+
+
+def remove_patient_personal_data(path_to_dicom, profile_name: str = config.ingest_env.DEPERSONALIZATION_PROFILE):
+    '''
+    Обезличивание файла на месте (через временный файл и атомарную замену)
+    '''
+    path_to_dicom = pathlib.Path(path_to_dicom)
+    tmp_path = path_to_dicom.with_name(f'.{path_to_dicom.name}.tmp')
+    with open(path_to_dicom, 'rb') as src:
+        meta = depersonalize_stream(src, tmp_path, get_profile(profile_name))
+    if meta is None:
+        return
+    os.replace(tmp_path, path_to_dicom)
+
+
+def get_slice_metadata(ds: pydicom.Dataset) -> tp.Dict[str, tp.Any]:
+    '''
+    Метаданные среза: порядок в серии, геометрия и параметры окна по умолчанию
+    '''
+    return {
+        'instance_number': _to_int(ds.get('InstanceNumber')),
+        'slice_location': _to_float(ds.get('SliceLocation')),
+        'image_position': _to_floats(ds.get('ImagePositionPatient')),
+        'image_orientation': _to_floats(ds.get('ImageOrientationPatient')),
+        'pixel_spacing': _to_floats(ds.get('PixelSpacing')),
+        'slice_thickness': _to_float(ds.get('SliceThickness')),
+        'rows': _to_int(ds.get('Rows')),
+        'columns': _to_int(ds.get('Columns')),
+        'window_center': _to_float(_first(ds.get('WindowCenter'))),
+        'window_width': _to_float(_first(ds.get('WindowWidth'))),
+        'rescale_slope': _to_float(ds.get('RescaleSlope')),
+        'rescale_intercept': _to_float(ds.get('RescaleIntercept')),
+    }
+
+
+def _first(value: tp.Any) -> tp.Any:
+    if isinstance(value, MultiValue):
+        return value[0] if len(value) else None
+    return value
+
+
+def _to_int(value: tp.Any) -> tp.Optional[int]:
+    return int(value) if value not in (None, '') else None
+
+
+def _to_float(value: tp.Any) -> tp.Optional[float]:
+    return float(value) if value not in (None, '') else None
+
+
+def _to_floats(value: tp.Any) -> tp.Optional[tp.List[float]]:
+    return [float(item) for item in value] if value else None
+
+
+def depersonalize_stream(src: tp.BinaryIO,
+                         path_to_save: pathlib.Path,
+                         profile: DepersonalizationProfile,
+                         chunk_size: int = config.ingest_env.CHUNK_SIZE) -> tp.Optional[tp.Dict[str, tp.Any]]:
+    '''
+    Обезличивание с перезаписью только заголовка: разбирается набор данных до PixelData,
+    заголовок записывается заново, а байты PixelData копируются без декодирования.
+    Если файл не позволяет безопасно скопировать хвост (сжатый набор данных и т.п.),
+    выполняется полная перезапись.
+    Возвращает метаданные среза или None, если файл не является DICOM-файлом
+    '''
+    src.seek(0)
+    header = src.read(ContentValidators.dicom_header_len())
+    if not ContentValidators.is_dicom(header):
+        return None
+    src.seek(0)
+
+    try:
+        ds = pydicom.dcmread(src, stop_before_pixels=True)
+    except InvalidDicomError:
+        return None
+    pixel_data_offset = src.tell()
+
+    if not _is_at_pixel_data(src, ds, pixel_data_offset):
+        return _depersonalize_full(src, path_to_save, profile)
+
+    meta = get_slice_metadata(ds)
+    profile.apply(ds)
+    with open(path_to_save, 'wb') as dst:
+        ds.save_as(dst, write_like_original=True)
+        src.seek(pixel_data_offset)
+        shutil.copyfileobj(src, dst, chunk_size)
+    return meta
+
+
+def _is_at_pixel_data(src: tp.BinaryIO, ds: pydicom.Dataset, offset: int) -> bool:
+    '''
+    Проверка, что разбор остановился ровно на элементе PixelData (или в конце файла)
+    '''
+    transfer_syntax = ds.file_meta.get('TransferSyntaxUID') if hasattr(ds, 'file_meta') else None
+    if transfer_syntax == DeflatedExplicitVRLittleEndian:
+        return False
+    tag = src.read(4)
+    src.seek(offset)
+    if not tag:
+        return True
+    return tag == (_PIXEL_DATA_TAG_LE if ds.is_little_endian else _PIXEL_DATA_TAG_BE)
+
+
+def _depersonalize_full(src: tp.BinaryIO,
+                        path_to_save: pathlib.Path,
+                        profile: DepersonalizationProfile) -> tp.Dict[str, tp.Any]:
+    src.seek(0)
+    ds = pydicom.dcmread(src)
+    meta = get_slice_metadata(ds)
+    profile.apply(ds)
+    ds.save_as(path_to_save)
+    return meta
+
+
+def ingest_dicom(src: tp.BinaryIO, path_to_save: pathlib.Path) -> tp.Optional[tp.Dict[str, tp.Any]]:
+    '''
+    Однопроходная обработка загружаемого среза: разбор заголовка, удаление персональных данных
+    по настроенному профилю, запись обезличенного файла и сбор метаданных.
+    Возвращает None, если файл не является DICOM-файлом
+    '''
+    return depersonalize_stream(src, path_to_save, get_profile())
@@ -0,0 +1,63 @@
+import asyncio
+import functools
+import multiprocessing
+import typing as tp
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+
+from src import config
+
+
+# Пул потоков для блокирующих операций ввода-вывода (чтение загрузок, запись на диск)
+io_executor = ThreadPoolExecutor(max_workers=config.ingest_env.WORKERS, thread_name_prefix='io')
+
+# Пул потоков для хэширования паролей (hashlib.pbkdf2_hmac освобождает GIL)
+password_executor = ThreadPoolExecutor(max_workers=config.password_env.WORKERS, thread_name_prefix='password')
+
+# Пул процессов для ресурсоемких операций (создается при первом обращении)
+_cpu_executor: tp.Optional[ProcessPoolExecutor] = None
+
+# Ограничение количества одновременно обрабатываемых загрузок исследований
+ingest_semaphore = asyncio.Semaphore(config.ingest_env.MAX_CONCURRENCY)
+
+
+def get_cpu_executor() -> ProcessPoolExecutor:
+    '''
+    Получение пула процессов. Используется spawn, чтобы не копировать потоки и цикл событий приложения
+    '''
+    global _cpu_executor
+    if _cpu_executor is None:
+        _cpu_executor = ProcessPoolExecutor(max_workers=config.ingest_env.CPU_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+    return _cpu_executor
+
+
+async def run_in_executor(executor: Executor, func: tp.Callable, *args, **kwargs) -> tp.Any:
+    '''
+    Выполнение блокирующей функции в заданном пуле без блокировки цикла событий
+    '''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_io(func: tp.Callable, *args, **kwargs) -> tp.Any:
+    '''
+    Выполнение блокирующей операции ввода-вывода в пуле потоков
+    '''
+    return await run_in_executor(io_executor, func, *args, **kwargs)
+
+
+async def run_cpu(func: tp.Callable, *args, **kwargs) -> tp.Any:
+    '''
+    Выполнение ресурсоемкой операции в пуле процессов (функция и аргументы должны сериализоваться pickle)
+    '''
+    return await run_in_executor(get_cpu_executor(), func, *args, **kwargs)
+
+
+def shutdown() -> None:
+    '''
+    Остановка пулов при завершении работы приложения
+    '''
+    io_executor.shutdown(wait=False)
+    password_executor.shutdown(wait=False)
+    if _cpu_executor is not None:
+        _cpu_executor.shutdown(wait=False)
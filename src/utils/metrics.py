@@ -0,0 +1,295 @@
+from abc import ABCMeta, abstractmethod
+import bisect
+import os
+import pathlib
+import threading
+import time
+import typing as tp
+
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.utils.cache import LRUCache
+
+
+LabelValues = tp.Tuple[str, ...]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(11))  # 256 Б - 256 МБ
+CONTENT_TYPE = 'text/plain; version=0.0.4'  # charset добавляет Response
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _format_labels(names: tp.Sequence[str], values: tp.Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + '}'
+
+
+class Registry:
+    '''
+    Набор метрик приложения, отдаваемый в текстовом формате Prometheus
+    '''
+    def __init__(self) -> None:
+        self._metrics: tp.List['Metric'] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: 'Metric') -> None:
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class Metric(metaclass=ABCMeta):
+    '''
+    Метрика с набором меток: значения меток передаются именованными аргументами
+    '''
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: tp.Sequence[str] = (), registry: Registry = registry) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: tp.Dict[str, tp.Any]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def render(self) -> tp.List[str]:
+        pass
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: tp.Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: tp.Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> tp.List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in values]
+
+
+class Gauge(Metric):
+    '''
+    Текущее значение. Значение без меток может вычисляться при каждом чтении (set_function)
+    '''
+    type = 'gauge'
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: tp.Dict[LabelValues, float] = {}
+        self._function: tp.Optional[tp.Callable[[], float]] = None
+
+    def set(self, value: float, **labels: tp.Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: tp.Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: tp.Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: tp.Callable[[], float]) -> None:
+        self._function = function
+
+    def render(self) -> tp.List[str]:
+        if self._function is not None:
+            return [f'{self.name} {_format_value(self._function())}']
+        with self._lock:
+            values = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in values]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, *args, buckets: tp.Sequence[float] = LATENCY_BUCKETS, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # на каждый набор меток: количество наблюдений по корзинам (не накопительно) и сумма
+        self._values: tp.Dict[LabelValues, tp.Tuple[tp.List[int], tp.List[float]]] = {}
+
+    def observe(self, value: float, **labels: tp.Any) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * len(self._buckets), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> tp.List[str]:
+        with self._lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        lines = []
+        names = self.labelnames + ('le',)
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self._buckets, counts):
+                cumulative += count
+                labels = _format_labels(names, key + (_format_value(bound),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+    def time(self, **labels: tp.Any) -> '_Timer':
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: tp.Dict[str, tp.Any]) -> None:
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self) -> '_Timer':
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+
+
+# HTTP
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests by route and status', ('method', 'route', 'status'))
+HTTP_REQUEST_DURATION = Histogram('http_request_duration_seconds', 'HTTP request latency until the response is sent',
+                                  ('method', 'route'))
+HTTP_REQUEST_SIZE = Histogram('http_request_size_bytes', 'HTTP request body size', ('method', 'route'),
+                              buckets=SIZE_BUCKETS)
+HTTP_RESPONSE_SIZE = Histogram('http_response_size_bytes', 'HTTP response body size', ('method', 'route'),
+                               buckets=SIZE_BUCKETS)
+HTTP_IN_FLIGHT = Gauge('http_requests_in_flight', 'HTTP requests being processed', ('method', 'route'))
+
+# Пул подключений к базе данных
+DB_POOL_SIZE = Gauge('db_pool_size', 'Open connections in the database pool')
+DB_POOL_IDLE = Gauge('db_pool_idle', 'Idle connections in the database pool')
+DB_POOL_MAX_SIZE = Gauge('db_pool_max_size', 'Maximum size of the database pool')
+DB_POOL_ACQUIRE = Histogram('db_pool_acquire_seconds', 'Time spent waiting for a database connection')
+
+# Загрузка исследований
+INGEST_SLICES = Counter('ingest_slices_total', 'Slices ingested into storage', ('storage',))
+INGEST_BYTES = Counter('ingest_bytes_written_total', 'Bytes of depersonalized slices written to storage', ('storage',))
+INGEST_DURATION = Histogram('ingest_duration_seconds', 'Time to load, depersonalize and write a series',
+                            ('storage',))
+INGEST_DEPERSONALIZE = Histogram('ingest_depersonalize_seconds', 'Time to depersonalize and write one slice')
+
+
+def observe_ingest(storage: str, path: pathlib.Path, slices: int, seconds: float) -> None:
+    '''
+    Учет загруженной серии: количество срезов, размер записанных файлов (папка срезов), время загрузки
+    '''
+    INGEST_SLICES.inc(slices, storage=storage)
+    INGEST_BYTES.inc(sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file()), storage=storage)
+    INGEST_DURATION.observe(seconds, storage=storage)
+
+
+class MetricsMiddleware:
+    '''
+    Метрики HTTP по маршрутам: задержка, размер запроса и ответа, количество обрабатываемых запросов.
+    Метка route - шаблон пути маршрута (/research/{research_id}/...), а не сам путь,
+    чтобы количество рядов не зависело от идентификаторов в запросах
+    '''
+    _UNMATCHED = '<unmatched>'
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._routes = LRUCache(maxsize=10_000)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        labels = {'method': scope['method'], 'route': self._get_route(scope)}
+        status = 500
+        request_size = response_size = 0
+
+        async def receive_wrapper() -> Message:
+            nonlocal request_size
+            message = await receive()
+            if message['type'] == 'http.request':
+                request_size += len(message.get('body', b''))
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, response_size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                response_size += len(message.get('body', b''))
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(**labels)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec(**labels)
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, **labels)
+            HTTP_REQUEST_SIZE.observe(request_size, **labels)
+            HTTP_RESPONSE_SIZE.observe(response_size, **labels)
+            HTTP_REQUESTS.inc(status=status, **labels)
+
+    def _get_route(self, scope: Scope) -> str:
+        key = (scope['method'], scope['path'])
+        route = self._routes.get(key)
+        if route is None:
+            route = self._match_route(scope)
+            self._routes.put(key, route)
+        return route
+
+    def _match_route(self, scope: Scope) -> str:
+        app = scope.get('app')
+        partial = None
+        for route in getattr(app, 'routes', ()):
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+            if match == Match.PARTIAL and partial is None:
+                partial = route.path
+        return partial or self._UNMATCHED
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    '''
+    Метрики приложения в текстовом формате Prometheus
+    '''
+    return Response(registry.render(), media_type=CONTENT_TYPE)
@@ -92,4 +92,17 @@ class ExtensionsValidators:
         return os.path.splitext(filename)[1]
 
 
+class ContentValidators:
+    _dicom_preamble_len = 128
+    _dicom_magic = b'DICM'
 
+    @classmethod
+    def dicom_header_len(cls) -> int:
+        return cls._dicom_preamble_len + len(cls._dicom_magic)
+
+    @classmethod
+    def is_dicom(cls, header: bytes) -> bool:
+        '''
+        Проверка сигнатуры DICOM-файла ("DICM" после 128-байтной преамбулы)
+        '''
+        return header[cls._dicom_preamble_len:cls.dicom_header_len()] == cls._dicom_magic
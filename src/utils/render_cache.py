@@ -0,0 +1,92 @@
+import threading
+import typing as tp
+import pathlib
+import hashlib
+import os
+
+from src import config
+from src.utils.cache import LRUCache
+
+
+class RenderCache:
+    '''
+    Двухуровневый кэш отрисованных изображений срезов.
+    Первый уровень - общий для процесса LRU-кэш в памяти, ограниченный суммарным объемом,
+    второй - файлы в папке renders исследования, ограниченные количеством.
+    Файлы папки учитываются в LRU-индексе в памяти, который строится по содержимому папки
+    один раз при первом обращении к ней в процессе; вытесненные из индекса файлы удаляются.
+    Ключ кэша - (исследование, срез, параметры отрисовки)
+    '''
+    _memory = LRUCache(maxsize=1_000_000,
+                       maxweight=config.render_env.MEMORY_CACHE_BYTES,
+                       weigher=len)
+    # индексы файлов по папкам; индекс вытесненной папки строится заново при следующем обращении
+    _indexes = LRUCache(maxsize=1024)
+    _indexes_lock = threading.Lock()
+
+    def __init__(self, path: pathlib.Path, max_files: int = config.render_env.DISK_CACHE_FILES) -> None:
+        self._path = path
+        self._max_files = max_files
+
+    @staticmethod
+    def make_key(*parts: tp.Any) -> str:
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def peek(self, key: str) -> tp.Optional[bytes]:
+        '''
+        Поиск только в памяти (без обращения к диску)
+        '''
+        return self._memory.get(key)
+
+    def get(self, key: str) -> tp.Optional[bytes]:
+        data = self._memory.get(key)
+        if data is not None:
+            return data
+
+        file_path = self._path.joinpath(key)
+        try:
+            data = file_path.read_bytes()
+        except FileNotFoundError:
+            return None
+        self._memory.put(key, data)
+        self._get_index().get(key)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        self._memory.put(key, data)
+        self._path.mkdir(exist_ok=True)
+        tmp_path = self._path.joinpath(f'.{key}.tmp')
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, self._path.joinpath(key))
+        self._get_index().put(key, True)
+
+    def _get_index(self) -> LRUCache:
+        index = self._indexes.get(str(self._path))
+        if index is not None:
+            return index
+        with self._indexes_lock:
+            index = self._indexes.get(str(self._path))
+            if index is None:
+                index = self._build_index()
+                self._indexes.put(str(self._path), index)
+        return index
+
+    def _build_index(self) -> LRUCache:
+        '''
+        Индекс существующих файлов папки от старых к новым (временные файлы записи не учитываются)
+        '''
+        index = LRUCache(maxsize=self._max_files, on_evict=self._remove)
+        try:
+            entries = [entry for entry in os.scandir(self._path) if not entry.name.endswith('.tmp')]
+        except FileNotFoundError:
+            return index
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            index.put(entry.name, True)
+        return index
+
+    def _remove(self, key: str, _: tp.Any) -> None:
+        try:
+            os.unlink(self._path.joinpath(key))
+        except FileNotFoundError:
+            pass
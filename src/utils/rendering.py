@@ -0,0 +1,139 @@
+import typing as tp
+import functools
+import io
+
+import numpy as np
+from PIL import Image
+
+
+# Предустановленные окна (центр, ширина) в единицах Хаунсфилда
+WINDOW_PRESETS = {
+    'lung': (-600.0, 1500.0),
+    'mediastinum': (50.0, 350.0),
+    'bone': (400.0, 1800.0),
+}
+
+# Опорные точки палитры bone (совпадает с палитрой matplotlib, использовавшейся для превью)
+_BONE_SEGMENTS = {
+    'red': ((0.0, 0.0), (0.746032, 0.652778), (1.0, 1.0)),
+    'green': ((0.0, 0.0), (0.365079, 0.319444), (0.746032, 0.777778), (1.0, 1.0)),
+    'blue': ((0.0, 0.0), (0.365079, 0.444444), (1.0, 1.0)),
+}
+
+
+def _build_colormap(segments: tp.Dict[str, tp.Tuple[tp.Tuple[float, float], ...]]) -> np.ndarray:
+    x = np.linspace(0.0, 1.0, 256)
+    channels = []
+    for channel in ('red', 'green', 'blue'):
+        points = segments[channel]
+        channels.append(np.interp(x, [p[0] for p in points], [p[1] for p in points]))
+    return np.round(np.stack(channels, axis=-1) * 255).astype(np.uint8)
+
+
+# Палитры: 256 значений яркости -> RGB. Для 'gray' палитра не применяется
+COLORMAPS = {
+    'gray': None,
+    'bone': _build_colormap(_BONE_SEGMENTS),
+}
+
+
+class Window(tp.NamedTuple):
+    center: float
+    width: float
+
+
+def auto_window(pixels: np.ndarray, slope: float = 1.0, intercept: float = 0.0) -> Window:
+    '''
+    Окно по диапазону значений среза (или серии)
+    '''
+    low = float(pixels.min()) * slope + intercept
+    high = float(pixels.max()) * slope + intercept
+    if low > high:
+        low, high = high, low
+    return Window((low + high) / 2, max(high - low, 1.0))
+
+
+def window_to_uint8(hu: np.ndarray, window: Window) -> np.ndarray:
+    low = window.center - window.width / 2
+    return np.clip((hu - low) * (255.0 / window.width), 0, 255).astype(np.uint8)
+
+
+@functools.lru_cache(maxsize=64)
+def build_lut(dtype: str, slope: float, intercept: float, window: Window, colormap: str = 'gray') -> np.ndarray:
+    '''
+    Таблица преобразования хранимого значения пикселя в итоговый цвет:
+    перевод в HU, применение окна и палитры. Таблица индексируется битовым
+    представлением значения (для 16-битных данных - 65536 записей)
+    '''
+    dtype = np.dtype(dtype)
+    unsigned = np.dtype(f'u{dtype.itemsize}')
+    values = np.arange(1 << (8 * dtype.itemsize), dtype=unsigned).view(dtype)
+    lut = window_to_uint8(values.astype(np.float32) * slope + intercept, window)
+    palette = COLORMAPS[colormap]
+    if palette is not None:
+        lut = palette[lut]
+    lut.setflags(write=False)
+    return lut
+
+
+def render(pixels: np.ndarray,
+           slope: float = 1.0,
+           intercept: float = 0.0,
+           window: tp.Optional[Window] = None,
+           colormap: str = 'gray') -> np.ndarray:
+    '''
+    Отрисовка среза или стопки срезов (N, H, W) за один векторизованный проход.
+    Целочисленные данные до 16 бит преобразуются через таблицу (LUT),
+    остальные - вычислением по формуле.
+    Возвращает uint8 массив (..., H, W) или (..., H, W, 3) для цветных палитр
+    '''
+    if window is None:
+        window = auto_window(pixels, slope, intercept)
+    window = Window(float(window[0]), float(window[1]))
+
+    if pixels.dtype.kind in 'iu' and pixels.dtype.itemsize <= 2:
+        lut = build_lut(pixels.dtype.str, float(slope), float(intercept), window, colormap)
+        unsigned = np.dtype(f'u{pixels.dtype.itemsize}')
+        return lut[pixels.view(unsigned)]
+
+    image = window_to_uint8(pixels.astype(np.float32) * slope + intercept, window)
+    palette = COLORMAPS[colormap]
+    return palette[image] if palette is not None else image
+
+
+def render_batch(stack: np.ndarray,
+                 slope: float = 1.0,
+                 intercept: float = 0.0,
+                 window: tp.Optional[Window] = None,
+                 colormap: str = 'gray') -> np.ndarray:
+    '''
+    Отрисовка серии с общим окном (окно по умолчанию вычисляется по всей серии)
+    '''
+    if window is None:
+        window = auto_window(stack, slope, intercept)
+    return render(stack, slope, intercept, window, colormap)
+
+
+def scale_height(image: np.ndarray, factor: float) -> np.ndarray:
+    '''
+    Растяжение изображения по вертикали (приведение анизотропного вокселя к квадратному пикселю)
+    '''
+    height = max(int(round(image.shape[0] * factor)), 1)
+    if height == image.shape[0]:
+        return image
+    return np.asarray(Image.fromarray(image).resize((image.shape[1], height), Image.BILINEAR))
+
+
+def encode(image: np.ndarray,
+           image_format: str = 'jpeg',
+           quality: int = 85,
+           size: tp.Optional[int] = None) -> bytes:
+    '''
+    Масштабирование (по большей стороне до size) и кодирование изображения
+    '''
+    pil_image = Image.fromarray(image)
+    if size is not None:
+        pil_image.thumbnail((size, size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    pil_image.save(buffer, format=image_format.upper(), quality=quality)
+    return buffer.getvalue()
@@ -0,0 +1,140 @@
+import typing as tp
+import pathlib
+import hashlib
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Request
+from fastapi.responses import Response, FileResponse, StreamingResponse
+
+from src.utils.cache import LRUCache
+from src.utils.executors import run_io
+
+
+# Политики кэширования для разных типов ресурсов
+CACHE_IMMUTABLE = 'private, max-age=31536000, immutable'  # срезы не меняются после загрузки
+CACHE_PREVIEW = 'private, max-age=86400'
+CACHE_REVALIDATE = 'private, no-cache'  # разметка может меняться, клиент проверяет актуальность
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+_CHUNK_SIZE = 64 * 1024
+
+# Хэши содержимого файлов: ключ - (путь, время изменения, размер)
+_digests = LRUCache(maxsize=65536)
+
+
+def file_digest(path: tp.Union[str, pathlib.Path], stat: os.stat_result) -> str:
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    digest = _digests.get(key)
+    if digest is None:
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+                sha1.update(chunk)
+        digest = sha1.hexdigest()
+        _digests.put(key, digest)
+    return digest
+
+
+def file_etag(path: tp.Union[str, pathlib.Path], stat: os.stat_result, by_content: bool = False) -> str:
+    '''
+    ETag файла: хэш содержимого (кэшируется) или время изменения и размер
+    '''
+    if by_content:
+        return f'"{file_digest(path, stat)}"'
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def is_not_modified(request: Request, etag: str, last_modified: tp.Optional[float] = None) -> bool:
+    '''
+    Проверка условных заголовков If-None-Match / If-Modified-Since
+    '''
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+    if_modified_since = request.headers.get('If-Modified-Since')
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(last_modified) <= since
+    return False
+
+
+async def file_response(request: Request,
+                        path: tp.Union[str, pathlib.Path],
+                        cache_control: str,
+                        media_type: tp.Optional[str] = None,
+                        etag_by_content: bool = False) -> Response:
+    '''
+    Отдача файла с валидаторами (ETag, Last-Modified), ответом 304 на условные запросы
+    и поддержкой запросов диапазона (Range/If-Range, один диапазон)
+    '''
+    stat, etag = await run_io(_stat_with_etag, path, etag_by_content)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+        'Cache-Control': cache_control,
+        'Accept-Ranges': 'bytes',
+    }
+    if is_not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if range_header is not None and (if_range is None or if_range == etag):
+        byte_range = _parse_range(range_header, stat.st_size)
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, 'Content-Range': f'bytes */{stat.st_size}'})
+        if byte_range != (0, stat.st_size - 1):
+            start, end = byte_range
+            headers['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+            headers['Content-Length'] = str(end - start + 1)
+            return StreamingResponse(_read_range(path, start, end), status_code=206,
+                                     media_type=media_type, headers=headers)
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat)
+
+
+def _stat_with_etag(path: tp.Union[str, pathlib.Path], by_content: bool) -> tp.Tuple[os.stat_result, str]:
+    stat = os.stat(path)
+    return stat, file_etag(path, stat, by_content)
+
+
+def _parse_range(range_header: str, size: int) -> tp.Optional[tp.Tuple[int, int]]:
+    '''
+    Разбор заголовка Range. Несколько диапазонов не поддерживаются - отдается весь файл.
+    Возвращает None, если диапазон невыполним
+    '''
+    match = _RANGE_RE.match(range_header.strip())
+    if match is None:
+        return (0, size - 1)
+    start, end = match.groups()
+    if not start and not end:
+        return (0, size - 1)
+    if not start:
+        suffix = int(end)
+        if suffix == 0 or size == 0:
+            return None
+        return (max(size - suffix, 0), size - 1)
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return None
+    return (start, end)
+
+
+def _read_range(path: tp.Union[str, pathlib.Path], start: int, end: int) -> tp.Iterator[bytes]:
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
@@ -0,0 +1,122 @@
+import typing as tp
+import pathlib
+import zipfile
+import uuid
+import zlib
+
+
+# Срез серии: (номер среза в API, путь к файлу)
+SeriesItem = tp.Tuple[int, pathlib.Path]
+
+_CHUNK_SIZE = 64 * 1024
+
+
+class _StreamBuffer:
+    '''
+    Буфер для записи zip-архива в поток. Метода tell нет, поэтому ZipFile
+    пишет архив как в неперематываемый поток (размеры сжатых членов - в дескрипторах данных)
+    '''
+    def __init__(self) -> None:
+        self._chunks: tp.List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(items: tp.Iterable[SeriesItem], compress: bool = False, compress_level: int = 6) -> tp.Iterator[bytes]:
+    '''
+    Zip-архив серии, собираемый на лету без временных файлов.
+    В памяти держится не более одного блока среза
+    '''
+    buffer = _StreamBuffer()
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with zipfile.ZipFile(buffer, 'w', compression=compression, compresslevel=compress_level if compress else None) as archive:
+        for slice_num, path in items:
+            if compress:
+                members = _iter_deflated(archive, buffer, slice_num, path)
+            else:
+                members = _iter_stored(archive, buffer, slice_num, path)
+            for data in members:
+                if data:
+                    yield data
+    yield buffer.drain()
+
+
+def _iter_deflated(archive: zipfile.ZipFile, buffer: _StreamBuffer,
+                   slice_num: int, path: pathlib.Path) -> tp.Iterator[bytes]:
+    with open(path, 'rb') as src, archive.open(f'{slice_num}.dcm', 'w') as dst:
+        for chunk in iter(lambda: src.read(_CHUNK_SIZE), b''):
+            dst.write(chunk)
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def _iter_stored(archive: zipfile.ZipFile, buffer: _StreamBuffer,
+                 slice_num: int, path: pathlib.Path) -> tp.Iterator[bytes]:
+    '''
+    Член архива без сжатия: CRC и размер считаются заранее (первый проход по файлу) и пишутся
+    в локальный заголовок, без дескриптора данных - такие архивы читают и потоковые распаковщики.
+    Запись идет через archive.fp, чтобы ZipFile учел смещения и записал член в центральный каталог
+    '''
+    crc = 0
+    with open(path, 'rb') as src:
+        for chunk in iter(lambda: src.read(_CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+
+    zinfo = zipfile.ZipInfo.from_file(path, f'{slice_num}.dcm')
+    zinfo.compress_type = zipfile.ZIP_STORED
+    zinfo.compress_size = zinfo.file_size
+    zinfo.CRC = crc
+    zinfo.header_offset = archive.fp.tell()
+    archive.fp.write(zinfo.FileHeader(zinfo.file_size > zipfile.ZIP64_LIMIT))
+    with open(path, 'rb') as src:
+        for chunk in iter(lambda: src.read(_CHUNK_SIZE), b''):
+            archive.fp.write(chunk)
+            yield buffer.drain()
+    archive.filelist.append(zinfo)
+    archive.NameToInfo[zinfo.filename] = zinfo
+    archive.start_dir = archive.fp.tell()
+
+
+def make_boundary() -> str:
+    return uuid.uuid4().hex
+
+
+def iter_multipart(items: tp.Iterable[SeriesItem], boundary: str) -> tp.Iterator[bytes]:
+    '''
+    Поток multipart/mixed: каждая часть - DICOM-файл среза с номером в Content-Location
+    '''
+    for slice_num, path in items:
+        headers = (f'--{boundary}\r\n'
+                   'Content-Type: application/dicom\r\n'
+                   f'Content-Length: {path.stat().st_size}\r\n'
+                   f'Content-Location: {slice_num}\r\n'
+                   '\r\n')
+        yield headers.encode()
+        with open(path, 'rb') as src:
+            for chunk in iter(lambda: src.read(_CHUNK_SIZE), b''):
+                yield chunk
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+
+def gzip_stream(stream: tp.Iterable[bytes], compress_level: int = 6) -> tp.Iterator[bytes]:
+    '''
+    Сжатие потока в формат gzip (для ответа с Content-Encoding: gzip)
+    '''
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in stream:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
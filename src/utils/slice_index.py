@@ -0,0 +1,117 @@
+import typing as tp
+import pathlib
+import statistics
+
+import pydantic as pd
+
+
+class SliceInfo(pd.BaseModel):
+    capture_num: int
+    instance_number: tp.Optional[int] = None
+    slice_location: tp.Optional[float] = None
+    image_position: tp.Optional[tp.List[float]] = None
+
+
+class SeriesGeometry(pd.BaseModel):
+    rows: tp.Optional[int] = None
+    columns: tp.Optional[int] = None
+    pixel_spacing: tp.Optional[tp.List[float]] = None
+    slice_thickness: tp.Optional[float] = None
+    spacing_between_slices: tp.Optional[float] = None
+    image_orientation: tp.Optional[tp.List[float]] = None
+    window_center: tp.Optional[float] = None
+    window_width: tp.Optional[float] = None
+    rescale_slope: float = 1.0
+    rescale_intercept: float = 0.0
+
+
+class SliceIndex(pd.BaseModel):
+    '''
+    Индекс срезов исследования, строится один раз при загрузке.
+    Срезы хранятся в анатомическом порядке (от головы к ногам), номер среза в API -
+    позиция в этом порядке (с 1), capture_num - номер файла в папке captures
+    '''
+    slices: tp.List[SliceInfo] = pd.Field(default_factory=list)
+    geometry: SeriesGeometry = pd.Field(default_factory=SeriesGeometry)
+
+    @classmethod
+    def build(cls, metadata: tp.List[tp.Dict[str, tp.Any]]) -> 'SliceIndex':
+        slices = [SliceInfo.parse_obj(meta) for meta in metadata]
+        first = metadata[0] if metadata else {}
+        orientation = first.get('image_orientation')
+        positions = cls._positions_along_normal(slices, orientation)
+
+        if positions is not None:
+            ordered = sorted(zip(slices, positions), key=lambda item: (-item[1], item[0].capture_num))
+            slices = [info for info, _ in ordered]
+            spacing = cls._median_spacing(sorted(positions))
+        elif all(info.slice_location is not None for info in slices):
+            slices.sort(key=lambda info: (-info.slice_location, info.capture_num))
+            spacing = cls._median_spacing(sorted(info.slice_location for info in slices))
+        else:
+            slices.sort(key=lambda info: (info.instance_number is None, info.instance_number or 0, info.capture_num))
+            spacing = None
+
+        geometry = SeriesGeometry(
+            rows=first.get('rows'),
+            columns=first.get('columns'),
+            pixel_spacing=first.get('pixel_spacing'),
+            slice_thickness=first.get('slice_thickness'),
+            spacing_between_slices=spacing or first.get('slice_thickness'),
+            image_orientation=orientation,
+            window_center=first.get('window_center'),
+            window_width=first.get('window_width'),
+            rescale_slope=first.get('rescale_slope') or 1.0,
+            rescale_intercept=first.get('rescale_intercept') or 0.0,
+        )
+        return cls(slices=slices, geometry=geometry)
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> 'SliceIndex':
+        return cls.parse_file(path)
+
+    def save(self, path: pathlib.Path) -> None:
+        tmp_path = path.with_name(f'.{path.name}.tmp')
+        tmp_path.write_text(self.json())
+        tmp_path.replace(path)
+
+    @property
+    def count(self) -> int:
+        return len(self.slices)
+
+    def get_capture_num(self, slice_num: int) -> tp.Optional[int]:
+        '''
+        Номер файла среза по его позиции в анатомическом порядке (с 1)
+        '''
+        if not 1 <= slice_num <= self.count:
+            return None
+        return self.slices[slice_num - 1].capture_num
+
+    def middle(self) -> tp.Optional[int]:
+        '''
+        Позиция среднего среза серии
+        '''
+        if not self.count:
+            return None
+        return self.count // 2 + 1
+
+    @staticmethod
+    def _positions_along_normal(slices: tp.List[SliceInfo],
+                                orientation: tp.Optional[tp.List[float]]) -> tp.Optional[tp.List[float]]:
+        '''
+        Проекция ImagePositionPatient на нормаль к плоскости среза
+        '''
+        if orientation is None or len(orientation) != 6:
+            return None
+        if any(info.image_position is None or len(info.image_position) != 3 for info in slices):
+            return None
+        row, col = orientation[:3], orientation[3:]
+        normal = (row[1] * col[2] - row[2] * col[1],
+                  row[2] * col[0] - row[0] * col[2],
+                  row[0] * col[1] - row[1] * col[0])
+        return [sum(p * n for p, n in zip(info.image_position, normal)) for info in slices]
+
+    @staticmethod
+    def _median_spacing(positions: tp.List[float]) -> tp.Optional[float]:
+        diffs = [abs(b - a) for a, b in zip(positions, positions[1:]) if b != a]
+        return statistics.median(diffs) if diffs else None
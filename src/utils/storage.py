@@ -1,8 +1,13 @@
 import typing as tp
 import pathlib
 import shutil
+import os
 from functools import lru_cache
 from .crypto import generate_uuid
+from .cache import LRUCache
+from .slice_index import SliceIndex
+from .executors import run_cpu
+from . import volume
 
 
 class FileStorage:
@@ -52,4 +57,102 @@ class FileStorage:
 
     @staticmethod
     def _gen_foldername() -> str:
-        return str(generate_uuid())
\ No newline at end of file
+        return str(generate_uuid())
+
+class SliceIndexMixin:
+    '''
+    Доступ к срезам исследования через индекс срезов (index.json).
+    Загруженные индексы кэшируются в памяти процесса, поэтому обращение к срезу
+    не требует сканирования каталога. Указывается перед FileStorage в списке базовых классов
+    '''
+    _INDEX_FILENAME = 'index.json'
+    _indexes = LRUCache(maxsize=1024)
+
+    def get_index_path(self, foldername: str) -> pathlib.Path:
+        return self.get_path_to_folder(foldername).joinpath(self._INDEX_FILENAME)
+
+    def save_index(self, foldername: str, index: SliceIndex) -> None:
+        index_path = self.get_index_path(foldername)
+        index.save(index_path)
+        self._indexes.put(str(index_path), index)
+
+    def get_index(self, foldername: str) -> tp.Optional[SliceIndex]:
+        index_path = self.get_index_path(foldername)
+        index = self._indexes.get(str(index_path))
+        if index is not None:
+            return index
+        if not index_path.exists():
+            return None
+        index = SliceIndex.load(index_path)
+        self._indexes.put(str(index_path), index)
+        return index
+
+    def remove_folder(self, foldername) -> None:
+        self._indexes.pop(str(self.get_index_path(foldername)))
+        super().remove_folder(foldername)
+
+    def get_captures_count(self, foldername: str) -> tp.Optional[int]:
+        index = self.get_index(foldername)
+        if index is not None:
+            return index.count
+
+        # исследования, загруженные до появления индекса
+        if not self.is_exists(foldername):
+            return None
+        path = self.get_path_to_folder(foldername)
+        return len(os.listdir(path.joinpath(self._CAPTURES_FOLDER)))
+
+    def get_capture_path(self, foldername: str, capture_num: int) -> tp.Optional[pathlib.Path]:
+        '''
+        Путь к срезу по его позиции в анатомическом порядке (с 1)
+        '''
+        index = self.get_index(foldername)
+        if index is not None:
+            file_num = index.get_capture_num(capture_num)
+            if file_num is None:
+                return None
+            return self.get_path_to_folder(foldername).joinpath(self._CAPTURES_FOLDER, f'{file_num}.dcm')
+
+        if not self.is_exists(foldername):
+            return None
+        capture_path = self.get_path_to_folder(foldername).joinpath(self._CAPTURES_FOLDER, f'{capture_num}.dcm')
+        if not capture_path.exists():
+            return None
+        return capture_path
+
+
+class VolumeMixin:
+    '''
+    Объем серии (volume.npy + volume.json), собранный при загрузке по индексу срезов.
+    Используется вместе с SliceIndexMixin
+    '''
+    _VOLUME_FILENAME = 'volume.npy'
+
+    def get_volume_path(self, foldername: str) -> pathlib.Path:
+        return self.get_path_to_folder(foldername).joinpath(self._VOLUME_FILENAME)
+
+    def has_volume(self, foldername: str) -> bool:
+        return volume.Volume.exists(self.get_volume_path(foldername))
+
+    def get_volume(self, foldername: str) -> tp.Optional[volume.Volume]:
+        if not self.has_volume(foldername):
+            return None
+        return volume.Volume.open(self.get_volume_path(foldername))
+
+    async def build_volume(self, foldername: str) -> tp.Optional[volume.VolumeHeader]:
+        index = self.get_index(foldername)
+        if index is None:
+            return None
+        paths = [self.get_capture_path(foldername, i) for i in range(1, index.count + 1)]
+        return await run_cpu(volume.build_volume, paths, self.get_volume_path(foldername), index)
+
+    def get_slice_source(self, foldername: str, capture_num: int) -> tp.Optional[volume.SliceSource]:
+        '''
+        Источник пикселей среза: срез объема, если объем собран, иначе DICOM-файл
+        '''
+        capture_path = self.get_capture_path(foldername, capture_num)
+        if capture_path is None:
+            return None
+        if self.has_volume(foldername):
+            return volume.VolumeSlice(self.get_volume_path(foldername), capture_num)
+        return capture_path
@@ -0,0 +1,91 @@
+import typing as tp
+import pathlib
+import hashlib
+import math
+import shutil
+import os
+
+from PIL import Image
+
+from src import config
+from src.utils import rendering
+from src.utils.volume import SliceSource, read_slice
+
+
+class TilePyramid:
+    '''
+    Многоуровневая пирамида тайлов среза.
+    Уровень 0 - изображение, уменьшенное до одного тайла, последний уровень - исходное разрешение,
+    каждый следующий уровень в 2 раза больше предыдущего.
+    Структура на диске: {path}/{level}/{col}_{row}.{ext}, признак готовности - файл .done
+    '''
+    _DONE_MARKER = '.done'
+
+    def __init__(self, path: pathlib.Path, tile_size: int = config.tile_env.TILE_SIZE) -> None:
+        self._path = path
+        self.tile_size = tile_size
+
+    @staticmethod
+    def levels_count(width: int, height: int, tile_size: int = config.tile_env.TILE_SIZE) -> int:
+        return max(math.ceil(math.log2(max(width, height) / tile_size)), 0) + 1
+
+    def is_built(self) -> bool:
+        return self._path.joinpath(self._DONE_MARKER).exists()
+
+    def get_tile_path(self, level: int, col: int, row: int, image_format: str) -> tp.Optional[pathlib.Path]:
+        tile_path = self._path.joinpath(str(level), f'{col}_{row}.{image_format}')
+        if not tile_path.exists():
+            return None
+        return tile_path
+
+    def build(self, image: Image.Image, image_format: str, quality: int) -> None:
+        '''
+        Нарезка изображения на тайлы всех уровней. Пирамида собирается во временной папке
+        и переносится на место целиком, поэтому читатели не видят частично записанных уровней
+        '''
+        tmp_path = self._path.with_name(f'.{self._path.name}.{os.getpid()}.tmp')
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+        levels = self.levels_count(image.width, image.height, self.tile_size)
+        level_image = image
+        for level in reversed(range(levels)):
+            level_path = tmp_path.joinpath(str(level))
+            level_path.mkdir(parents=True)
+            for col in range(math.ceil(level_image.width / self.tile_size)):
+                for row in range(math.ceil(level_image.height / self.tile_size)):
+                    box = (col * self.tile_size, row * self.tile_size,
+                           min((col + 1) * self.tile_size, level_image.width),
+                           min((row + 1) * self.tile_size, level_image.height))
+                    level_image.crop(box).save(level_path.joinpath(f'{col}_{row}.{image_format}'),
+                                               format=image_format.upper(), quality=quality)
+            level_image = level_image.resize((max(level_image.width // 2, 1), max(level_image.height // 2, 1)),
+                                             Image.LANCZOS)
+        tmp_path.joinpath(self._DONE_MARKER).touch()
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            tmp_path.rename(self._path)
+        except OSError:
+            # пирамиду уже построил параллельный запрос
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def build_tile_pyramid(source: SliceSource,
+                       pyramid_path: pathlib.Path,
+                       window: tp.Optional[rendering.Window],
+                       image_format: str,
+                       quality: int) -> None:
+    '''
+    Отрисовка среза в исходном разрешении и построение пирамиды тайлов
+    (функция уровня модуля, чтобы ее можно было выполнять в пуле процессов)
+    '''
+    pixels, slope, intercept, file_window = read_slice(source)
+    image = rendering.render(pixels, slope, intercept, window or file_window)
+    TilePyramid(pyramid_path).build(Image.fromarray(image), image_format, quality)
+
+
+def make_etag(*parts: tp.Any) -> str:
+    '''
+    Сильный ETag: тайлы детерминированно строятся из неизменяемого среза и параметров
+    '''
+    return '"' + hashlib.sha1(repr(parts).encode()).hexdigest() + '"'
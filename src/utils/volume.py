@@ -0,0 +1,203 @@
+import typing as tp
+import pathlib
+import os
+
+import numpy as np
+import pydantic as pd
+
+from src.utils import rendering
+from src.utils.cache import LRUCache
+from src.utils.dicom import read_pixels
+from src.utils.slice_index import SliceIndex
+
+
+_HU_MIN, _HU_MAX = np.iinfo(np.int16).min, np.iinfo(np.int16).max
+
+
+class VolumeHeader(pd.BaseModel):
+    '''
+    Заголовок объема: размерность (срезы, строки, столбцы), шаг вокселя в мм (z, y, x),
+    ориентация, положение первого среза и окна срезов из исходных файлов
+    '''
+    shape: tp.Tuple[int, int, int]
+    dtype: str = 'int16'
+    spacing: tp.Tuple[float, float, float] = (1.0, 1.0, 1.0)
+    image_orientation: tp.Optional[tp.List[float]] = None
+    origin: tp.Optional[tp.List[float]] = None
+    windows: tp.List[tp.Optional[tp.Tuple[float, float]]] = pd.Field(default_factory=list)
+
+
+class VolumeSlice(tp.NamedTuple):
+    '''
+    Срез объема: путь к файлу объема и позиция среза в анатомическом порядке (с 1)
+    '''
+    path: pathlib.Path
+    slice_num: int
+
+
+class Volume:
+    '''
+    Серия в виде непрерывного массива int16 в единицах Хаунсфилда (срезы в анатомическом порядке).
+    Хранится в формате .npy рядом с заголовком .json и открывается через memmap:
+    чтение среза или плоскости MPR - чтение страниц файла без декодирования DICOM
+    '''
+    # Открытые объемы процесса: ключ - (путь, время изменения заголовка)
+    _opened = LRUCache(maxsize=32)
+
+    def __init__(self, voxels: np.ndarray, header: VolumeHeader) -> None:
+        self.voxels = voxels
+        self.header = header
+
+    @staticmethod
+    def get_header_path(path: pathlib.Path) -> pathlib.Path:
+        return path.with_suffix('.json')
+
+    @classmethod
+    def exists(cls, path: pathlib.Path) -> bool:
+        # заголовок записывается последним и служит признаком готовности
+        return cls.get_header_path(path).exists()
+
+    @classmethod
+    def open(cls, path: pathlib.Path) -> 'Volume':
+        header_path = cls.get_header_path(path)
+        key = (str(path), header_path.stat().st_mtime_ns)
+        volume = cls._opened.get(key)
+        if volume is None:
+            volume = cls(np.load(path, mmap_mode='r'), VolumeHeader.parse_file(header_path))
+            cls._opened.put(key, volume)
+        return volume
+
+    @property
+    def count(self) -> int:
+        return self.voxels.shape[0]
+
+    def plane_size(self, plane: str) -> int:
+        '''
+        Количество сечений по плоскости
+        '''
+        return {'axial': self.voxels.shape[0],
+                'coronal': self.voxels.shape[1],
+                'sagittal': self.voxels.shape[2]}[plane]
+
+    def axial(self, slice_num: int) -> np.ndarray:
+        return self.voxels[slice_num - 1]
+
+    def coronal(self, position: int) -> np.ndarray:
+        return self.voxels[:, position - 1, :]
+
+    def sagittal(self, position: int) -> np.ndarray:
+        return self.voxels[:, :, position - 1]
+
+    def window(self, slice_num: int) -> tp.Optional[rendering.Window]:
+        if not 1 <= slice_num <= len(self.header.windows):
+            return None
+        window = self.header.windows[slice_num - 1]
+        return rendering.Window(*window) if window is not None else None
+
+
+def build_volume(paths: tp.List[pathlib.Path], path: pathlib.Path, index: SliceIndex) -> tp.Optional[VolumeHeader]:
+    '''
+    Сборка объема из срезов, переданных в анатомическом порядке. Срезы переводятся в HU
+    по собственным RescaleSlope/RescaleIntercept и записываются в файл по одному,
+    поэтому весь объем в памяти не держится.
+    Возвращает None, если размеры срезов различаются
+    (функция уровня модуля, чтобы ее можно было выполнять в пуле процессов)
+    '''
+    if not paths:
+        return None
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    voxels = None
+    windows = []
+    try:
+        for num, slice_path in enumerate(paths):
+            pixels, slope, intercept, window = read_pixels(slice_path)
+            if voxels is None:
+                voxels = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.int16,
+                                                   shape=(len(paths), *pixels.shape))
+            if pixels.shape != voxels.shape[1:]:
+                return None
+            voxels[num] = np.clip(np.rint(pixels * np.float32(slope) + np.float32(intercept)), _HU_MIN, _HU_MAX)
+            windows.append(tuple(window) if window is not None else None)
+        voxels.flush()
+        shape = voxels.shape
+    finally:
+        del voxels
+        if len(windows) != len(paths):
+            tmp_path.unlink(missing_ok=True)
+
+    geometry = index.geometry
+    pixel_spacing = geometry.pixel_spacing or [1.0, 1.0]
+    header = VolumeHeader(
+        shape=shape,
+        spacing=(geometry.spacing_between_slices or 1.0, pixel_spacing[0], pixel_spacing[1]),
+        image_orientation=geometry.image_orientation,
+        origin=index.slices[0].image_position if index.slices else None,
+        windows=windows,
+    )
+    os.replace(tmp_path, path)
+    header_path = Volume.get_header_path(path)
+    tmp_header_path = header_path.with_name(f'.{header_path.name}.tmp')
+    tmp_header_path.write_text(header.json())
+    os.replace(tmp_header_path, header_path)
+    return header
+
+
+SliceSource = tp.Union[pathlib.Path, VolumeSlice]
+
+
+def read_slice(source: SliceSource) -> tp.Tuple[np.ndarray, float, float, tp.Optional[rendering.Window]]:
+    '''
+    Пиксели среза с параметрами перевода в HU и окном из файла:
+    из объема (значения уже в HU) или из DICOM-файла
+    '''
+    if isinstance(source, VolumeSlice):
+        volume = Volume.open(source.path)
+        return volume.axial(source.slice_num), 1.0, 0.0, volume.window(source.slice_num)
+    return read_pixels(source)
+
+
+def render_slice(source: SliceSource,
+                 window_center: tp.Optional[float] = None,
+                 window_width: tp.Optional[float] = None,
+                 size: tp.Optional[int] = None,
+                 image_format: str = 'jpeg',
+                 quality: int = 85) -> bytes:
+    '''
+    Отрисовка среза в изображение заданного формата.
+    Если окно не задано, используется окно из файла или диапазон значений среза
+    '''
+    pixels, slope, intercept, window = read_slice(source)
+    if window_center is not None and window_width is not None:
+        window = rendering.Window(window_center, window_width)
+    image = rendering.render(pixels, slope, intercept, window)
+    return rendering.encode(image, image_format, quality, size)
+
+
+def render_plane(path: pathlib.Path,
+                 plane: str,
+                 position: int,
+                 window_center: tp.Optional[float] = None,
+                 window_width: tp.Optional[float] = None,
+                 size: tp.Optional[int] = None,
+                 image_format: str = 'jpeg',
+                 quality: int = 85) -> bytes:
+    '''
+    Отрисовка корональной или сагиттальной реконструкции (position - номер сечения с 1).
+    Изображение растягивается по вертикали с учетом шага между срезами.
+    Если окно не задано, используется окно среднего среза серии или диапазон значений сечения
+    '''
+    volume = Volume.open(path)
+    if plane == 'coronal':
+        pixels = volume.coronal(position)
+        in_plane_spacing = volume.header.spacing[2]
+    else:
+        pixels = volume.sagittal(position)
+        in_plane_spacing = volume.header.spacing[1]
+
+    if window_center is not None and window_width is not None:
+        window = rendering.Window(window_center, window_width)
+    else:
+        window = volume.window(volume.count // 2 + 1)
+    image = rendering.render(pixels, 1.0, 0.0, window)
+    image = rendering.scale_height(image, volume.header.spacing[0] / in_plane_spacing)
+    return rendering.encode(image, image_format, quality, size)